@@ -0,0 +1,203 @@
+"""
+A local stand-in of the Stripe and fixer.io HTTP APIs, used by the benchmark commands.
+Implements only the endpoints used by the project, with an injected latency per request, and counts the calls.
+"""
+import itertools
+import json
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# endpoint name -> (method, path pattern)
+ENDPOINTS = {
+    'product_create': ('POST', r'/v1/products'),
+    'product_modify': ('POST', r'/v1/products/[^/]+'),
+    'price_create': ('POST', r'/v1/prices'),
+    'price_modify': ('POST', r'/v1/prices/[^/]+'),
+    'coupon_create': ('POST', r'/v1/coupons'),
+    'tax_rate_create': ('POST', r'/v1/tax_rates'),
+    'session_create': ('POST', r'/v1/checkout/sessions'),
+    'session_list': ('GET', r'/v1/checkout/sessions'),
+    'session_retrieve': ('GET', r'/v1/checkout/sessions/[^/]+'),
+    'fx_fetch': ('GET', r'/api/latest'),
+}
+
+FX_RATES = {'EUR': 1.0, 'RUB': 98.5, 'USD': 1.09, 'GBP': 0.86}
+
+
+class FakeAPIServer:
+    """
+    A threaded HTTP server faking the Stripe API (api_base: self.url) and the fixer.io API (self.url + '/api').
+    Every request is delayed by the latency (seconds), and counted by its endpoint name (see ENDPOINTS).
+    The created Checkout Sessions are paid with the paid_ratio probability (deterministically, by their number).
+    """
+
+    def __init__(self, latency: float = 0.0, paid_ratio: float = 0.5):
+        self.latency = latency
+        self.paid_ratio = paid_ratio
+        self.calls = Counter()
+        # the (monotonic) times of the calls
+        self.call_times = []
+        self.prices = {}
+        self.sessions = {}
+        # the fixer.io error returned instead of the rates, e.g. {'code': 104, 'type': 'usage_limit_reached'}
+        self.fx_error = None
+        # the number of the next calls of an endpoint answered with 503, e.g. {'fx_fetch': 1}
+        self.failures = Counter()
+        # the Idempotency-Key headers of the POST requests
+        self.idempotency_keys = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FakeAPIServer':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_calls(self) -> Counter:
+        """
+        Resets the calls counter and returns the counted calls.
+        """
+        with self._lock:
+            calls, self.calls, self.call_times = self.calls, Counter(), []
+        return calls
+
+    def _new_id(self, prefix: str) -> str:
+        return f'{prefix}_fake{next(self._ids)}'
+
+    def handle(self, method: str, path: str, params: dict) -> tuple[int, dict]:
+        """
+        Returns the (status code, JSON body) response of the fake API.
+        """
+        endpoint = next(
+            (name for name, (endpoint_method, pattern) in ENDPOINTS.items()
+             if endpoint_method == method and re.fullmatch(pattern, path)),
+            None)
+        if endpoint is None:
+            return 404, {'error': {'type': 'invalid_request_error', 'message': f'Unknown path {method} {path}'}}
+        with self._lock:
+            self.calls[endpoint] += 1
+            self.call_times.append(time.monotonic())
+            failed = self.failures[endpoint] > 0
+            if failed:
+                self.failures[endpoint] -= 1
+        time.sleep(self.latency)
+        if failed:
+            return 503, {'error': {'type': 'api_error', 'message': 'Service unavailable'}}
+
+        if endpoint == 'fx_fetch':
+            # fixer.io responds to the failed requests with 200 too
+            if self.fx_error is not None:
+                return 200, {'success': False, 'error': self.fx_error}
+            base = params.get('base', 'EUR')
+            symbols = params.get('symbols', ','.join(FX_RATES)).split(',')
+            rates = {symbol: FX_RATES[symbol] / FX_RATES[base] for symbol in symbols if symbol in FX_RATES}
+            return 200, {'success': True, 'base': base, 'rates': rates}
+        if endpoint in ('product_create', 'product_modify'):
+            product_id = path.rsplit('/', 1)[1] if endpoint == 'product_modify' else self._new_id('prod')
+            return 200, {'id': product_id, 'object': 'product', 'name': params.get('name'), 'active': True}
+        if endpoint in ('price_create', 'price_modify'):
+            if endpoint == 'price_modify':
+                return 200, {'id': path.rsplit('/', 1)[1], 'object': 'price', 'active': False}
+            price = {'id': self._new_id('price'), 'object': 'price', 'currency': params['currency'],
+                     'unit_amount': int(params['unit_amount']), 'active': True}
+            self.prices[price['id']] = price
+            return 200, price
+        if endpoint == 'coupon_create':
+            return 200, {'id': self._new_id('coupon'), 'object': 'coupon'}
+        if endpoint == 'tax_rate_create':
+            return 200, {'id': self._new_id('txr'), 'object': 'tax_rate'}
+        if endpoint == 'session_create':
+            return 200, self.create_session(params)
+        if endpoint == 'session_retrieve':
+            stripe_session = self.sessions.get(path.rsplit('/', 1)[1])
+            if stripe_session is None:
+                return 404, {'error': {'type': 'invalid_request_error', 'message': 'No such checkout session'}}
+            return 200, stripe_session
+        if endpoint == 'session_list':
+            data = [s for s in self.sessions.values() if s['status'] == params.get('status', s['status'])]
+            return 200, {'object': 'list', 'url': '/v1/checkout/sessions', 'has_more': False, 'data': data}
+
+    def create_session(self, params: dict) -> dict:
+        """
+        Creates a fake Checkout Session from the form-encoded line items (referenced prices or inline price_data).
+        """
+        amount_total, currency, index = 0, None, 0
+        while f'line_items[{index}][quantity]' in params:
+            quantity = int(params[f'line_items[{index}][quantity]'])
+            price_id = params.get(f'line_items[{index}][price]')
+            if price_id is not None:
+                price = self.prices.get(price_id, {'unit_amount': 0, 'currency': 'eur'})
+                unit_amount, currency = price['unit_amount'], price['currency']
+            else:
+                unit_amount = int(params[f'line_items[{index}][price_data][unit_amount]'])
+                currency = params[f'line_items[{index}][price_data][currency]']
+            amount_total += unit_amount * quantity
+            index += 1
+
+        number = next(self._ids)
+        is_paid = self.paid_ratio > 0 and number % max(1, round(1 / self.paid_ratio)) == 0
+        stripe_session = {
+            'id': f'cs_fake{number}',
+            'object': 'checkout.session',
+            'url': f'{self.url}/pay/cs_fake{number}',
+            'amount_total': amount_total,
+            'currency': currency,
+            'created': int(time.time()),
+            'status': 'complete' if is_paid else 'open',
+            'payment_status': 'paid' if is_paid else 'unpaid',
+        }
+        self.sessions[stripe_session['id']] = stripe_session
+        return stripe_session
+
+    def _make_handler(self):
+        fake_api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _respond(self, method: str) -> None:
+                url = urlparse(self.path)
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+                params = {key: values[0] for key, values in parse_qs(url.query + '&' + body).items()}
+                if method == 'POST':
+                    fake_api.idempotency_keys.append(self.headers.get('Idempotency-Key'))
+                status, data = fake_api.handle(method, url.path, params)
+                payload = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def do_POST(self):
+                self._respond('POST')
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -1,6 +1,8 @@
 import os
+import sys
 
 from celery import Celery
+from celery.signals import celeryd_init
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
@@ -9,3 +11,20 @@ app = Celery('config')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
 app.autodiscover_tasks()
+
+# connects the task metrics and tracing receivers
+import config.metrics  # noqa: E402,F401
+import config.tracing  # noqa: E402,F401
+
+
+@celeryd_init.connect
+def patch_psycopg_for_eventlet(**kwargs):
+    """
+    Makes the psycopg2 DB calls cooperative in a worker with the eventlet pool (celery worker -P eventlet),
+    so a task waiting for the DB does not block the other green threads.
+    """
+    if 'eventlet' in sys.modules:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('socket'):
+            from psycogreen.eventlet import patch_psycopg
+            patch_psycopg()
@@ -0,0 +1,130 @@
+"""
+Shared outbound HTTP clients of the Stripe and fixer.io integrations.
+Both clients keep a per-process pool of keep-alive connections, and have connect/read timeouts and retries.
+The stripe and requests packages take a half of the process start, so they are imported on the first use:
+the Stripe client is configured by the first get_stripe() call, and the processes which never call the APIs
+(e.g. the 'db' celery worker, celery-beat, the migrations) do not import them. The preloading production server
+sets both clients up before forking its workers (configure_clients(), see gunicorn.conf.py).
+"""
+import threading
+import time
+from typing import TYPE_CHECKING
+
+from config import settings
+
+if TYPE_CHECKING:
+    import requests
+    from urllib3 import Retry
+
+_fixer_session = None
+# the configured stripe module, see get_stripe
+_stripe = None
+_stripe_lock = threading.Lock()
+
+
+def make_pooled_session(pool_maxsize: int, max_retries: 'Retry | int' = 0) -> 'requests.Session':
+    """
+    Returns a requests.Session keeping up to pool_maxsize keep-alive connections per host.
+
+    :param pool_maxsize: the max number of the pooled connections per host.
+    :param max_retries: the urllib3 retry configuration of the session's requests.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize, max_retries=max_retries)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class RateLimiter:
+    """
+    A thread-safe limiter of the calls rate: acquire() blocks until the next call is allowed,
+    the calls are spaced by at least 1 / rate seconds.
+    """
+
+    def __init__(self, rate: float):
+        """
+        Initializes a RateLimiter instance.
+
+        :param rate: the max number of calls per second.
+        """
+        self.interval = 1 / rate
+        self.lock = threading.Lock()
+        self.next_call_at = time.monotonic()
+
+    def acquire(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            call_at = max(now, self.next_call_at)
+            self.next_call_at = call_at + self.interval
+        time.sleep(call_at - now)
+
+
+def configure_stripe(rate_limit: float = None) -> None:
+    """
+    Configures the global Stripe client: the API key, a pooled keep-alive HTTP session shared by all the threads,
+    the connect/read timeouts and the network retries.
+    Stripe retries the failed requests with an exponential backoff with jitter, and sends every POST request
+    (object creation) with an Idempotency-Key, which is reused by the retries, so retried writes are not duplicated.
+
+    :param rate_limit: the max number of the Stripe requests per second of the process, not limited if not passed.
+    """
+    global _stripe
+    import stripe
+    from config.stripe_clients import InstrumentedRequestsClient, RateLimitedRequestsClient
+
+    stripe.api_key = settings.STRIPE_API_KEY
+    stripe.api_base = settings.STRIPE_API_BASE
+    stripe.max_network_retries = settings.STRIPE_MAX_NETWORK_RETRIES
+    client_kwargs = {
+        'timeout': settings.STRIPE_TIMEOUT,
+        'session': make_pooled_session(pool_maxsize=settings.STRIPE_HTTP_POOL_MAXSIZE),
+    }
+    if rate_limit:
+        stripe.default_http_client = RateLimitedRequestsClient(RateLimiter(rate_limit), **client_kwargs)
+    else:
+        stripe.default_http_client = InstrumentedRequestsClient(**client_kwargs)
+    _stripe = stripe
+
+
+def get_stripe():
+    """
+    Returns the stripe module, imported and configured (see configure_stripe) on the first call in the process.
+    The Stripe API is called via the returned module: stripe = get_stripe(); stripe.Product.create(...)
+    """
+    if _stripe is None:
+        with _stripe_lock:
+            if _stripe is None:
+                configure_stripe()
+    return _stripe
+
+
+def get_fixer_session() -> 'requests.Session':
+    """
+    Returns the process-wide fixer.io HTTP session. The idempotent GET requests are retried on connection errors
+    and 429/5xx responses, with an exponential backoff with jitter.
+    """
+    global _fixer_session
+    if _fixer_session is None:
+        from urllib3 import Retry
+
+        retries = Retry(
+            total=settings.FIXER_MAX_RETRIES,
+            backoff_factor=0.5,
+            backoff_jitter=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=('GET',),
+        )
+        _fixer_session = make_pooled_session(pool_maxsize=4, max_retries=retries)
+    return _fixer_session
+
+
+def configure_clients() -> None:
+    """
+    Sets up the Stripe and the fixer.io clients at once, instead of on their first use.
+    """
+    get_stripe()
+    get_fixer_session()
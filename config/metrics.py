@@ -0,0 +1,207 @@
+"""
+The Prometheus metrics of the hot paths: the outbound Stripe and fixer.io requests (config.clients, order.utils),
+the views (MetricsMiddleware: the request duration and the number of the DB queries per view), the celery tasks
+(the runtime and the outcome per task) and the item page cache (item.cache). They are exposed in the Prometheus text
+format by the metrics view (/metrics), and by an HTTP server of each celery worker (WORKER_METRICS_PORT).
+With the PROMETHEUS_MULTIPROC_DIR environment variable set (an empty directory, before the process is started),
+every process of a server or a worker writes its metrics to the directory, and all of them are exposed together.
+"""
+import os
+import time
+from contextvars import ContextVar
+from urllib.parse import urlparse
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from celery.signals import task_postrun, task_prerun, worker_ready
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+    start_http_server,
+)
+
+from config.settings import METRICS_TOKEN, WORKER_METRICS_PORT
+
+DB_QUERIES_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+
+EXTERNAL_REQUEST_DURATION = Histogram(
+    'external_request_duration_seconds', 'Duration of the outbound API requests (every attempt of a retried one).',
+    ['service', 'operation', 'outcome'])
+CHECKOUT_SESSION_DURATION = Histogram(
+    'checkout_session_duration_seconds',
+    'Duration of the Stripe Checkout Session creation (ProjectStripeSession.make_session), all the Stripe calls.')
+FX_RATE_LOOKUP_DURATION = Histogram(
+    'fx_rate_lookup_duration_seconds', 'Duration of the currency rates lookups (order.utils.get_fx_rates).',
+    ['source'])
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Duration of the requests, until the response (or its stream) is returned.',
+    ['view', 'method', 'status'])
+HTTP_REQUEST_DB_QUERIES = Histogram(
+    'http_request_db_queries', 'Number of the DB queries per request.', ['view'], buckets=DB_QUERIES_BUCKETS)
+CELERY_TASK_DURATION = Histogram(
+    'celery_task_duration_seconds', 'Runtime of the celery tasks.', ['task', 'outcome'])
+ITEM_PAGE_CACHE_REQUESTS = Counter(
+    'item_page_cache_requests', 'Item page cache lookups (item.cache.get_item_card).', ['result'])
+
+# the DB queries counter of the current request, see MetricsMiddleware
+_db_queries: ContextVar[list[int] | None] = ContextVar('db_queries', default=None)
+# the start times of the running celery tasks, by task id
+_task_started_at = {}
+
+
+def get_metrics_registry() -> CollectorRegistry:
+    """
+    Returns the registry of the metrics of all the processes (in the multiprocess mode), or of this process.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def get_outcome(status_code: int | None) -> str:
+    """
+    Returns the outcome label of a response status code: '2xx', '4xx', ..., 'error' if there is no response.
+    """
+    return f'{status_code // 100}xx' if status_code else 'error'
+
+
+def get_stripe_operation(method: str, url: str) -> str:
+    """
+    Returns the operation label of a Stripe API request, the object ids are left out:
+    POST /v1/products -> 'products.create', GET /v1/checkout/sessions/cs_1 -> 'checkout.sessions.retrieve',
+    POST /v1/products/prod_1 -> 'products.update', POST /v1/checkout/sessions/cs_1/expire -> 'checkout.sessions.expire'.
+
+    :param method: the HTTP method.
+    :param url: the request url.
+    """
+    segments = [segment for segment in urlparse(url).path.split('/')[2:] if segment]
+    if len(segments) > 1 and segments[0] == 'checkout':
+        segments = [f'checkout.{segments[1]}', *segments[2:]]
+    if not segments:
+        return 'unknown'
+    resource, object_path = segments[0], segments[1:]
+    if len(object_path) > 1:
+        action = object_path[1]
+    else:
+        action = {
+            ('get', False): 'list', ('get', True): 'retrieve', ('post', False): 'create', ('post', True): 'update',
+        }.get((method.lower(), bool(object_path)), method.lower())
+    return f'{resource}.{action}'
+
+
+def observe_external_request(service: str, operation: str, started_at: float, status_code: int | None) -> None:
+    """
+    Records the duration and the outcome of an outbound API request.
+
+    :param service: 'stripe' or 'fixer'.
+    :param operation: the API operation (e.g. 'products.create').
+    :param started_at: the time.perf_counter() value before the request.
+    :param status_code: the response status code, None if the request has failed without a response.
+    """
+    EXTERNAL_REQUEST_DURATION.labels(service=service, operation=operation, outcome=get_outcome(status_code)).observe(
+        time.perf_counter() - started_at)
+
+
+def count_db_query(execute, sql, params, many, context):
+    """
+    A DB connection execute wrapper counting the queries of the current request (see MetricsMiddleware).
+    """
+    counter = _db_queries.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def add_db_queries_counter(sender, connection, **kwargs):
+    """
+    Adds the DB queries counter to every DB connection, once (the signal is sent on every reconnection).
+    """
+    if count_db_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_db_query)
+
+
+class MetricsMiddleware:
+    """
+    Records the duration and the number of the DB queries of the requests by view (the url name).
+    Serves both the sync and the async views without switching between threads and the event loop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counter, started_at = [0], time.perf_counter()
+        token = _db_queries.set(counter)
+        try:
+            response = self.get_response(request)
+        finally:
+            _db_queries.reset(token)
+        self.observe(request, response, started_at, counter[0])
+        return response
+
+    async def __acall__(self, request):
+        counter, started_at = [0], time.perf_counter()
+        token = _db_queries.set(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _db_queries.reset(token)
+        self.observe(request, response, started_at, counter[0])
+        return response
+
+    @staticmethod
+    def observe(request, response, started_at: float, db_queries: int) -> None:
+        view = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+        HTTP_REQUEST_DURATION.labels(view=view, method=request.method, status=response.status_code).observe(
+            time.perf_counter() - started_at)
+        HTTP_REQUEST_DB_QUERIES.labels(view=view).observe(db_queries)
+
+
+@require_GET
+def metrics(request):
+    """
+    Prometheus metrics endpoint: the metrics of all the server processes in the Prometheus text format.
+    If METRICS_TOKEN is set, the scraper must send it as the bearer token (Authorization: Bearer {METRICS_TOKEN}).
+
+    :param request: HTTP request object.
+    :return: the metrics, 401 if the token is not valid.
+    """
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return HttpResponse(status=401)
+    return HttpResponse(generate_latest(get_metrics_registry()), content_type=CONTENT_TYPE_LATEST)
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, **kwargs):
+    _task_started_at[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def observe_task(task_id=None, task=None, state=None, **kwargs):
+    """
+    Records the runtime and the outcome (the final state: 'SUCCESS', 'FAILURE', 'RETRY', ...) of a celery task.
+    """
+    started_at = _task_started_at.pop(task_id, None)
+    if started_at is not None:
+        CELERY_TASK_DURATION.labels(task=task.name, outcome=state or 'UNKNOWN').observe(
+            time.perf_counter() - started_at)
+
+
+@worker_ready.connect
+def start_worker_metrics_server(**kwargs):
+    """
+    Exposes the metrics of a celery worker (all its pool processes, in the multiprocess mode) on WORKER_METRICS_PORT.
+    """
+    if WORKER_METRICS_PORT:
+        start_http_server(WORKER_METRICS_PORT, registry=get_metrics_registry())
@@ -39,6 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'django_celery_beat',
 
@@ -48,6 +49,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'config.tracing.TracingMiddleware',
+    'config.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -137,11 +140,122 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 SMALLEST_CURRENCY_UNIT_RATIO = 100
 
 STRIPE_API_KEY = os.getenv('STRIPE_API_KEY')
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE', 'https://api.stripe.com')
+# Stripe (connect, read) timeouts, seconds, and the number of retries of the failed requests
+STRIPE_TIMEOUT = (5, 30)
+STRIPE_MAX_NETWORK_RETRIES = 2
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
+# Payment status polling is a fallback of the Stripe webhook, so it is run rarely, minutes
+PAYMENT_STATUS_CHECK_INTERVAL = 10
+# Stripe Checkout Session expiration period, seconds
+CHECKOUT_SESSION_EXPIRATION = 1800
+# The unpaid orders are set as 'expired' every ORDER_EXPIRY_INTERVAL minutes, PAYMENT_STATUS_CHECK_INTERVAL minutes
+# after their Checkout Session has expired, so a payment made right before the expiration is still found by the sweep
+ORDER_EXPIRY_INTERVAL = 5
+# If True, the checkout views save the order and return at once, the Checkout Session is created by a celery task,
+# and the browser waits for its url on a waiting page (see order.checkout). The waiting page's event stream
+# checks the order every CHECKOUT_WAIT_POLL_INTERVAL seconds for CHECKOUT_WAIT_TIMEOUT seconds, then reconnects
+CHECKOUT_DEFERRED = os.getenv('CHECKOUT_DEFERRED') == 'True'
+CHECKOUT_WAIT_TIMEOUT = 30
+CHECKOUT_WAIT_POLL_INTERVAL = 0.5
+# The Checkout Session of a deferred checkout is created by one task run at a time (a cache lock held for at most
+# CHECKOUT_SESSION_LOCK_TIMEOUT seconds), a task redelivered meanwhile (acks_late) is retried after the timeout
+CHECKOUT_SESSION_LOCK_TIMEOUT = 300
+# The sales rollups (order.rollups) are refreshed every SALES_ROLLUP_REFRESH_INTERVAL minutes, the orders paid within
+# SALES_ROLLUP_LATENESS seconds before the previous refresh are recounted
+SALES_ROLLUP_REFRESH_INTERVAL = 5
+SALES_ROLLUP_LATENESS = 600
+# The default period of the sales report, days
+SALES_REPORT_DEFAULT_DAYS = 7
+# The max number of the carts quoted by one POST request to the order quote endpoint (order.views.quote_order)
+QUOTE_MAX_CARTS = 100
+# Independent Stripe API calls of a checkout are run concurrently by a thread pool of STRIPE_MAX_WORKERS per process
+STRIPE_CONCURRENT_REQUESTS = True
+STRIPE_MAX_WORKERS = 8
+# The max number of the pooled keep-alive Stripe connections per process, is raised for the eventlet celery worker
+STRIPE_HTTP_POOL_MAXSIZE = int(os.getenv('STRIPE_HTTP_POOL_MAXSIZE', STRIPE_MAX_WORKERS * 2))
+# The bulk Stripe jobs (e.g. import_items --sync-stripe) send at most STRIPE_BULK_RATE_LIMIT requests per second
+# (the Stripe API allows 100 requests per second in live mode and 25 in test mode)
+STRIPE_BULK_RATE_LIMIT = 20
+# The currencies of the catalog items (fixer.io symbols), the first one is the items' default currency.
+# The mixed-currency carts are converted to BASE_CURRENCY, one of CURRENCIES
+CURRENCIES = os.getenv('CURRENCIES', 'RUB,EUR').upper().split(',')
+BASE_CURRENCY = os.getenv('BASE_CURRENCY', 'EUR').upper()
 FIXER_API_KEY = os.getenv('FIXER_API_KEY')
+FIXER_API_URL = os.getenv('FIXER_API_URL', 'http://data.fixer.io/api')
+# fixer.io (connect, read) timeouts, seconds, and the number of retries of the failed requests
+FIXER_TIMEOUT = (5, 10)
+FIXER_MAX_RETRIES = 2
+# The cached currency rates are fresh for FX_RATE_TTL seconds, then they are served stale while being refreshed.
+# The rates older than FX_RATE_MAX_STALENESS seconds are fetched synchronously, and are served only while
+# the fixer.io API fails.
+FX_RATE_TTL = 3600
+FX_RATE_MAX_STALENESS = 24 * 3600
+# The rendered item detail pages are cached per item version (see item.cache) for ITEM_PAGE_CACHE_TIMEOUT seconds
+ITEM_PAGE_CACHE_TIMEOUT = 24 * 3600
+# The item search (autocomplete) page size, and the minimum query length (the trigram index needs 3 characters)
+ITEM_SEARCH_PAGE_SIZE = 20
+ITEM_SEARCH_MIN_QUERY_LENGTH = 3
+# The catalog API (item.catalog_api) page size (default and max). The pages up to ITEM_API_CACHED_PAGE_SIZE items
+# are cached for ITEM_API_CACHE_TIMEOUT seconds, the larger ones are streamed
+ITEM_API_PAGE_SIZE = 100
+ITEM_API_MAX_PAGE_SIZE = 10000
+ITEM_API_CACHED_PAGE_SIZE = 1000
+ITEM_API_CACHE_TIMEOUT = 3600
+
+# The JSON Lines file the trace spans (config.tracing) are appended to, by all the processes. Tracing is off if not set
+TRACING_FILE = os.getenv('TRACING_FILE')
+# The /metrics endpoint (config.metrics) requires this bearer token if it is set.
+# The celery workers expose their metrics on WORKER_METRICS_PORT, if it is set
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+WORKER_METRICS_PORT = int(os.getenv('WORKER_METRICS_PORT', 0))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://redis:6379/1',
+    }
+}
 
 CELERY_BROKER_URL = 'redis://redis:6379/0'
 CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TIMEZONE = os.getenv('TIME_ZONE')
+# The Stripe and fixer.io I/O-bound tasks are routed to the 'io' queue, consumed by a worker with a high-concurrency
+# eventlet (green threads) pool, all the other (DB) tasks go to the 'db' queue, consumed by a prefork worker.
+# See the celery-io and celery services of docker-compose.yaml.
+CELERY_TASK_DEFAULT_QUEUE = 'db'
+CELERY_TASK_ROUTES = {
+    'item.tasks.sync_item_with_stripe': {'queue': 'io'},
+    'item.tasks.archive_stripe_product': {'queue': 'io'},
+    'order.tasks.create_checkout_session': {'queue': 'io'},
+    'order.tasks.set_payment_status': {'queue': 'io'},
+    'order.tasks.sweep_payment_statuses': {'queue': 'io'},
+    'order.tasks.refresh_fx_rates_task': {'queue': 'io'},
+}
+# All the tasks are idempotent, so they are acknowledged after they are run, and are redelivered if a worker dies.
+# A worker reserves one task per pool process (green thread) at most, so long tasks do not hold the queued ones back.
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_RESULT_EXPIRES = 24 * 3600
 DJANGO_CELERY_BEAT_TZ_AWARE = True
+CELERY_BEAT_SCHEDULE = {
+    'sweep-payment-statuses': {
+        'task': 'order.tasks.sweep_payment_statuses',
+        'schedule': PAYMENT_STATUS_CHECK_INTERVAL * 60,
+    },
+    'expire-orders': {
+        'task': 'order.tasks.expire_orders',
+        'schedule': ORDER_EXPIRY_INTERVAL * 60,
+    },
+    'refresh-sales-rollups': {
+        'task': 'order.tasks.refresh_sales_rollups_task',
+        'schedule': SALES_ROLLUP_REFRESH_INTERVAL * 60,
+    },
+    'refresh-fx-rates': {
+        'task': 'order.tasks.refresh_fx_rates_task',
+        'schedule': FX_RATE_TTL / 2,
+    },
+}
@@ -0,0 +1,45 @@
+"""
+The Stripe HTTP clients of config.clients.configure_stripe. Importing this module imports the stripe package,
+so it is imported by configure_stripe only, on the first use of the Stripe API (see config.clients.get_stripe).
+"""
+import time
+
+import stripe
+
+from config.clients import RateLimiter
+from config.metrics import get_stripe_operation, observe_external_request
+from config.tracing import span
+
+
+class InstrumentedRequestsClient(stripe.http_client.RequestsClient):
+    """
+    A Stripe HTTP client recording the duration and the outcome of every request (the retries included)
+    by the API operation (see config.metrics), and running it in a trace span (see config.tracing).
+    """
+
+    def _request_internal(self, method, url, *args, **kwargs):
+        operation = get_stripe_operation(method, url)
+        started_at, status_code = time.perf_counter(), None
+        with span(f'stripe {operation}') as current:
+            try:
+                content, status_code, headers = super()._request_internal(method, url, *args, **kwargs)
+                return content, status_code, headers
+            finally:
+                observe_external_request('stripe', operation, started_at, status_code)
+                if current is not None:
+                    current.attributes['status_code'] = status_code
+
+
+class RateLimitedRequestsClient(InstrumentedRequestsClient):
+    """
+    A Stripe HTTP client sending the requests (the retries included) at a limited rate,
+    so the bulk Stripe jobs stay under the Stripe API rate limit.
+    """
+
+    def __init__(self, rate_limiter: RateLimiter, **kwargs):
+        super().__init__(**kwargs)
+        self.rate_limiter = rate_limiter
+
+    def _request_internal(self, *args, **kwargs):
+        self.rate_limiter.acquire()
+        return super()._request_internal(*args, **kwargs)
@@ -0,0 +1,219 @@
+"""
+A lightweight tracing of the checkout timeline: the spans of the views (TracingMiddleware), the Stripe and fixer.io
+requests (config.clients, order.utils) and the celery tasks. The current span is kept in a context variable,
+so the nested spans (e.g. the Stripe requests of a view) are its children, and the trace context is sent to the celery
+tasks in the 'traceparent' message header (the W3C Trace Context format), so a task is a part of the trace of
+the request (or the task) which has queued it. The spans related to an order have its id in their 'order_id'
+attribute. The finished spans are appended to the TRACING_FILE JSON Lines file, shared by all the processes,
+the timeline of an order is rebuilt from it by the trace_order command. Tracing is off if TRACING_FILE is not set.
+"""
+import json
+import os
+import secrets
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from celery.signals import before_task_publish, task_postrun, task_prerun
+
+from config.settings import TRACING_FILE
+
+TRACEPARENT_HEADER = 'traceparent'
+
+_current_span: ContextVar['Span | None'] = ContextVar('current_span', default=None)
+# the spans of the running celery tasks and their context tokens, by task id
+_task_spans = {}
+_export_lock = threading.Lock()
+
+
+class Span:
+    """
+    A timed operation of a trace. A span without a parent is the root span of a new trace.
+    """
+
+    def __init__(self, name: str, parent: 'Span | None' = None, trace_id: str = None, parent_id: str = None,
+                 **attributes):
+        """
+        Initializes a Span instance and starts it.
+
+        :param name: the name of the operation.
+        :param parent: the parent span in this process.
+        :param trace_id: the trace id of a remote parent span (see parse_traceparent), if there is no parent.
+        :param parent_id: the span id of a remote parent span.
+        :param attributes: the attributes of the span (e.g. order_id).
+        """
+        self.trace_id = parent.trace_id if parent else trace_id or secrets.token_hex(16)
+        self.parent_id = parent.span_id if parent else parent_id
+        self.span_id = secrets.token_hex(8)
+        self.name = name
+        self.attributes = attributes
+        self.status = 'ok'
+        self.error = None
+        self.start_time = time.time()
+        self.started_at = time.perf_counter()
+
+    @property
+    def traceparent(self) -> str:
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+    def set_error(self, error: BaseException) -> None:
+        self.status = 'error'
+        self.error = f'{type(error).__name__}: {error}'[:500]
+
+    def finish(self) -> None:
+        """
+        Ends the span and appends it to TRACING_FILE.
+        """
+        duration = time.perf_counter() - self.started_at
+        record = {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_time': self.start_time,
+            'duration_ms': round(duration * 1000, 3),
+            'status': self.status,
+            'error': self.error,
+            'attributes': self.attributes,
+            'process': f'{socket.gethostname()}:{os.getpid()}',
+        }
+        line = json.dumps(record, default=str) + '\n'
+        with _export_lock, open(TRACING_FILE, 'a') as trace_file:
+            trace_file.write(line)
+
+
+def parse_traceparent(traceparent: str | None) -> tuple[str, str] | None:
+    """
+    Returns the trace id and the parent span id of a 'traceparent' header value, None if it is not valid.
+    """
+    parts = (traceparent or '').split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+
+def start_span(name: str, traceparent: str = None, **attributes) -> Span | None:
+    """
+    Starts a span, a child of the current span (or of the remote traceparent), and makes it the current span.
+    Use span() instead when the span ends in the same function.
+
+    :return: the span, None if tracing is off.
+    """
+    if not TRACING_FILE:
+        return None
+    remote_parent = parse_traceparent(traceparent) if traceparent else None
+    if remote_parent:
+        return Span(name, trace_id=remote_parent[0], parent_id=remote_parent[1], **attributes)
+    return Span(name, parent=_current_span.get(), **attributes)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Span | None]:
+    """
+    Runs the block in a span, a child of the current span. The exceptions raised by the block mark the span as failed.
+
+    :param name: the name of the operation.
+    :param attributes: the attributes of the span.
+    :return: the span, None if tracing is off.
+    """
+    current = start_span(name, **attributes)
+    if current is None:
+        yield None
+        return
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.finish()
+
+
+def set_span_attributes(**attributes) -> None:
+    """
+    Sets the attributes of the current span (e.g. the order_id of a checkout request), if there is one.
+    """
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+class TracingMiddleware:
+    """
+    Runs every request in a root span named by the view (the url name), with the method and the status code.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with span('http', method=request.method, path=request.path) as current:
+            response = self.get_response(request)
+            self.describe(current, request, response)
+        return response
+
+    async def __acall__(self, request):
+        with span('http', method=request.method, path=request.path) as current:
+            response = await self.get_response(request)
+            self.describe(current, request, response)
+        return response
+
+    @staticmethod
+    def describe(current: Span | None, request, response) -> None:
+        if current is not None:
+            view = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+            current.name = f'{request.method} {view}'
+            current.attributes['status_code'] = response.status_code
+            if response.status_code >= 500:
+                current.status = 'error'
+
+
+@before_task_publish.connect
+def inject_trace_context(headers=None, **kwargs):
+    """
+    Sends the current trace context with a queued celery task.
+    """
+    current = _current_span.get()
+    if current is not None and headers is not None:
+        headers[TRACEPARENT_HEADER] = current.traceparent
+
+
+@task_prerun.connect
+def start_task_span(task_id=None, task=None, args=None, kwargs=None, **extra):
+    """
+    Starts the span of a celery task run, a child of the span which has queued it.
+    """
+    request = task.request
+    traceparent = request.get(TRACEPARENT_HEADER) or (request.headers or {}).get(TRACEPARENT_HEADER)
+    current = start_span(f'task {task.name}', traceparent=traceparent, task_id=task_id, retries=request.retries)
+    if current is not None:
+        _task_spans[task_id] = (current, _current_span.set(current))
+
+
+@task_postrun.connect
+def finish_task_span(task_id=None, state=None, retval=None, **extra):
+    """
+    Ends the span of a celery task run, with its final state.
+    """
+    current, token = _task_spans.pop(task_id, (None, None))
+    if current is None:
+        return
+    _current_span.reset(token)
+    current.attributes['state'] = state
+    if state == 'FAILURE':
+        current.status = 'error'
+        if isinstance(retval, BaseException):
+            current.set_error(retval)
+    current.finish()
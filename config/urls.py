@@ -15,10 +15,16 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
+from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 from django.urls import path, include
 
+from config.metrics import metrics
+
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics, name='metrics'),
     path('', include('item.urls', namespace='items')),
     path('', include('order.urls', namespace='orders')),
 ]
+# the static files are served by the app server (e.g. gunicorn, see gunicorn.conf.py) if DEBUG only
+urlpatterns += staticfiles_urlpatterns()
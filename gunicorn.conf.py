@@ -0,0 +1,60 @@
+"""
+The production server of the app (the app service of docker-compose.yaml): gunicorn runs a master process
+which loads the app once (preload_app) and forks the workers, gthread workers by default: the sync views,
+which wait for the Stripe API, are served by a pool of threads per worker (GUNICORN_THREADS).
+The modules loaded by the master are shared by the workers (copy-on-write), and a restarted worker is forked
+from the loaded master instead of loading the app again.
+For the ASGI server (the checkout event streams hold no thread while waiting, the async checkout views run their
+Stripe calls in executor threads, but the sync views are run one at a time per worker):
+GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn
+See the bench_startup command for the time to the first request of the server and the celery workers.
+"""
+import gc
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+# the ASGI app for the uvicorn workers, the WSGI app for the others
+wsgi_app = 'config.asgi:application' if 'uvicorn' in worker_class.lower() else 'config.wsgi:application'
+# the threads of a gthread worker: the hot sync views spend most of their time waiting for Stripe,
+# so a worker serves more concurrent requests than it has CPU time for
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'True') == 'True'
+# the workers are recycled (forked from the preloaded master again) after max_requests, so no worker grows for ever
+max_requests = 1000
+max_requests_jitter = 100
+# the checkout event streams are up to CHECKOUT_WAIT_TIMEOUT (30 seconds) long, holding a gthread thread
+timeout = 60
+graceful_timeout = 35
+keepalive = 5
+accesslog = '-'
+
+
+def when_ready(server):
+    """
+    The app is loaded (if preload_app), the workers are not forked yet: the parts of the app which are loaded
+    on the first use (the url patterns and the views, the Stripe and fixer.io clients) are loaded once here.
+    """
+    if not preload_app:
+        return
+    from django.urls import get_resolver
+
+    from config.clients import configure_clients
+
+    # imports all the views
+    get_resolver().url_patterns
+    configure_clients()
+    # the loaded objects are moved to the permanent generation, so the garbage collections of the workers
+    # do not write to their memory pages and do not make the workers copy them
+    gc.freeze()
+
+
+def child_exit(server, worker):
+    """
+    Removes the live metrics of an exited worker (see config.metrics).
+    """
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
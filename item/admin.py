@@ -1,10 +1,91 @@
+from decimal import Decimal
+
+from django import forms
 from django.contrib import admin
 
-from item.models import Item
+from item.models import Item, ItemStripePrice, get_currency_choices
+
+
+class IdSearchMixin:
+    """
+    Searches the changelist by the exact id if the search term is a number, in addition to the search_fields.
+    Unlike the 'id' search field (an icontains lookup on the id cast to text), the lookup uses the primary key index.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        search_term = search_term.strip()
+        if search_term.isdigit():
+            results |= queryset.filter(pk=int(search_term))
+        return results, may_have_duplicates
+
+
+class PriceRangeFilter(admin.SimpleListFilter):
+    """
+    Filters the items by a price range (uses the item_price_idx index), instead of listing every distinct price.
+    """
+    title = 'price'
+    parameter_name = 'price_range'
+    # the lookup value -> (the lowest price, the highest price exclusive)
+    PRICE_RANGES = {
+        '0-100': (Decimal(0), Decimal(100)),
+        '100-1000': (Decimal(100), Decimal(1000)),
+        '1000-10000': (Decimal(1000), Decimal(10000)),
+        '10000-': (Decimal(10000), None),
+    }
+
+    def lookups(self, request, model_admin):
+        return [
+            (value, f'{low} - {high}' if high is not None else f'{low} and more')
+            for value, (low, high) in self.PRICE_RANGES.items()
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() not in self.PRICE_RANGES:
+            return queryset
+        low, high = self.PRICE_RANGES[self.value()]
+        queryset = queryset.filter(price__gte=low)
+        if high is not None:
+            queryset = queryset.filter(price__lt=high)
+        return queryset
+
+
+class CurrencyFilter(admin.SimpleListFilter):
+    """
+    Filters the items by one of the CURRENCIES, which are not the choices of the field, without a query of
+    the distinct currencies of the table.
+    """
+    title = 'currency'
+    parameter_name = 'currency'
+
+    def lookups(self, request, model_admin):
+        return get_currency_choices()
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        return queryset.filter(currency=self.value())
+
+
+class ItemStripePriceInline(admin.TabularInline):
+    model = ItemStripePrice
+    fields = ('stripe_price_id', 'unit_amount', 'currency', 'tax_behavior',)
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
 
 
 @admin.register(Item)
-class AdminItem(admin.ModelAdmin):
+class AdminItem(IdSearchMixin, admin.ModelAdmin):
     list_display = ('id', 'name', 'price', 'currency',)
-    list_filter = ('price', 'currency',)
-    search_fields = ('id', 'name', 'description')
+    list_filter = (PriceRangeFilter, CurrencyFilter,)
+    # icontains lookups on UPPER(name) and UPPER(description), use the trigram indexes
+    search_fields = ('name', 'description')
+    readonly_fields = ('stripe_product_id', 'stripe_product_name',)
+    inlines = (ItemStripePriceInline,)
+
+    def formfield_for_dbfield(self, db_field, request, **kwargs):
+        if db_field.name == 'currency':
+            choices = get_currency_choices()
+            return forms.ChoiceField(label=db_field.verbose_name, choices=choices, initial=choices[0][0])
+        return super().formfield_for_dbfield(db_field, request, **kwargs)
@@ -0,0 +1,177 @@
+"""
+The cache of the rendered item detail pages (item.views.get_item).
+The item card (everything but the per-user form with the CSRF token) is rendered once per item version,
+the version is the item's updated_at time. The current versions are kept in the cache as well, they are updated by
+the item.signals receivers when an item is saved or deleted, so a page is served without any DB query.
+The JSON catalog API (item.catalog_api) caches its list pages per catalog version, which changes on every
+item change, and its item documents per item version.
+"""
+import hashlib
+import uuid
+from datetime import datetime
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe, SafeString
+
+from config.metrics import ITEM_PAGE_CACHE_REQUESTS
+from config.settings import ITEM_PAGE_CACHE_TIMEOUT
+from item.models import Item
+
+ITEM_PAGE_STATS = ('hits', 'misses')
+
+
+def get_item_version_cache_key(item_id: int) -> str:
+    return f'item_page:{item_id}:version'
+
+
+def get_item_card_cache_key(item_id: int, version: datetime) -> str:
+    return f'item_page:{item_id}:card:{version.timestamp()}'
+
+
+def get_catalog_version_cache_key() -> str:
+    return 'item_api:catalog_version'
+
+
+def get_item_page_stats_cache_key(name: str) -> str:
+    return f'item_page:stats:{name}'
+
+
+def set_item_version(item: Item) -> None:
+    """
+    Sets the item's current version, so the previously cached card of the item is not used anymore.
+
+    :param item: an item.Item instance.
+    """
+    cache.set(get_item_version_cache_key(item.pk), item.updated_at, timeout=ITEM_PAGE_CACHE_TIMEOUT)
+
+
+def delete_item_version(item_id: int) -> None:
+    """
+    Deletes the item's current version, so the cached card of the item is not used anymore.
+
+    :param item_id: the id of an item.Item instance.
+    """
+    cache.delete(get_item_version_cache_key(item_id))
+
+
+def delete_item_versions(item_ids: list[int]) -> None:
+    """
+    Deletes the current versions of many items at once (e.g. after a bulk write, which sends no signals).
+
+    :param item_ids: the ids of item.Item instances.
+    """
+    cache.delete_many([get_item_version_cache_key(item_id) for item_id in item_ids])
+
+
+def get_item_version(item_id: int) -> datetime | None:
+    """
+    Returns the item's current version (its updated_at time). It is looked up in the DB only if it is not cached.
+
+    :param item_id: the id of an item.Item instance.
+    :return: the item's version, None if the item does not exist.
+    """
+    version = cache.get(get_item_version_cache_key(item_id))
+    if version is None:
+        version = Item.objects.filter(pk=item_id).values_list('updated_at', flat=True).first()
+        if version is not None:
+            cache.set(get_item_version_cache_key(item_id), version, timeout=ITEM_PAGE_CACHE_TIMEOUT)
+    return version
+
+
+def get_item_card(item_id: int, version: datetime) -> SafeString | None:
+    """
+    Returns the item's card (item/item_card.html) of the version, rendered once and cached.
+    Counts the cache hits and misses (see get_item_page_stats).
+
+    :param item_id: the id of an item.Item instance.
+    :param version: the item's version (see get_item_version).
+    :return: the rendered card, None if the item does not exist.
+    """
+    card = cache.get(get_item_card_cache_key(item_id, version))
+    if card is not None:
+        count_item_page_stat('hits')
+        return mark_safe(card)
+
+    count_item_page_stat('misses')
+    item = Item.objects.filter(pk=item_id).first()
+    if item is None:
+        return None
+    card = render_to_string('item/item_card.html', {'item': item})
+    # the card is stored by the version of the rendered row, which may be newer than the requested version
+    cache.set(get_item_card_cache_key(item_id, item.updated_at), str(card), timeout=ITEM_PAGE_CACHE_TIMEOUT)
+    return mark_safe(card)
+
+
+def get_item_etag(request, item_id: int) -> str | None:
+    """
+    Returns the ETag of the item's detail page: a hash of the item's version and the user's CSRF secret
+    (the page's form has a CSRF token, so a page can be reused only with the same CSRF cookie).
+
+    :param request: HTTP request object.
+    :param item_id: the id of an item.Item instance.
+    :return: the ETag, None if the item does not exist.
+    """
+    version = get_item_version(item_id)
+    if version is None:
+        return None
+    etag_source = f"{item_id}:{version.isoformat()}:{request.META.get('CSRF_COOKIE', '')}"
+    return hashlib.md5(etag_source.encode()).hexdigest()
+
+
+def get_item_last_modified(request, item_id: int) -> datetime | None:
+    """
+    Returns the Last-Modified time of the item's detail page (the item's version).
+
+    :param request: HTTP request object.
+    :param item_id: the id of an item.Item instance.
+    """
+    return get_item_version(item_id)
+
+
+def get_catalog_version() -> str:
+    """
+    Returns the current version of the whole catalog, an opaque token changed by bump_catalog_version.
+    """
+    version = cache.get(get_catalog_version_cache_key())
+    if version is None:
+        cache.add(get_catalog_version_cache_key(), uuid.uuid4().hex, timeout=None)
+        version = cache.get(get_catalog_version_cache_key())
+    return version
+
+
+def bump_catalog_version() -> None:
+    """
+    Sets a new version of the whole catalog, so the cached catalog API list pages are not used anymore.
+    """
+    cache.set(get_catalog_version_cache_key(), uuid.uuid4().hex, timeout=None)
+
+
+def count_item_page_stat(name: str) -> None:
+    """
+    Increments the item page cache counter ('hits' or 'misses'), shared by all the processes,
+    and the item_page_cache_requests metric.
+    """
+    ITEM_PAGE_CACHE_REQUESTS.labels(result=name).inc()
+    cache_key = get_item_page_stats_cache_key(name)
+    if not cache.add(cache_key, 1, timeout=None):
+        try:
+            cache.incr(cache_key)
+        except ValueError:
+            # the counter has been evicted or reset meanwhile
+            cache.add(cache_key, 1, timeout=None)
+
+
+def get_item_page_stats() -> dict:
+    """
+    Returns the item page cache counters: {'hits': int, 'misses': int}.
+    """
+    stats = cache.get_many([get_item_page_stats_cache_key(name) for name in ITEM_PAGE_STATS])
+    return {name: stats.get(get_item_page_stats_cache_key(name), 0) for name in ITEM_PAGE_STATS}
+
+
+def reset_item_page_stats() -> None:
+    """
+    Resets the item page cache counters.
+    """
+    cache.delete_many([get_item_page_stats_cache_key(name) for name in ITEM_PAGE_STATS])
@@ -0,0 +1,163 @@
+"""
+The read-only JSON catalog API (item.views.list_items_api and item.views.get_item_api).
+The list is paginated by a keyset cursor (the last item id of the previous page), so a page costs the same whatever
+its position in the catalog. The fields of the items can be selected with the 'fields' parameter.
+The list pages are cached per catalog version, the item documents per item version (see item.cache), and both
+have an ETag based on the versions, so a client revalidating a page gets 304 Not Modified without any DB query.
+The pages larger than ITEM_API_CACHED_PAGE_SIZE are not cached, they are serialized and sent as a stream.
+"""
+import hashlib
+import json
+from datetime import datetime
+from itertools import islice
+from typing import Iterator, NamedTuple
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+from config.settings import ITEM_API_PAGE_SIZE, ITEM_API_MAX_PAGE_SIZE, ITEM_API_CACHE_TIMEOUT
+from item.cache import get_catalog_version, get_item_version
+from item.models import Item
+
+ITEM_API_FIELDS = ('id', 'name', 'description', 'price', 'currency', 'updated_at')
+# the number of rows serialized at once when a page is streamed
+STREAM_CHUNK_SIZE = 500
+
+
+class CatalogQueryError(Exception):
+    pass
+
+
+class CatalogQuery(NamedTuple):
+    """
+    A catalog list page: the items with an id greater than cursor (0 for the first page), limit items at most.
+    """
+    cursor: int
+    limit: int
+    fields: tuple[str, ...]
+
+
+def parse_fields(request) -> tuple[str, ...]:
+    """
+    Returns the fields selected by the comma-separated 'fields' GET parameter, all the ITEM_API_FIELDS by default.
+    """
+    fields = tuple(field.strip() for field in request.GET.get('fields', '').split(',') if field.strip())
+    unknown_fields = [field for field in fields if field not in ITEM_API_FIELDS]
+    if unknown_fields:
+        raise CatalogQueryError(f'Unknown fields {unknown_fields}, the fields are {list(ITEM_API_FIELDS)}')
+    return fields or ITEM_API_FIELDS
+
+
+def parse_catalog_query(request) -> CatalogQuery:
+    """
+    Parses the 'cursor', 'limit' and 'fields' GET parameters of a catalog list request.
+
+    :param request: HTTP request object.
+    :return: a CatalogQuery instance.
+    """
+    try:
+        cursor = int(request.GET.get('cursor', 0))
+        limit = int(request.GET.get('limit', ITEM_API_PAGE_SIZE))
+    except ValueError:
+        raise CatalogQueryError('cursor and limit must be integers')
+    if cursor < 0 or not 1 <= limit <= ITEM_API_MAX_PAGE_SIZE:
+        raise CatalogQueryError(f'cursor must not be negative, limit must be between 1 and {ITEM_API_MAX_PAGE_SIZE}')
+    return CatalogQuery(cursor=cursor, limit=limit, fields=parse_fields(request))
+
+
+def get_catalog_page_cache_key(version: str, query: CatalogQuery) -> str:
+    return f"item_api:page:{version}:{query.cursor}:{query.limit}:{','.join(query.fields)}"
+
+
+def get_catalog_item_cache_key(item_id: int, version: datetime, fields: tuple[str, ...]) -> str:
+    return f"item_api:item:{item_id}:{version.timestamp()}:{','.join(fields)}"
+
+
+def get_catalog_page_etag(request) -> str | None:
+    """
+    Returns the ETag of a catalog list page: a hash of the catalog version and the page parameters.
+    None if the parameters are invalid.
+    """
+    try:
+        query = parse_catalog_query(request)
+    except CatalogQueryError:
+        return None
+    return hashlib.md5(get_catalog_page_cache_key(get_catalog_version(), query).encode()).hexdigest()
+
+
+def get_catalog_item_etag(request, item_id: int) -> str | None:
+    """
+    Returns the ETag of a catalog item document: a hash of the item's version and the selected fields.
+    None if the item does not exist or the fields are invalid.
+    """
+    version = get_item_version(item_id)
+    if version is None:
+        return None
+    try:
+        fields = parse_fields(request)
+    except CatalogQueryError:
+        return None
+    return hashlib.md5(get_catalog_item_cache_key(item_id, version, fields).encode()).hexdigest()
+
+
+def iter_catalog_page(query: CatalogQuery) -> Iterator[str]:
+    """
+    Serializes a catalog list page piece by piece: {"results": [{...}, ...], "next_cursor": int | null}.
+    The rows are fetched from the DB in chunks, one extra row tells whether there is a next page.
+
+    :param query: a CatalogQuery instance.
+    :return: an iterator of the JSON document pieces.
+    """
+    # the id is always fetched, it is the next page cursor
+    columns = ('id',) + tuple(field for field in query.fields if field != 'id')
+    rows = Item.objects.filter(pk__gt=query.cursor).order_by('pk').values_list(*columns)[:query.limit + 1].iterator(
+        chunk_size=STREAM_CHUNK_SIZE)
+
+    yield '{"results": ['
+    last_id, count, has_next = None, 0, False
+    while chunk := list(islice(rows, STREAM_CHUNK_SIZE)):
+        if count + len(chunk) > query.limit:
+            chunk, has_next = chunk[:query.limit - count], True
+        if chunk:
+            pieces = [
+                json.dumps({field: value for field, value in zip(columns, row) if field in query.fields},
+                           cls=DjangoJSONEncoder)
+                for row in chunk
+            ]
+            yield (', ' if count else '') + ', '.join(pieces)
+            last_id, count = chunk[-1][0], count + len(chunk)
+    yield f'], "next_cursor": {json.dumps(last_id if has_next else None)}}}'
+
+
+def get_catalog_page(query: CatalogQuery) -> str:
+    """
+    Returns a catalog list page as a JSON document, cached per catalog version.
+    """
+    cache_key = get_catalog_page_cache_key(get_catalog_version(), query)
+    page = cache.get(cache_key)
+    if page is None:
+        page = ''.join(iter_catalog_page(query))
+        cache.set(cache_key, page, timeout=ITEM_API_CACHE_TIMEOUT)
+    return page
+
+
+def get_catalog_item(item_id: int, fields: tuple[str, ...]) -> str | None:
+    """
+    Returns a catalog item document (the selected fields of the item) as JSON, cached per item version.
+
+    :param item_id: the id of an item.Item instance.
+    :param fields: the selected fields (see parse_fields).
+    :return: the JSON document, None if the item does not exist.
+    """
+    version = get_item_version(item_id)
+    if version is None:
+        return None
+    cache_key = get_catalog_item_cache_key(item_id, version, fields)
+    document = cache.get(cache_key)
+    if document is None:
+        values = Item.objects.filter(pk=item_id).values(*fields).first()
+        if values is None:
+            return None
+        document = json.dumps(values, cls=DjangoJSONEncoder)
+        cache.set(cache_key, document, timeout=ITEM_API_CACHE_TIMEOUT)
+    return document
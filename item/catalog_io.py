@@ -0,0 +1,233 @@
+"""
+Streaming bulk import and export of the item catalog (see the import_items and export_items commands).
+The catalog is read and written row by row as CSV (with a header row) or JSON Lines, and is written to the DB in
+chunks, so the memory used does not depend on the catalog size. The columns are ITEM_COLUMNS, 'id' is optional
+on import: the rows with an id are upserted (created or updated), the rows without an id are created.
+Bulk writes send no signals, so the imported items' page cache versions and the catalog version are reset here,
+and their Stripe catalog is synced by sync_items_with_stripe (or on their first checkout).
+"""
+import csv
+import json
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from typing import IO, TYPE_CHECKING, Callable, Iterable, Iterator, NamedTuple
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import QuerySet
+
+from config.clients import get_stripe
+
+from item.cache import bump_catalog_version, delete_item_versions
+from item.models import Item, get_currency_choices
+from item.service import ItemStripeCatalog
+from order.service import run_closing_db_connections
+
+if TYPE_CHECKING:
+    import stripe
+
+ITEM_COLUMNS = ('id', 'name', 'description', 'price', 'currency')
+ITEM_UPSERT_FIELDS = ('name', 'description', 'price', 'currency', 'updated_at')
+FILE_FORMATS = ('csv', 'jsonl')
+ITEM_CURRENCIES = [currency for currency, _ in get_currency_choices()]
+MAX_PRICE = Decimal(10) ** (Item._meta.get_field('price').max_digits - Item._meta.get_field('price').decimal_places)
+
+
+class CatalogImportError(Exception):
+    pass
+
+
+class ImportResult(NamedTuple):
+    created: int
+    updated: int
+    skipped: int
+
+
+def get_file_format(path: str, file_format: str = None) -> str:
+    """
+    Returns the catalog file format: the passed one, otherwise 'jsonl' for the .jsonl and .ndjson files, else 'csv'.
+    """
+    if file_format is not None:
+        return file_format
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def read_rows(file: IO[str], file_format: str) -> Iterator[dict | str]:
+    """
+    Reads the catalog rows one by one. The JSON Lines rows are not decoded here, but by parse_item,
+    so an invalid line is skipped like the other invalid rows.
+
+    :param file: a text file object (opened with newline='' for CSV).
+    :param file_format: 'csv' or 'jsonl'.
+    :return: an iterator of the rows: dicts (CSV) or the lines (JSON Lines).
+    """
+    if file_format == 'csv':
+        yield from csv.DictReader(file)
+        return
+    for line in file:
+        if line.strip():
+            yield line
+
+
+def parse_item(row: dict | str, row_number: int) -> Item:
+    """
+    Makes an unsaved item.Item instance of a catalog row.
+
+    :param row: a catalog row (see ITEM_COLUMNS), or a JSON Lines line of it (see read_rows).
+    :param row_number: the row's number in the file, used in the error messages.
+    :return: an item.Item instance, its pk is set if the row has an id.
+    """
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except json.JSONDecodeError as e:
+            raise CatalogImportError(f'Row {row_number}: invalid JSON: {e}')
+    if not isinstance(row, dict):
+        raise CatalogImportError(f'Row {row_number}: invalid item {row!r}, an object is expected')
+    try:
+        item_id = row.get('id')
+        item = Item(
+            id=int(item_id) if item_id not in (None, '') else None,
+            name=str(row['name']).strip(),
+            description=str(row.get('description') or ''),
+            price=Decimal(str(row['price'])).quantize(Decimal('0.01')),
+            currency=str(row.get('currency') or ITEM_CURRENCIES[0]).lower(),
+        )
+    except (KeyError, TypeError, ValueError, InvalidOperation) as e:
+        raise CatalogImportError(f'Row {row_number}: invalid item {row}: {e!r}')
+
+    if not item.name or len(item.name) > Item._meta.get_field('name').max_length:
+        raise CatalogImportError(f'Row {row_number}: invalid name {item.name!r}')
+    if not item.price.is_finite() or not 0 <= item.price < MAX_PRICE:
+        raise CatalogImportError(f'Row {row_number}: invalid price {item.price}')
+    if item.currency not in ITEM_CURRENCIES:
+        raise CatalogImportError(f'Row {row_number}: invalid currency {item.currency!r}')
+    return item
+
+
+def reset_item_id_sequence() -> None:
+    """
+    Moves the item ids sequence past the max item id, so it does not collide with the imported explicit ids.
+    """
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [Item]):
+            cursor.execute(sql)
+
+
+def import_chunk(items: list[Item]) -> tuple[int, int]:
+    """
+    Writes a chunk of items in a transaction: the items with a pk are upserted with one
+    INSERT ... ON CONFLICT DO UPDATE (the last one of a pk wins), then the items without a pk are created with one
+    INSERT. The ids sequence is moved past the upserted ids first, so the created items do not take them.
+
+    :param items: a list of unsaved item.Item instances.
+    :return: a tuple of the numbers of the created and updated items.
+    """
+    new_items = [item for item in items if item.pk is None]
+    upserted_items = list({item.pk: item for item in items if item.pk is not None}.values())
+    existing_ids = set()
+    with transaction.atomic():
+        if upserted_items:
+            existing_ids = set(Item.objects.filter(
+                pk__in=[item.pk for item in upserted_items]).values_list('pk', flat=True))
+            Item.objects.bulk_create(
+                upserted_items, update_conflicts=True, unique_fields=['id'], update_fields=ITEM_UPSERT_FIELDS)
+            reset_item_id_sequence()
+        Item.objects.bulk_create(new_items)
+    delete_item_versions(list(existing_ids))
+    bump_catalog_version()
+    return len(new_items) + len(upserted_items) - len(existing_ids), len(existing_ids)
+
+
+def import_items(rows: Iterable[dict | str], chunk_size: int = 2000,
+                 on_error: Callable[[CatalogImportError], None] = None) -> ImportResult:
+    """
+    Imports the catalog rows, chunk by chunk (one transaction per chunk, see import_chunk).
+    The invalid rows are skipped.
+    A row with an id updates the item with the id, or creates it with the id, so an id of a not existing item
+    should not be greater than the ids of the items created by the previous rows without an id.
+
+    :param rows: an iterable of the catalog rows (see read_rows).
+    :param chunk_size: the number of rows written at once.
+    :param on_error: is called with the error of every skipped row.
+    :return: an ImportResult instance.
+    """
+    created, updated, skipped = 0, 0, 0
+    numbered_rows = enumerate(rows, start=1)
+    while chunk := list(islice(numbered_rows, chunk_size)):
+        items = []
+        for row_number, row in chunk:
+            try:
+                items.append(parse_item(row, row_number))
+            except CatalogImportError as e:
+                skipped += 1
+                if on_error is not None:
+                    on_error(e)
+        chunk_created, chunk_updated = import_chunk(items)
+        created, updated = created + chunk_created, updated + chunk_updated
+    return ImportResult(created=created, updated=updated, skipped=skipped)
+
+
+def export_items(items: QuerySet, file: IO[str], file_format: str, chunk_size: int = 2000) -> int:
+    """
+    Writes the items to the file row by row, the rows are fetched from the DB chunk by chunk
+    (with a server-side cursor on Postgres).
+
+    :param items: a queryset of item.Item instances.
+    :param file: a text file object (opened with newline='' for CSV).
+    :param file_format: 'csv' or 'jsonl'.
+    :param chunk_size: the number of rows fetched at once.
+    :return: the number of the exported items.
+    """
+    rows = items.order_by('pk').values_list(*ITEM_COLUMNS).iterator(chunk_size=chunk_size)
+    count = 0
+    if file_format == 'csv':
+        writer = csv.writer(file)
+        writer.writerow(ITEM_COLUMNS)
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in rows:
+            file.write(json.dumps(dict(zip(ITEM_COLUMNS, row)), default=str, ensure_ascii=False) + '\n')
+            count += 1
+    return count
+
+
+def sync_items_with_stripe(items: Iterable[Item], max_workers: int,
+                           on_error: Callable[[Item, 'stripe.error.StripeError'], None] = None) -> tuple[int, int]:
+    """
+    Syncs the items' Stripe Products and Prices concurrently (see item.service.ItemStripeCatalog.sync).
+    At most max_workers * 2 items are queued at once, so the items are consumed lazily.
+    The rate of the Stripe requests is limited by the Stripe HTTP client (see config.clients.configure_stripe).
+    The threads' database connections are closed after every sync (see order.service.run_closing_db_connections).
+
+    :param items: an iterable of item.Item instances.
+    :param max_workers: the number of the threads calling Stripe.
+    :param on_error: is called with the item and the error of every failed sync.
+    :return: a tuple of the numbers of the synced and failed items.
+    """
+    stripe = get_stripe()
+    synced, failed = 0, 0
+    pending: dict[Future, Item] = {}
+
+    def collect(futures: set[Future]) -> None:
+        nonlocal synced, failed
+        for future in futures:
+            item = pending.pop(future)
+            try:
+                future.result()
+                synced += 1
+            except stripe.error.StripeError as e:
+                failed += 1
+                if on_error is not None:
+                    on_error(item, e)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='stripe-sync') as executor:
+        for item in items:
+            if len(pending) >= max_workers * 2:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+            pending[executor.submit(run_closing_db_connections, ItemStripeCatalog(item).sync)] = item
+        collect(wait(pending).done)
+    return synced, failed
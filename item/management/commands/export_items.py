@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management import BaseCommand
+
+from item.catalog_io import FILE_FORMATS, export_items, get_file_format
+from item.models import Item
+
+
+class Command(BaseCommand):
+    help = (
+        'Exports the item catalog (all the items, or the ones passed by id) to a CSV or JSON Lines file '
+        'with the id, name, description, price and currency columns. The items are streamed from the DB in chunks.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='the catalog file, "-" for stdout')
+        parser.add_argument('--format', choices=FILE_FORMATS, help='the file format, by default by the extension')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='the number of rows fetched at once')
+        parser.add_argument('--ids', nargs='+', type=int, help='ids of the Item instances to be exported')
+
+    def handle(self, *args, **options):
+        file_format = get_file_format(options['path'], options['format'])
+        items = Item.objects.all()
+        if options['ids']:
+            items = items.filter(pk__in=options['ids'])
+
+        if options['path'] == '-':
+            export_items(items, sys.stdout, file_format, chunk_size=options['chunk_size'])
+            return
+        with open(options['path'], 'w', newline='', encoding='utf-8') as file:
+            count = export_items(items, file, file_format, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Exported items: {count} to {options['path']}"))
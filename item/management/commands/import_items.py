@@ -0,0 +1,53 @@
+import sys
+
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from config import settings
+from config.clients import configure_stripe
+from item.catalog_io import FILE_FORMATS, get_file_format, import_items, read_rows, sync_items_with_stripe
+from item.models import Item
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports the item catalog from a CSV or JSON Lines file with the id (optional), name, description, price '
+        'and currency columns. The file is streamed and written in chunks, the rows with an id are upserted. '
+        'Optionally syncs the imported items with Stripe concurrently, at a limited rate.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='the catalog file, "-" for stdin')
+        parser.add_argument('--format', choices=FILE_FORMATS, help='the file format, by default by the extension')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='the number of rows written at once')
+        parser.add_argument('--sync-stripe', action='store_true',
+                            help='sync the Stripe Products and Prices of the imported items')
+        parser.add_argument('--stripe-workers', type=int, default=settings.STRIPE_MAX_WORKERS,
+                            help='the number of the threads calling Stripe')
+        parser.add_argument('--stripe-rate', type=float, default=settings.STRIPE_BULK_RATE_LIMIT,
+                            help='the max number of the Stripe requests per second')
+
+    def handle(self, *args, **options):
+        file_format = get_file_format(options['path'], options['format'])
+        started_at = timezone.now()
+        if options['path'] == '-':
+            result = self.__import(sys.stdin, file_format, options['chunk_size'])
+        else:
+            with open(options['path'], newline='', encoding='utf-8') as file:
+                result = self.__import(file, file_format, options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Created items: {result.created}, updated: {result.updated}, skipped: {result.skipped}'))
+
+        if options['sync_stripe']:
+            configure_stripe(rate_limit=options['stripe_rate'])
+            # the imported items are the ones written since the import has started
+            items = Item.objects.filter(updated_at__gte=started_at).order_by('pk').iterator(
+                chunk_size=options['chunk_size'])
+            synced, failed = sync_items_with_stripe(
+                items, max_workers=options['stripe_workers'],
+                on_error=lambda item, e: self.stderr.write(f"Couldn't sync {item} with Stripe: {str(e)}"))
+            self.stdout.write(self.style.SUCCESS(f'Synced items: {synced}, failed: {failed}'))
+
+    def __import(self, file, file_format: str, chunk_size: int):
+        return import_items(
+            read_rows(file, file_format), chunk_size=chunk_size, on_error=lambda e: self.stderr.write(str(e)))
@@ -0,0 +1,19 @@
+from django.core.management import BaseCommand
+
+from item.cache import get_item_page_stats, reset_item_page_stats
+
+
+class Command(BaseCommand):
+    help = 'Shows the hits and misses of the item detail page cache (item.cache), shared by all the app processes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='reset the counters after showing them')
+
+    def handle(self, *args, **options):
+        stats = get_item_page_stats()
+        requests_count = stats['hits'] + stats['misses']
+        hit_ratio = stats['hits'] / requests_count if requests_count else 0
+        self.stdout.write(f"Hits: {stats['hits']}, misses: {stats['misses']}, hit ratio: {hit_ratio:.2%}")
+        if options['reset']:
+            reset_item_page_stats()
+            self.stdout.write(self.style.SUCCESS('The counters are reset'))
@@ -0,0 +1,27 @@
+from django.core.management import BaseCommand
+from stripe.error import StripeError
+
+from item.models import Item
+from item.service import ItemStripeCatalog
+
+
+class Command(BaseCommand):
+    help = 'Syncs the Stripe Products and Prices of the Item instances (all of them, or the ones passed by id).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('item_ids', nargs='*', type=int, help='ids of the Item instances to be synced')
+
+    def handle(self, *args, **options):
+        items = Item.objects.order_by('pk')
+        if options['item_ids']:
+            items = items.filter(pk__in=options['item_ids'])
+
+        synced, failed = 0, 0
+        for item in items.iterator():
+            try:
+                ItemStripeCatalog(item).sync()
+                synced += 1
+            except StripeError as e:
+                failed += 1
+                self.stderr.write(f"Couldn't sync {item} with Stripe: {str(e)}")
+        self.stdout.write(self.style.SUCCESS(f'Synced items: {synced}, failed: {failed}'))
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0004_alter_item_currency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='stripe_product_id',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='stripe_product_id'),
+        ),
+        migrations.CreateModel(
+            name='ItemStripePrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripe_price_id', models.CharField(max_length=255, unique=True, verbose_name='stripe_price_id')),
+                ('unit_amount', models.PositiveBigIntegerField(verbose_name='unit_amount')),
+                ('currency', models.CharField(max_length=3, verbose_name='currency')),
+                ('tax_behavior', models.CharField(choices=[('inclusive', 'Inclusive'), ('exclusive', 'Exclusive')], max_length=9, verbose_name='tax_behavior')),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stripe_prices', to='item.item', verbose_name='item')),
+            ],
+            options={
+                'verbose_name': 'Item Stripe price',
+                'verbose_name_plural': 'Item Stripe prices',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='itemstripeprice',
+            constraint=models.UniqueConstraint(fields=('item', 'currency', 'tax_behavior'), name='unique_item_stripe_price'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0005_item_stripe_catalog'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='updated_at'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0007_item_search_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['price'], name='item_price_idx'),
+        ),
+    ]
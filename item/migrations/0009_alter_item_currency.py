@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0008_item_price_idx'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='currency',
+            field=models.CharField(choices=[('rub', 'RUB'), ('eur', 'EUR')], default='rub', verbose_name='price_currency'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0009_alter_item_currency'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='item',
+            name='currency',
+            field=models.CharField(max_length=3, verbose_name='price_currency'),
+        ),
+    ]
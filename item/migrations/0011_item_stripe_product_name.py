@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 02:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0010_alter_item_currency_max_length'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='stripe_product_name',
+            field=models.CharField(blank=True, max_length=150, null=True, verbose_name='stripe_product_name'),
+        ),
+    ]
@@ -1,22 +1,73 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.functions import Upper
+
+from config.settings import CURRENCIES
 
 NULLABLE = {'blank': True, 'null': True}
 
 
-class Item(models.Model):
-    CURRENCY = {
-        ('rub', 'RUB'),
-        ('eur', 'EUR')
-    }
+def get_currency_choices() -> list[tuple[str, str]]:
+    """
+    Returns the choices of the item currency: the CURRENCIES setting, the first one is the default.
+    They are not the choices of the model field, so the migrations do not depend on the deployment's settings.
+    """
+    return [(currency.lower(), currency) for currency in CURRENCIES]
+
 
+class Item(models.Model):
     name = models.CharField(verbose_name='name', max_length=150)
     description = models.TextField(verbose_name='description')
     price = models.DecimalField(verbose_name='price', max_digits=15, decimal_places=2)
-    currency = models.CharField(choices=CURRENCY, verbose_name='price_currency', default='rub')
+    currency = models.CharField(verbose_name='price_currency', max_length=3)
+    stripe_product_id = models.CharField(verbose_name='stripe_product_id', max_length=255, **NULLABLE)
+    # the name of the Stripe Product at its last sync, the Product is modified only when the item's name changes
+    stripe_product_name = models.CharField(verbose_name='stripe_product_name', max_length=150, **NULLABLE)
+    updated_at = models.DateTimeField(verbose_name='updated_at', auto_now=True)
 
     def __str__(self):
         return f'Item "{self.name}"'
 
+    def clean(self):
+        if self.currency not in dict(get_currency_choices()):
+            raise ValidationError({'currency': f'Currency must be one of {", ".join(CURRENCIES)}'})
+
     class Meta:
         verbose_name = 'Item'
         verbose_name_plural = 'Items'
+        indexes = [
+            # the price range filter of the admin changelist (item.admin.PriceRangeFilter)
+            models.Index(fields=['price'], name='item_price_idx'),
+            # trigram indexes of the name__icontains and description__icontains lookups (item.views.search_items)
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='item_name_trgm_idx'),
+            GinIndex(OpClass(Upper('description'), name='gin_trgm_ops'), name='item_description_trgm_idx'),
+        ]
+
+
+class ItemStripePrice(models.Model):
+    """
+    A Stripe Price object synced with an item.Item instance.
+    There is a single active Stripe Price per item, currency and tax behavior.
+    """
+    TAX_BEHAVIOR = [
+        ('inclusive', 'Inclusive'),
+        ('exclusive', 'Exclusive'),
+    ]
+
+    item = models.ForeignKey(Item, verbose_name='item', related_name='stripe_prices', on_delete=models.CASCADE)
+    stripe_price_id = models.CharField(verbose_name='stripe_price_id', max_length=255, unique=True)
+    unit_amount = models.PositiveBigIntegerField(verbose_name='unit_amount')
+    currency = models.CharField(verbose_name='currency', max_length=3)
+    tax_behavior = models.CharField(verbose_name='tax_behavior', choices=TAX_BEHAVIOR, max_length=9)
+
+    def __str__(self):
+        return f'Stripe price {self.stripe_price_id} of {self.item}'
+
+    class Meta:
+        verbose_name = 'Item Stripe price'
+        verbose_name_plural = 'Item Stripe prices'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['item', 'currency', 'tax_behavior'], name='unique_item_stripe_price'),
+        ]
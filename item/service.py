@@ -0,0 +1,179 @@
+from django.db import IntegrityError, transaction
+
+from config.clients import get_stripe
+from config.settings import SMALLEST_CURRENCY_UNIT_RATIO
+from item.models import Item, ItemStripePrice
+
+
+def get_unit_amount(item: Item) -> int:
+    """
+    Returns the item's price in the smallest currency unit, as it is expected by the Stripe API.
+
+    :param item: an item.Item instance.
+    """
+    return int(item.price) * SMALLEST_CURRENCY_UNIT_RATIO
+
+
+class ItemStripeCatalog:
+    """
+    A class keeping the Stripe Product and Price objects of an item.Item instance in sync with the instance.
+    The Stripe Product id is stored in the Item.stripe_product_id field, the Stripe Price ids are stored as
+    item.ItemStripePrice instances (one per currency and tax behavior).
+    Stripe Prices are immutable, so a price change creates a new Stripe Price and archives the previous one.
+    All the Stripe errors are propagated to the caller as stripe.error.StripeError.
+    """
+    # the fields saved by the sync
+    SYNC_FIELDS = {'stripe_product_id', 'stripe_product_name'}
+
+    def __init__(self, item: Item):
+        """
+        Initializes an ItemStripeCatalog instance.
+
+        :param item: an item.Item instance.
+        """
+        self.item = item
+
+    def __sync_product(self) -> None:
+        """
+        Creates a Stripe Product for the item if there is no one yet, otherwise updates the Product's name
+        if it has been changed since the last sync.
+        """
+        stripe = get_stripe()
+        if not self.item.stripe_product_id:
+            # a concurrent sync of the item gets the same Product
+            stripe_product = stripe.Product.create(
+                name=self.item.name, metadata={'item_id': self.item.pk},
+                idempotency_key=f'item-{self.item.pk}-product')
+            self.item.stripe_product_id = stripe_product['id']
+        elif self.item.stripe_product_name != self.item.name:
+            stripe.Product.modify(self.item.stripe_product_id, name=self.item.name)
+        else:
+            return
+        self.item.stripe_product_name = self.item.name
+        self.item.save(update_fields=self.SYNC_FIELDS)
+
+    def __sync_price(self, tax_behavior: str) -> ItemStripePrice:
+        """
+        Makes sure the item has an active Stripe Price matching its current price, currency and the tax_behavior.
+        The new Stripe Price is saved only if the stored one has not been replaced by a concurrent sync meanwhile
+        (compare-and-set), otherwise the new Price is archived and the sync is repeated.
+
+        :param tax_behavior: 'inclusive' or 'exclusive'.
+        :return: an item.ItemStripePrice instance.
+        """
+        unit_amount = get_unit_amount(self.item)
+        stripe_price = ItemStripePrice.objects.filter(
+            item=self.item, currency=self.item.currency, tax_behavior=tax_behavior).first()
+        if stripe_price is not None and stripe_price.unit_amount == unit_amount:
+            return stripe_price
+
+        stripe = get_stripe()
+        previous_price_id = stripe_price.stripe_price_id if stripe_price is not None else None
+        # the concurrent syncs replacing the same Price with the same amount get the same new Price
+        new_stripe_price = stripe.Price.create(
+            unit_amount=unit_amount,
+            currency=self.item.currency,
+            product=self.item.stripe_product_id,
+            tax_behavior=tax_behavior,
+            idempotency_key=f'item-{self.item.pk}-price-{self.item.currency}-{tax_behavior}-{previous_price_id}-'
+                            f'{unit_amount}',
+        )
+        if stripe_price is None:
+            try:
+                # the unique constraint of the item, currency and tax behavior: the first created Price is kept
+                with transaction.atomic():
+                    stripe_price = ItemStripePrice.objects.create(
+                        item=self.item, currency=self.item.currency, tax_behavior=tax_behavior,
+                        stripe_price_id=new_stripe_price['id'], unit_amount=unit_amount)
+                return stripe_price
+            except IntegrityError:
+                pass
+        elif ItemStripePrice.objects.filter(pk=stripe_price.pk, stripe_price_id=previous_price_id).update(
+                stripe_price_id=new_stripe_price['id'], unit_amount=unit_amount):
+            stripe.Price.modify(previous_price_id, active=False)
+            stripe_price.stripe_price_id = new_stripe_price['id']
+            stripe_price.unit_amount = unit_amount
+            return stripe_price
+
+        # a concurrent sync has saved another Price
+        if not ItemStripePrice.objects.filter(stripe_price_id=new_stripe_price['id']).exists():
+            stripe.Price.modify(new_stripe_price['id'], active=False)
+        return self.__sync_price(tax_behavior)
+
+    def sync(self) -> None:
+        """
+        Syncs the item's Stripe Product and its Stripe Prices for all the tax behaviors.
+        No DB lock is held while Stripe is called: the Stripe objects are created with the idempotency keys of
+        the item's synced state, so the concurrent syncs do not create duplicated Stripe objects,
+        and the Stripe Price ids are saved with compare-and-set updates.
+        """
+        self.item.refresh_from_db(fields=self.SYNC_FIELDS)
+        self.__sync_product()
+        for tax_behavior, _ in ItemStripePrice.TAX_BEHAVIOR:
+            self.__sync_price(tax_behavior)
+
+    def get_product_id(self) -> str:
+        """
+        Returns the item's Stripe Product id. Syncs the item first if it has not been synced yet.
+        """
+        if not self.item.stripe_product_id:
+            self.sync()
+        return self.item.stripe_product_id
+
+    def get_price_id(self, tax_behavior: str) -> str:
+        """
+        Returns the id of the item's Stripe Price for the tax_behavior.
+        Syncs the item first if it has no up-to-date Stripe Price yet.
+
+        :param tax_behavior: 'inclusive' or 'exclusive'.
+        """
+        stripe_price = ItemStripePrice.objects.filter(
+            item=self.item, currency=self.item.currency, tax_behavior=tax_behavior).first()
+        if stripe_price is None or stripe_price.unit_amount != get_unit_amount(self.item):
+            self.sync()
+            stripe_price = ItemStripePrice.objects.get(
+                item=self.item, currency=self.item.currency, tax_behavior=tax_behavior)
+        return stripe_price.stripe_price_id
+
+    @staticmethod
+    def get_synced_price_ids(items: list[Item], tax_behavior: str) -> dict[int, str]:
+        """
+        Returns the up-to-date Stripe Price ids of the items with a single query.
+        Items without an up-to-date Stripe Price are missing in the result.
+
+        :param items: a list of item.Item instances.
+        :param tax_behavior: 'inclusive' or 'exclusive'.
+        :return: a dict of {item.pk: stripe_price_id}.
+        """
+        items_by_pk = {item.pk: item for item in items}
+        stripe_prices = ItemStripePrice.objects.filter(item__in=items_by_pk.keys(), tax_behavior=tax_behavior)
+        return {
+            stripe_price.item_id: stripe_price.stripe_price_id for stripe_price in stripe_prices
+            if stripe_price.currency == items_by_pk[stripe_price.item_id].currency
+            and stripe_price.unit_amount == get_unit_amount(items_by_pk[stripe_price.item_id])
+        }
+
+    @staticmethod
+    def get_price_ids(items: list[Item], tax_behavior: str) -> dict[int, str]:
+        """
+        Returns the Stripe Price ids of the items with a single query.
+        Items without an up-to-date Stripe Price are synced on the fly.
+
+        :param items: a list of item.Item instances.
+        :param tax_behavior: 'inclusive' or 'exclusive'.
+        :return: a dict of {item.pk: stripe_price_id}.
+        """
+        price_ids = ItemStripeCatalog.get_synced_price_ids(items, tax_behavior)
+        for item in items:
+            if item.pk not in price_ids:
+                price_ids[item.pk] = ItemStripeCatalog(item).get_price_id(tax_behavior)
+        return price_ids
+
+    @staticmethod
+    def archive_product(stripe_product_id: str) -> None:
+        """
+        Archives a Stripe Product (and so makes it unavailable for new checkouts).
+
+        :param stripe_product_id: the Stripe Product id.
+        """
+        get_stripe().Product.modify(stripe_product_id, active=False)
@@ -0,0 +1,53 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from item.cache import set_item_version, delete_item_version, bump_catalog_version
+from item.models import Item
+from item.service import ItemStripeCatalog
+from item.tasks import sync_item_with_stripe, archive_stripe_product
+
+
+@receiver(post_save, sender=Item)
+def sync_saved_item(sender, instance, raw=False, update_fields=None, **kwargs):
+    """
+    Schedules the Stripe catalog sync of a created or changed Item, once the transaction is committed.
+    Fixture loading (raw saves) and saves made by the sync itself (only ItemStripeCatalog.SYNC_FIELDS are updated)
+    are skipped, use the sync_stripe_catalog command for them.
+    """
+    if raw or (update_fields is not None and set(update_fields) <= ItemStripeCatalog.SYNC_FIELDS):
+        return
+    transaction.on_commit(lambda: sync_item_with_stripe.delay(instance.pk))
+
+
+@receiver(post_delete, sender=Item)
+def archive_deleted_item(sender, instance, **kwargs):
+    """
+    Schedules archiving of the deleted Item's Stripe Product, once the transaction is committed.
+    """
+    if instance.stripe_product_id:
+        transaction.on_commit(lambda: archive_stripe_product.delay(instance.stripe_product_id))
+
+
+@receiver(post_save, sender=Item)
+def invalidate_saved_item_page(sender, instance, update_fields=None, **kwargs):
+    """
+    Sets the new version of a created or changed Item and of the catalog once the transaction is committed,
+    so its cached detail page and the cached catalog API pages are rendered again (see item.cache).
+    Saves made by the Stripe catalog sync (only ItemStripeCatalog.SYNC_FIELDS are updated) do not change the page.
+    """
+    if update_fields is not None and set(update_fields) <= ItemStripeCatalog.SYNC_FIELDS:
+        return
+    transaction.on_commit(lambda: set_item_version(instance))
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_delete, sender=Item)
+def invalidate_deleted_item_page(sender, instance, **kwargs):
+    """
+    Deletes the version of a deleted Item and sets a new version of the catalog once the transaction is committed,
+    so its cached detail page and the cached catalog API pages are not served.
+    """
+    item_id = instance.pk
+    transaction.on_commit(lambda: delete_item_version(item_id))
+    transaction.on_commit(bump_catalog_version)
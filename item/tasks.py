@@ -0,0 +1,26 @@
+from celery import shared_task
+
+from item.models import Item
+from item.service import ItemStripeCatalog
+
+
+@shared_task(ignore_result=True)
+def sync_item_with_stripe(item_id: int) -> None:
+    """
+    Syncs the item.Item instance's Stripe Product and Prices with the instance's current name and price.
+
+    :param item_id: id of the Item instance to be synced.
+    """
+    item = Item.objects.filter(pk=item_id).first()
+    if item is not None:
+        ItemStripeCatalog(item).sync()
+
+
+@shared_task(ignore_result=True)
+def archive_stripe_product(stripe_product_id: str) -> None:
+    """
+    Archives the Stripe Product of a deleted item.Item instance.
+
+    :param stripe_product_id: the Stripe Product id.
+    """
+    ItemStripeCatalog.archive_product(stripe_product_id)
@@ -1,3 +1,571 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from benchmarks.fake_apis import FakeAPIServer
+from config.celery import app as celery_app
+from config.clients import get_stripe
+from item.cache import get_item_page_stats, get_item_version_cache_key
+from item.models import Item, ItemStripePrice
+from item.service import ItemStripeCatalog
+
+
+class QueryPlanTestMixin:
+    """
+    Checks the Postgres query plans (EXPLAIN) of the captured queries, to catch the queries falling back to
+    sequential scans of a large table. The tables are expected to be seeded with a large dataset and ANALYZEd.
+    """
+
+    @staticmethod
+    def analyze(*models) -> None:
+        with connection.cursor() as cursor:
+            for model in models:
+                cursor.execute(f'ANALYZE "{model._meta.db_table}"')
+
+    @staticmethod
+    def get_plan(sql: str) -> dict:
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+            return cursor.fetchone()[0][0]['Plan']
+
+    def get_seq_scanned_tables(self, sql: str) -> set[str]:
+        """
+        Returns the tables sequentially scanned by the query.
+
+        :param sql: the SQL of a query captured with CaptureQueriesContext (the parameters are interpolated).
+        """
+        tables, nodes = set(), [self.get_plan(sql)]
+        while nodes:
+            node = nodes.pop()
+            if node['Node Type'] == 'Seq Scan':
+                tables.add(node['Relation Name'])
+            nodes.extend(node.get('Plans', []))
+        return tables
+
+    def assertNoSeqScan(self, queries: list[dict], table: str) -> None:
+        """
+        Asserts that none of the captured SELECT, UPDATE and DELETE queries on the table is a sequential scan
+        of the table (EXPLAIN does not run the queries).
+
+        :param queries: the queries captured with CaptureQueriesContext.
+        :param table: the name of the table.
+        """
+        statements = [
+            query['sql'] for query in queries
+            if query['sql'].startswith(('SELECT', 'UPDATE', 'DELETE')) and f'"{table}"' in query['sql']
+        ]
+        self.assertTrue(statements, f'No queries on {table} have been captured')
+        for sql in statements:
+            self.assertNotIn(table, self.get_seq_scanned_tables(sql), f'Sequential scan of {table}: {sql}')
+
+
+@skipUnless(connection.vendor == 'postgresql', 'The query plans are checked on Postgres only')
+class ItemQueryPlansTestCase(QueryPlanTestMixin, TestCase):
+    """
+    The item admin changelist queries on a large catalog use the indexes.
+    """
+    ITEMS_COUNT = 50000
+
+    @classmethod
+    def setUpTestData(cls):
+        # mostly cheap items, every 1000th item is expensive
+        Item.objects.bulk_create([
+            Item(name=f'Item {i}', description=f'Description of the item {i}', currency=('eur', 'rub')[i % 2],
+                 price=Decimal(5000 if i % 1000 == 0 else i % 100))
+            for i in range(cls.ITEMS_COUNT)
+        ], batch_size=5000)
+        cls.analyze(Item)
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+    def setUp(self):
+        self.client.force_login(self.superuser)
+
+    def skip_unless_trigram_indexes(self) -> None:
+        # the search by name and description uses the trigram indexes of the pg_trgm extension
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            if cursor.fetchone() is None:
+                self.skipTest('The pg_trgm extension is not installed')
+
+    def get_changelist_page_queries(self, params: dict) -> list[dict]:
+        """
+        Returns the queries of the changelist page, the counts are skipped.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:item_item_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return [query for query in queries if not query['sql'].startswith('SELECT COUNT(*)')]
+
+    def test_admin_price_range_filter(self):
+        queries = self.get_changelist_page_queries({'price_range': '1000-10000'})
+        self.assertNoSeqScan(queries, Item._meta.db_table)
+
+    def test_admin_id_search(self):
+        self.skip_unless_trigram_indexes()
+        queries = self.get_changelist_page_queries({'q': '4242'})
+        self.assertNoSeqScan(queries, Item._meta.db_table)
+
+    def test_admin_name_search(self):
+        self.skip_unless_trigram_indexes()
+        queries = self.get_changelist_page_queries({'q': '"item 4242"'})
+        self.assertNoSeqScan(queries, Item._meta.db_table)
+
+
+class ItemCurrencyTestCase(TestCase):
+    """
+    The item currencies are the CURRENCIES setting, validated by the model and offered by the admin form.
+    """
+
+    def setUp(self):
+        patcher = mock.patch('item.models.CURRENCIES', ['EUR', 'USD'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_clean(self):
+        item = Item(name='Item', description='Test item', price=Decimal(10), currency='usd')
+        item.full_clean()
+        item.currency = 'rub'
+        with self.assertRaises(ValidationError) as e:
+            item.full_clean()
+        self.assertEqual(e.exception.message_dict, {'currency': ['Currency must be one of EUR, USD']})
+
+    def test_admin_form(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        response = self.client.get(reverse('admin:item_item_add'))
+        self.assertContains(response, '<option value="eur" selected>EUR</option>', html=True)
+        self.assertContains(response, '<option value="usd">USD</option>', html=True)
+        self.assertNotContains(response, 'RUB')
+
+
+class ItemSearchTestCase(TestCase):
+    """
+    The item autocomplete (item.views.search_items): the names and descriptions are searched case-insensitively,
+    the results are paginated without counting all the matches.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.items = Item.objects.bulk_create([
+            Item(name=f'Chair {i}', description='Wooden', price=Decimal(10 + i), currency='eur') for i in range(3)
+        ] + [Item(name='Table', description='A table for the wooden chairs', price=Decimal(50), currency='usd')])
+
+    def search(self, **params) -> dict:
+        return self.client.get(reverse('items:search_items'), params).json()
+
+    def test_search(self):
+        self.assertEqual(self.search(q='cHaIr 1'), {
+            'results': [{'id': self.items[1].pk, 'name': 'Chair 1', 'price': '11.00', 'currency': 'eur'}],
+            'page': 1, 'has_next': False,
+        })
+        # the descriptions are searched too
+        self.assertEqual([result['name'] for result in self.search(q='wooden')['results']],
+                         ['Chair 0', 'Chair 1', 'Chair 2', 'Table'])
+
+    def test_pages(self):
+        with mock.patch('item.views.ITEM_SEARCH_PAGE_SIZE', 3):
+            first_page = self.search(q='wooden')
+            second_page = self.search(q='wooden', page=2)
+        self.assertEqual(([result['name'] for result in first_page['results']], first_page['has_next']),
+                         (['Chair 0', 'Chair 1', 'Chair 2'], True))
+        self.assertEqual(([result['name'] for result in second_page['results']], second_page['page'],
+                          second_page['has_next']), (['Table'], 2, False))
+
+    def test_short_and_invalid_queries(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search(q=' ch '), {'results': [], 'page': 1, 'has_next': False})
+        self.assertEqual(self.search(q='chair', page='last')['page'], 1)
+        self.assertEqual(self.search(q='chair', page=-1)['page'], 1)
+
+
+class ItemStripeCatalogTestCase(TestCase):
+    """
+    The Stripe Products and Prices of the items (item.service.ItemStripeCatalog), synced against a fake Stripe API.
+    """
+
+    def setUp(self):
+        # the Stripe client is set up on the first use
+        stripe = get_stripe()
+        self.fake_api = FakeAPIServer().__enter__()
+        self.addCleanup(self.fake_api.__exit__, None, None, None)
+        for patcher in [mock.patch.object(stripe, 'api_base', self.fake_api.url),
+                        mock.patch.object(stripe, 'api_key', 'sk_test_catalog')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.item = Item.objects.bulk_create([
+            Item(name='Item', description='Test item', price=Decimal('10.00'), currency='eur')])[0]
+
+    def get_prices(self) -> dict:
+        return dict(ItemStripePrice.objects.filter(item=self.item).values_list('tax_behavior', 'unit_amount'))
+
+    def test_sync(self):
+        ItemStripeCatalog(self.item).sync()
+        self.assertEqual(
+            self.fake_api.reset_calls(), {'product_create': 1, 'price_create': 2})
+        self.item.refresh_from_db()
+        self.assertEqual((self.item.stripe_product_id, self.item.stripe_product_name), ('prod_fake1', 'Item'))
+        self.assertEqual(self.get_prices(), {'inclusive': 1000, 'exclusive': 1000})
+
+        # nothing has changed
+        ItemStripeCatalog(self.item).sync()
+        self.assertEqual(self.fake_api.reset_calls(), {})
+
+        self.item.name = 'Renamed item'
+        ItemStripeCatalog(self.item).sync()
+        self.assertEqual(self.fake_api.reset_calls(), {'product_modify': 1})
+
+        self.item.price = Decimal('20.00')
+        ItemStripeCatalog(self.item).sync()
+        # the new Prices are created, the previous ones are archived
+        self.assertEqual(self.fake_api.reset_calls(), {'price_create': 2, 'price_modify': 2})
+        self.assertEqual(self.get_prices(), {'inclusive': 2000, 'exclusive': 2000})
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_saved_item_is_synced_when_changed(self):
+        # the sync task is run in the process: the celery app has read its settings already, so they are set as well
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', celery_app.conf.task_always_eager)
+        celery_app.conf.task_always_eager = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.save()
+        self.assertEqual(self.fake_api.reset_calls(), {'product_create': 1, 'price_create': 2})
+
+        self.item.refresh_from_db()
+        self.item.description = 'New description'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.save()
+        self.assertEqual(self.fake_api.reset_calls(), {})
+
+    def test_price_replaced_by_concurrent_sync(self):
+        ItemStripeCatalog(self.item).sync()
+        self.fake_api.reset_calls()
+        stripe = get_stripe()
+        create_price = stripe.Price.create
+
+        def create_price_while_synced_concurrently(**params):
+            # a concurrent sync saves another Price after this one has read the stored Price
+            ItemStripePrice.objects.filter(item=self.item, tax_behavior=params['tax_behavior']).update(
+                stripe_price_id=f"price_concurrent_{params['tax_behavior']}", unit_amount=3000)
+            return create_price(**params)
+
+        self.item.price = Decimal('20.00')
+        with mock.patch.object(stripe.Price, 'create', side_effect=create_price_while_synced_concurrently):
+            ItemStripeCatalog(self.item).sync()
+        self.assertEqual(self.get_prices(), {'inclusive': 2000, 'exclusive': 2000})
+        # per tax behavior: the Price created against the replaced one is archived, the sync is repeated
+        # and the concurrent Price is archived
+        self.assertEqual(self.fake_api.calls['price_modify'], 4)
+
+    def test_sync_stripe_catalog(self):
+        Item.objects.create(name='Another item', description='Test item', price=Decimal(5), currency='eur')
+        self.fake_api.reset_calls()
+
+        output = StringIO()
+        call_command('sync_stripe_catalog', stdout=output)
+        self.assertIn('Synced items: 2, failed: 0', output.getvalue())
+        self.assertEqual(self.fake_api.reset_calls(), {'product_create': 2, 'price_create': 4})
+        self.assertFalse(Item.objects.filter(stripe_product_id__isnull=True).exists())
+
+
+class ItemPageCacheTestCase(TestCase):
+    """
+    The cached item detail page (item.cache): the card is rendered once per item version, and the page is served
+    without DB queries, or as 304 Not Modified to the conditional requests.
+    """
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('item.signals.sync_item_with_stripe.delay')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item = Item.objects.create(name='Item', description='Test item', price=Decimal(10), currency='eur')
+        self.url = reverse('items:get_item', args=[self.item.pk])
+
+    def test_cached_page(self):
+        self.assertContains(self.client.get(self.url), 'Item')
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(self.url), 'Item')
+        self.assertEqual(get_item_page_stats(), {'hits': 1, 'misses': 1})
+
+    def test_changed_item(self):
+        self.client.get(self.url)
+        self.item.name = 'Renamed item'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.save()
+        self.assertContains(self.client.get(self.url), 'Renamed item')
+        self.assertEqual(get_item_page_stats(), {'hits': 0, 'misses': 2})
+
+    def test_deleted_item(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_not_modified(self):
+        # the first response sets the CSRF cookie, the ETag of the page depends on it
+        self.client.get(self.url)
+        response = self.client.get(self.url)
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        # the ETag is per CSRF cookie
+        self.client.cookies.clear()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+        self.item.price = Decimal(20)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.item.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertContains(response, '20.00 eur')
+
+    def test_item_page_cache_stats(self):
+        self.client.get(self.url)
+        self.client.get(self.url)
+
+        output = StringIO()
+        call_command('item_page_cache_stats', '--reset', stdout=output)
+        self.assertIn('Hits: 1, misses: 1, hit ratio: 50.00%', output.getvalue())
+        self.assertEqual(get_item_page_stats(), {'hits': 0, 'misses': 0})
+
+
+class ItemCatalogIOTestCase(TestCase):
+    """
+    The streaming catalog import and export (item.catalog_io, the import_items and export_items commands).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.items = Item.objects.bulk_create([
+            Item(name=f'Item {i}', description='Test item', price=Decimal(10 + i), currency='eur') for i in range(2)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+
+    def write_file(self, name: str, content: str) -> str:
+        path = os.path.join(self.temp_dir, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def read_file(self, name: str) -> str:
+        with open(os.path.join(self.temp_dir, name), encoding='utf-8') as file:
+            return file.read()
+
+    def call_command(self, *args) -> tuple[str, str]:
+        stdout, stderr = StringIO(), StringIO()
+        call_command(*args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_import_csv(self):
+        new_item_id = self.items[-1].pk + 10
+        path = self.write_file('catalog.csv', (
+            'id,name,description,price,currency\n'
+            f'{self.items[0].pk},Updated item,New description,12.5,EUR\n'
+            f'{new_item_id},Item with id,,7,rub\n'
+            ',New item,Created,3.999,\n'
+            ',,No name,1,eur\n'
+            ',Free item,,-1,eur\n'
+            ',Dollar item,,1,usd\n'
+        ))
+        cache.set(get_item_version_cache_key(self.items[0].pk), self.items[0].updated_at)
+
+        stdout, stderr = self.call_command('import_items', path, '--chunk-size', '2')
+        self.assertIn('Created items: 2, updated: 1, skipped: 3', stdout)
+        self.assertEqual(stderr.splitlines(), [
+            "Row 4: invalid name ''",
+            'Row 5: invalid price -1.00',
+            "Row 6: invalid currency 'usd'",
+        ])
+        self.assertEqual(
+            list(Item.objects.order_by('pk').values_list('name', 'description', 'price', 'currency')), [
+                ('Updated item', 'New description', Decimal('12.50'), 'eur'),
+                ('Item 1', 'Test item', Decimal('11.00'), 'eur'),
+                ('Item with id', '', Decimal('7.00'), 'rub'),
+                ('New item', 'Created', Decimal('4.00'), 'rub'),
+            ])
+        self.assertEqual(Item.objects.order_by('pk').values_list('pk', flat=True)[2], new_item_id)
+        # bulk writes send no signals, the updated item's cached page is reset by the import
+        self.assertIsNone(cache.get(get_item_version_cache_key(self.items[0].pk)))
+
+    def test_import_jsonl(self):
+        path = self.write_file('catalog.jsonl', (
+            f'{{"id": {self.items[1].pk}, "name": "Updated item", "price": 20, "currency": "eur"}}\n'
+            '\n'
+            '{"name": "New item", "description": "Created", "price": "5.50"}\n'
+            '{"name": "No price"}\n'
+        ))
+
+        stdout, stderr = self.call_command('import_items', path)
+        self.assertIn('Created items: 1, updated: 1, skipped: 1', stdout)
+        self.assertIn('Row 3: invalid item', stderr)
+        self.assertEqual(Item.objects.get(pk=self.items[1].pk).price, Decimal('20.00'))
+        self.assertTrue(Item.objects.filter(name='New item', price=Decimal('5.50')).exists())
+
+    def test_import_invalid_jsonl(self):
+        path = self.write_file('catalog.jsonl', (
+            '{"name": "First item", "price": 1}\n'
+            '{"name": "Broken item", \n'
+            '[1, 2]\n'
+            '"Item"\n'
+            '{"name": "Last item", "price": 2}\n'
+        ))
+
+        # the invalid rows are skipped, the rows of the next chunks are imported
+        stdout, stderr = self.call_command('import_items', path, '--chunk-size', '2')
+        self.assertIn('Created items: 2, updated: 0, skipped: 3', stdout)
+        self.assertEqual([line.split(':')[0] for line in stderr.splitlines()], ['Row 2', 'Row 3', 'Row 4'])
+        self.assertIn("Row 3: invalid item [1, 2], an object is expected", stderr)
+        self.assertEqual(Item.objects.filter(name__in=['First item', 'Last item']).count(), 2)
+
+    def test_export(self):
+        stdout, _ = self.call_command('export_items', os.path.join(self.temp_dir, 'catalog.csv'))
+        self.assertIn('Exported items: 2', stdout)
+        self.assertEqual(self.read_file('catalog.csv').splitlines(), [
+            'id,name,description,price,currency',
+            f'{self.items[0].pk},Item 0,Test item,10.00,eur',
+            f'{self.items[1].pk},Item 1,Test item,11.00,eur',
+        ])
+
+        self.call_command('export_items', os.path.join(self.temp_dir, 'catalog.jsonl'), '--ids', str(self.items[1].pk))
+        self.assertEqual([json.loads(line) for line in self.read_file('catalog.jsonl').splitlines()], [
+            {'id': self.items[1].pk, 'name': 'Item 1', 'description': 'Test item', 'price': '11.00', 'currency': 'eur'},
+        ])
+
+    def test_export_and_import(self):
+        path = os.path.join(self.temp_dir, 'catalog.csv')
+        self.call_command('export_items', path)
+        stdout, _ = self.call_command('import_items', path)
+        self.assertIn('Created items: 0, updated: 2, skipped: 0', stdout)
+        self.assertEqual(Item.objects.count(), 2)
+
+
+class ItemImportStripeSyncTestCase(TransactionTestCase):
+    """
+    The Stripe sync of the imported items (import_items --sync-stripe), made by a pool of threads with their own
+    database connections, so the imported items are committed (TransactionTestCase).
+    """
+
+    def setUp(self):
+        stripe = get_stripe()
+        self.fake_api = FakeAPIServer().__enter__()
+        self.addCleanup(self.fake_api.__exit__, None, None, None)
+        # the command configures the Stripe client of the process
+        for patcher in [mock.patch.object(stripe, 'api_base'), mock.patch.object(stripe, 'api_key'),
+                        mock.patch.object(stripe, 'default_http_client'),
+                        mock.patch('config.settings.STRIPE_API_BASE', self.fake_api.url),
+                        mock.patch('config.settings.STRIPE_API_KEY', 'sk_test_import')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_import_sync_stripe(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        path = os.path.join(temp_dir.name, 'catalog.jsonl')
+        with open(path, 'w') as file:
+            file.writelines(f'{{"name": "Item {i}", "price": {10 + i}, "currency": "eur"}}\n' for i in range(3))
+
+        stdout = StringIO()
+        call_command('import_items', path, '--sync-stripe', '--stripe-workers', '2', stdout=stdout)
+        self.assertIn('Synced items: 3, failed: 0', stdout.getvalue())
+        self.assertEqual(self.fake_api.reset_calls(), {'product_create': 3, 'price_create': 6})
+        self.assertFalse(Item.objects.filter(stripe_product_id__isnull=True).exists())
+        self.assertEqual(ItemStripePrice.objects.count(), 6)
+
+
+class CatalogApiTestCase(TestCase):
+    """
+    The JSON catalog API (item.catalog_api): the keyset cursor pagination, the cached and the streamed pages,
+    and the conditional requests.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.items = Item.objects.bulk_create([
+            Item(name=f'Item {i}', description='Test item', price=Decimal(10 + i), currency='eur') for i in range(5)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        patcher = mock.patch('item.signals.sync_item_with_stripe.delay')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_page(self, etag: str = None, **params):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.client.get(reverse('items:list_items_api'), params, headers=headers)
+
+    def test_pages(self):
+        names, cursor = [], 0
+        for _ in range(3):
+            page = self.get_page(cursor=cursor, limit=2, fields='name').json()
+            names.extend(result['name'] for result in page['results'])
+            cursor = page['next_cursor']
+        self.assertEqual(names, [f'Item {i}' for i in range(5)])
+        self.assertIsNone(cursor)
+        self.assertEqual(self.get_page(cursor=self.items[1].pk, limit=1, fields='id,price').json(), {
+            'results': [{'id': self.items[2].pk, 'price': '12.00'}], 'next_cursor': self.items[2].pk})
+
+    def test_streamed_page(self):
+        cached_page = self.get_page(limit=4).json()
+        with mock.patch('item.views.ITEM_API_CACHED_PAGE_SIZE', 3), mock.patch('item.catalog_api.STREAM_CHUNK_SIZE', 2):
+            response = self.get_page(limit=4)
+            self.assertTrue(response.streaming)
+            self.assertEqual(json.loads(b''.join(response.streaming_content)), cached_page)
+        self.assertEqual(cached_page['next_cursor'], self.items[3].pk)
+
+    def test_invalid_query(self):
+        for params in [{'cursor': -1}, {'cursor': 'last'}, {'limit': 0}, {'limit': 10001}, {'fields': 'name,secret'}]:
+            response = self.get_page(**params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('detail', response.json())
+
+    def test_page_not_modified(self):
+        etag = self.get_page(limit=2)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get_page(etag, limit=2).status_code, 304)
+        # another page has another ETag
+        self.assertEqual(self.get_page(etag, limit=3).status_code, 200)
+
+        # any item change is a new catalog version
+        with self.captureOnCommitCallbacks(execute=True):
+            self.items[4].save()
+        self.assertEqual(self.get_page(etag, limit=2).status_code, 200)
+
+    def test_get_item(self):
+        url = reverse('items:get_item_api', args=[self.items[0].pk])
+        self.assertEqual(self.client.get(url, {'fields': 'name,currency'}).json(),
+                         {'name': 'Item 0', 'currency': 'eur'})
+        self.assertEqual(self.client.get(url, {'fields': 'secret'}).status_code, 400)
+        response = self.client.get(reverse('items:get_item_api', args=[self.items[-1].pk + 1]))
+        self.assertEqual((response.status_code, response.json()), (404, {'detail': 'No Item matches the given query.'}))
+
+    def test_item_not_modified(self):
+        url = reverse('items:get_item_api', args=[self.items[0].pk])
+        response = self.client.get(url)
+        self.assertTrue(response.has_header('Last-Modified'))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        self.items[0].price = Decimal(20)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.items[0].save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual((response.status_code, response.json()['price']), (200, '20.00'))
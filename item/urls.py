@@ -1,11 +1,15 @@
 from django.urls import path
 
 from item.apps import ItemConfig
-from item.views import get_item, buy_item
+from item.views import get_item, buy_item, abuy_item, search_items, list_items_api, get_item_api
 
 app_name = ItemConfig.name
 
 urlpatterns = [
     path('item/<int:item_id>', get_item, name='get_item'),
+    path('item/search', search_items, name='search_items'),
     path('buy/<int:item_id>', buy_item, name='buy_item'),
+    path('async/buy/<int:item_id>', abuy_item, name='abuy_item'),
+    path('api/items', list_items_api, name='list_items_api'),
+    path('api/items/<int:item_id>', get_item_api, name='get_item_api'),
 ]
@@ -1,18 +1,39 @@
 import json
 
-from django.http import Http404, JsonResponse, HttpRequest
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.http import Http404, JsonResponse, HttpRequest, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET
+from django.views.decorators.vary import vary_on_cookie
 
+from config.settings import (
+    CHECKOUT_DEFERRED, ITEM_SEARCH_PAGE_SIZE, ITEM_SEARCH_MIN_QUERY_LENGTH, ITEM_API_CACHED_PAGE_SIZE,
+)
+from item.cache import get_item_card, get_item_etag, get_item_last_modified, get_item_version
+from item.catalog_api import (
+    CatalogQueryError, get_catalog_item, get_catalog_item_etag, get_catalog_page, get_catalog_page_etag,
+    iter_catalog_page, parse_catalog_query, parse_fields,
+)
 from item.models import Item
-from order.service import ProjectStripeSession
+from order.checkout import defer_item_checkout
+from order.models import Order
+from order.service import ProjectStripeSession, AsyncProjectStripeSession
 
 
+@vary_on_cookie
+@cache_control(no_cache=True)
+@condition(etag_func=get_item_etag, last_modified_func=get_item_last_modified)
 def get_item(request, item_id):
     """
     View to display item details and handle the purchase request.
+    The item's card is rendered once per item version and cached (see item.cache), and the page supports
+    conditional GET requests (ETag and Last-Modified), so it is served without DB queries, or as 304 Not Modified.
     If the request method is POST and contains 'buy_item', it initiates a purchase
     by making a GET request to the 'buy_item' view. The user is then redirected to
-    the Stripe Checkout URL for completing the purchase.
+    the Stripe Checkout URL for completing the purchase (or to the checkout waiting page, if CHECKOUT_DEFERRED).
 
     :param request: HTTP request object
     :param item_id: ID of the item to be displayed and purchased.
@@ -25,14 +46,14 @@ def get_item(request, item_id):
             buy_request.GET = {'item_id': item_id}
             buy_item_response = buy_item(buy_request, item_id)
             response_data = json.loads(buy_item_response.content)
-            checkout_url = response_data.get('checkout_url')
+            checkout_url = response_data.get('checkout_url') or response_data.get('checkout_page_url')
             return redirect(checkout_url)
     else:
-        try:
-            item = get_object_or_404(Item, pk=item_id)
-        except Http404:
-            return {'detail': 'Not found'}
-        context = {'item': item, 'page_title': 'Buy Item'}
+        version = get_item_version(item_id)
+        item_card = get_item_card(item_id, version) if version is not None else None
+        if item_card is None:
+            raise Http404('No Item matches the given query.')
+        context = {'item_card': item_card, 'page_title': 'Buy Item'}
         return render(request, 'item/get_item.html', context)
 
 
@@ -41,14 +62,128 @@ def buy_item(request, item_id):
     View to initiate the purchase process for a specific item (item.Item instance).
     If the request method is GET, it creates a new Stripe session for the specified
     item, retrieves the session ID and Checkout URL, and returns them as JSON.
+    If CHECKOUT_DEFERRED, an order of the item is saved and its Checkout Session is created in the background
+    (see order.checkout), the response is returned at once with the order's waiting page and status urls.
 
     :param request: HTTP request object
     :param item_id: ID of the item to be purchased.
-    :return: A JSON response containing the Stripe session ID and Checkout URL.
+    :return: A JSON response containing the Stripe session ID and Checkout URL, or with CHECKOUT_DEFERRED
+    the order id and its waiting page and checkout status urls (202 Accepted).
     """
     if request.method == 'GET':
         item = get_object_or_404(Item, pk=item_id)
+        if CHECKOUT_DEFERRED:
+            return get_deferred_checkout_response(defer_item_checkout(item))
         project_stripe_obj = ProjectStripeSession(items=[item])
         stripe_session = project_stripe_obj.make_session()
         response_data = {'stripe_session_id': stripe_session['id'], 'checkout_url': stripe_session['url']}
         return JsonResponse(response_data)
+
+
+def get_deferred_checkout_response(order: Order) -> JsonResponse:
+    """
+    Returns the response of a deferred checkout: the order id, the waiting page and the checkout status urls.
+    """
+    return JsonResponse({
+        'order_id': order.pk,
+        'checkout_page_url': reverse('order:checkout_page', args=[order.pk]),
+        'status_url': reverse('order:checkout_status', args=[order.pk]),
+    }, status=202)
+
+
+async def abuy_item(request, item_id):
+    """
+    Async variant of the buy_item view for ASGI. The event loop is not blocked, but every checkout holds
+    an executor thread while Stripe is being called (see order.service.AsyncProjectStripeSession).
+    The Stripe Checkout Session is created by order.service.AsyncProjectStripeSession.
+
+    :param request: HTTP request object
+    :param item_id: ID of the item to be purchased.
+    :return: A JSON response containing the Stripe session ID and Checkout URL.
+    """
+    if request.method == 'GET':
+        item = await Item.objects.filter(pk=item_id).afirst()
+        if item is None:
+            raise Http404('No Item matches the given query.')
+        if CHECKOUT_DEFERRED:
+            return get_deferred_checkout_response(await sync_to_async(defer_item_checkout)(item))
+        project_stripe_obj = AsyncProjectStripeSession(items=[item])
+        stripe_session = await project_stripe_obj.amake_session()
+        response_data = {'stripe_session_id': stripe_session['id'], 'checkout_url': stripe_session['url']}
+        return JsonResponse(response_data)
+
+
+def search_items(request):
+    """
+    Item autocomplete endpoint, used by the item picker of the order/create page.
+    Looks the query up in the items' names and descriptions (case-insensitive, backed by the trigram indexes),
+    the results are paginated by ITEM_SEARCH_PAGE_SIZE items. Queries shorter than ITEM_SEARCH_MIN_QUERY_LENGTH
+    return no results.
+
+    :param request: HTTP request object, with the 'q' (query) and 'page' (page number, from 1) GET parameters.
+    :return: A JSON response: {'results': [{'id', 'name', 'price', 'currency'}, ...], 'page': int, 'has_next': bool}.
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    if len(query) < ITEM_SEARCH_MIN_QUERY_LENGTH:
+        return JsonResponse({'results': [], 'page': page, 'has_next': False})
+
+    offset = (page - 1) * ITEM_SEARCH_PAGE_SIZE
+    # one extra row tells whether there is a next page, without counting all the matches
+    results = list(
+        Item.objects.filter(Q(name__icontains=query) | Q(description__icontains=query))
+        .order_by('name', 'pk')
+        .values('id', 'name', 'price', 'currency')[offset:offset + ITEM_SEARCH_PAGE_SIZE + 1]
+    )
+    return JsonResponse({
+        'results': results[:ITEM_SEARCH_PAGE_SIZE],
+        'page': page,
+        'has_next': len(results) > ITEM_SEARCH_PAGE_SIZE,
+    })
+
+
+@require_GET
+@cache_control(no_cache=True)
+@condition(etag_func=get_catalog_page_etag)
+def list_items_api(request):
+    """
+    Catalog API: the list of the items ordered by id, paginated by a keyset cursor (see item.catalog_api).
+    The pages up to ITEM_API_CACHED_PAGE_SIZE items are cached, the larger ones are streamed.
+    Supports conditional GET requests (ETag).
+
+    :param request: HTTP request object, with the 'cursor' (the next_cursor of the previous page, none for the first
+    page), 'limit' (the page size) and 'fields' (comma-separated item fields) GET parameters.
+    :return: A JSON response: {'results': [{field: value, ...}, ...], 'next_cursor': int or None},
+    400 with {'detail': str} if the parameters are invalid.
+    """
+    try:
+        query = parse_catalog_query(request)
+    except CatalogQueryError as e:
+        return JsonResponse({'detail': str(e)}, status=400)
+    if query.limit > ITEM_API_CACHED_PAGE_SIZE:
+        return StreamingHttpResponse(iter_catalog_page(query), content_type='application/json')
+    return HttpResponse(get_catalog_page(query), content_type='application/json')
+
+
+@require_GET
+@cache_control(no_cache=True)
+@condition(etag_func=get_catalog_item_etag, last_modified_func=get_item_last_modified)
+def get_item_api(request, item_id):
+    """
+    Catalog API: a single item, cached per item version. Supports conditional GET requests (ETag and Last-Modified).
+
+    :param request: HTTP request object, with the 'fields' (comma-separated item fields) GET parameter.
+    :param item_id: ID of the item.
+    :return: A JSON response: {field: value, ...}, 404 or 400 with {'detail': str}.
+    """
+    try:
+        fields = parse_fields(request)
+    except CatalogQueryError as e:
+        return JsonResponse({'detail': str(e)}, status=400)
+    document = get_catalog_item(item_id, fields)
+    if document is None:
+        return JsonResponse({'detail': 'No Item matches the given query.'}, status=404)
+    return HttpResponse(document, content_type='application/json')
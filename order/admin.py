@@ -1,10 +1,42 @@
 from django.contrib import admin
 
-from order.models import Order
+from item.admin import IdSearchMixin
+from order.models import Order, OrderLine, SalesRollup
+
+
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    fields = ('item', 'quantity', 'unit_price', 'currency',)
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
 
 
 @admin.register(Order)
-class AdminItem(admin.ModelAdmin):
-    list_display = ('id', 'payment_status', 'total_price', 'currency', 'created_at',)
+class AdminItem(IdSearchMixin, admin.ModelAdmin):
+    list_display = ('id', 'payment_status', 'total_price', 'currency', 'created_at', 'paid_at',)
     list_filter = ('payment_status',)
-    search_fields = ('id',)
+    # an exact lookup, uses the unique index of stripe_session_id
+    search_fields = ('stripe_session_id__exact',)
+    inlines = (OrderLineInline,)
+
+
+@admin.register(SalesRollup)
+class AdminSalesRollup(admin.ModelAdmin):
+    """
+    Read-only view of the hourly sales rollups, refreshed by the refresh_sales_rollups_task.
+    """
+    list_display = ('hour', 'currency', 'tax', 'discount', 'orders_count', 'revenue',)
+    list_filter = ('currency', 'tax', 'discount',)
+    list_select_related = ('tax', 'discount',)
+    date_hierarchy = 'hour'
+    ordering = ('-hour',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
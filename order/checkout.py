@@ -0,0 +1,147 @@
+"""
+The deferred checkout (CHECKOUT_DEFERRED): the checkout views save the order with its locally computed totals and
+return at once, without waiting for the Stripe API. The Stripe Checkout Session is created by the
+order.tasks.create_checkout_session task, which saves the session's url (or the error) to the order.
+The browser is sent to a waiting page (order.views.checkout_page), which gets the url from a Server-Sent Events stream
+(order.views.checkout_events, served without blocking a worker under ASGI, and holding a worker thread while waiting
+under WSGI), or by polling order.views.checkout_status.
+"""
+import asyncio
+import json
+import time
+from functools import partial
+from typing import AsyncIterator, Iterator
+
+from django.db import transaction
+
+from config.settings import CHECKOUT_WAIT_POLL_INTERVAL, CHECKOUT_WAIT_TIMEOUT
+from config.tracing import set_span_attributes
+from item.models import Item
+from order.models import Order, OrderLine
+from order.service import ProjectStripeSession
+from order.tasks import create_checkout_session
+from pricing.engine import Quote
+
+CHECKOUT_STATE_FIELDS = ('checkout_url', 'checkout_error')
+# the browser reconnects to the event stream after this delay, milliseconds
+CHECKOUT_EVENTS_RETRY = 1000
+
+
+def save_order(order: Order, order_lines: list[OrderLine]) -> None:
+    """
+    Saves the Order instance and its order lines in a single transaction, with two INSERT queries.
+
+    :param order: an unsaved order.Order instance.
+    :param order_lines: a list of the order's unsaved order.OrderLine instances.
+    """
+    with transaction.atomic():
+        order.save()
+        OrderLine.objects.bulk_create(order_lines)
+
+
+def defer_checkout(order: Order, order_lines: list[OrderLine], quote: Quote) -> None:
+    """
+    Saves the order with the quote's totals and its order lines, without a Checkout Session,
+    and queues the create_checkout_session task once the transaction is committed.
+
+    :param order: an unsaved order.Order instance.
+    :param order_lines: a list of the order's unsaved order.OrderLine instances.
+    :param quote: the order totals (see order.service.ProjectStripeSession.quote).
+    """
+    order.total_price = quote.total
+    order.currency = quote.currency
+    save_order(order, order_lines)
+    # the task is queued in the current trace, which is found by the order id (see config.tracing)
+    set_span_attributes(order_id=order.pk)
+    # the task is queued once the order is committed (e.g. with ATOMIC_REQUESTS), so the worker finds it
+    transaction.on_commit(partial(create_checkout_session.delay, order.pk))
+
+
+def defer_item_checkout(item: Item) -> Order:
+    """
+    Saves an order of a single item (quantity 1) and queues its Checkout Session creation (see defer_checkout).
+
+    :param item: an item.Item instance.
+    :return: the saved order.Order instance.
+    """
+    order = Order()
+    order_lines = [OrderLine(order=order, item=item, quantity=1, unit_price=item.price, currency=item.currency)]
+    defer_checkout(order, order_lines, ProjectStripeSession(items=[item]).quote())
+    return order
+
+
+def get_checkout_state(values: dict) -> dict:
+    """
+    Returns the state of an order's deferred checkout.
+
+    :param values: the CHECKOUT_STATE_FIELDS values of the order.
+    :return: {'status': 'ready', 'checkout_url': str}, {'status': 'failed', 'detail': str} or {'status': 'pending'}.
+    """
+    if values['checkout_url']:
+        return {'status': 'ready', 'checkout_url': values['checkout_url']}
+    if values['checkout_error']:
+        return {'status': 'failed', 'detail': values['checkout_error']}
+    return {'status': 'pending'}
+
+
+def get_checkout_event(values: dict | None, deadline: float) -> str | None:
+    """
+    Returns the last event of the checkout state stream: the order's state once it is ready or failed,
+    or the pending state after the deadline. None while the order is pending.
+
+    :param values: the CHECKOUT_STATE_FIELDS values of the order, None if it does not exist.
+    :param deadline: the time.monotonic() time the stream ends at.
+    """
+    state = get_checkout_state(values) if values is not None else {'status': 'failed', 'detail': 'Not found'}
+    if state['status'] != 'pending' or time.monotonic() >= deadline:
+        return f'data: {json.dumps(state)}\n\n'
+    return None
+
+
+async def iter_checkout_events(order_id: int, timeout: float = CHECKOUT_WAIT_TIMEOUT,
+                               poll_interval: float = CHECKOUT_WAIT_POLL_INTERVAL) -> AsyncIterator[str]:
+    """
+    Serializes the checkout state of an order as Server-Sent Events: the order is checked every poll_interval seconds
+    (a primary key lookup), and its state is sent once it is ready or failed. If it is still pending after timeout
+    seconds, the pending state is sent and the stream ends, the browser reconnects after CHECKOUT_EVENTS_RETRY.
+
+    :param order_id: id of an existing order.Order instance.
+    :param timeout: the max duration of the stream, seconds.
+    :param poll_interval: the delay between the order checks, seconds.
+    :return: an async iterator of the event stream pieces.
+    """
+    yield f'retry: {CHECKOUT_EVENTS_RETRY}\n\n'
+    deadline = time.monotonic() + timeout
+    while True:
+        values = await Order.objects.filter(pk=order_id).values(*CHECKOUT_STATE_FIELDS).afirst()
+        event = get_checkout_event(values, deadline)
+        if event is not None:
+            yield event
+            return
+        # a comment line, detects the closed connections
+        yield ': pending\n\n'
+        await asyncio.sleep(poll_interval)
+
+
+def iter_checkout_events_sync(order_id: int, timeout: float = CHECKOUT_WAIT_TIMEOUT,
+                              poll_interval: float = CHECKOUT_WAIT_POLL_INTERVAL) -> Iterator[str]:
+    """
+    The iterator of iter_checkout_events for the app served under WSGI, where a streaming response of an async
+    iterator is consumed at once (so nothing would be sent until the end of the stream).
+    The worker thread serving the stream is held while waiting.
+
+    :param order_id: id of an existing order.Order instance.
+    :param timeout: the max duration of the stream, seconds.
+    :param poll_interval: the delay between the order checks, seconds.
+    :return: an iterator of the event stream pieces.
+    """
+    yield f'retry: {CHECKOUT_EVENTS_RETRY}\n\n'
+    deadline = time.monotonic() + timeout
+    while True:
+        values = Order.objects.filter(pk=order_id).values(*CHECKOUT_STATE_FIELDS).first()
+        event = get_checkout_event(values, deadline)
+        if event is not None:
+            yield event
+            return
+        yield ': pending\n\n'
+        time.sleep(poll_interval)
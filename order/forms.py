@@ -1,7 +1,7 @@
 from django import forms
 
 from item.models import Item
-from order.models import Order
+from order.models import Order, OrderLine
 from pricing.models.discount import Discount
 from pricing.models.tax import Tax
 
@@ -12,10 +12,6 @@ class OrderForm(forms.ModelForm):
         super().__init__(*args, **kwargs)
         for field_name, field in self.fields.items():
             field.widget.attrs['class'] = 'form-control'
-            if field_name == 'items':
-                self.fields[field_name] = forms.ModelMultipleChoiceField(
-                    queryset=Item.objects.all(), )
-                self.fields[field_name].widget.attrs['class'] = 'form-control'
             if field_name == 'discount':
                 self.fields[field_name] = forms.ModelChoiceField(
                     queryset=Discount.objects.all(), required=False)
@@ -25,6 +21,70 @@ class OrderForm(forms.ModelForm):
                     queryset=Tax.objects.all(), required=False)
                 self.fields[field_name].widget.attrs['class'] = 'form-control'
 
+    def _get_validation_exclusions(self):
+        """
+        The tax and discount are already looked up by their ModelChoiceFields,
+        so they are not looked up again by the model validation of the foreign keys.
+        """
+        return super()._get_validation_exclusions() | {'tax', 'discount'}
+
     class Meta:
         model = Order
-        exclude = ('created_at', 'total_price', 'payment_status',)
+        # the rest of the fields are set by the server only: the checkout, payment and rollup state of the order
+        fields = ('tax', 'discount')
+
+
+class OrderLineForm(forms.Form):
+    """
+    An order line: an item id (picked with the item.views.search_items autocomplete) and its quantity.
+    The item ids of all the lines are validated by OrderLineFormSet with a single query.
+    """
+    item = forms.IntegerField(min_value=1, widget=forms.TextInput(attrs={'list': 'items-search-results'}))
+    quantity = forms.IntegerField(min_value=1, initial=1)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for field_name, field in self.fields.items():
+            field.widget.attrs['class'] = 'form-control'
+
+
+class BaseOrderLineFormSet(forms.BaseFormSet):
+
+    @classmethod
+    def get_default_prefix(cls):
+        return 'lines'
+
+    def clean(self):
+        """
+        Loads the items of all the lines with a single query, and checks that they exist.
+        """
+        if any(self.errors):
+            return
+        item_ids = {form.cleaned_data['item'] for form in self.forms if form.cleaned_data}
+        self.items = Item.objects.in_bulk(item_ids)
+        for form in self.forms:
+            if form.cleaned_data and form.cleaned_data['item'] not in self.items:
+                form.add_error('item', f"Item {form.cleaned_data['item']} does not exist")
+
+    def get_order_lines(self, order: Order) -> list[OrderLine]:
+        """
+        Returns the order lines of the filled forms (not saved yet), with the snapshot of the items' prices and
+        currencies. The quantities of a repeated item are summed up into a single line.
+
+        :param order: an order.Order instance.
+        :return: a list of order.OrderLine instances.
+        """
+        order_lines = {}
+        for form in self.forms:
+            if not form.cleaned_data:
+                continue
+            item = self.items[form.cleaned_data['item']]
+            if item.pk not in order_lines:
+                order_lines[item.pk] = OrderLine(
+                    order=order, item=item, quantity=0, unit_price=item.price, currency=item.currency)
+            order_lines[item.pk].quantity += form.cleaned_data['quantity']
+        return list(order_lines.values())
+
+
+OrderLineFormSet = forms.formset_factory(
+    OrderLineForm, formset=BaseOrderLineFormSet, extra=3, min_num=1, validate_min=True)
@@ -0,0 +1,106 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+
+from django.core.management import BaseCommand, CommandError
+from kombu import Queue
+
+from benchmarks.fake_apis import FakeAPIServer
+from config.celery import app as celery_app
+from item.tasks import archive_stripe_product
+
+# the worker pools compared by default: pool name -> concurrency (see the celery and celery-io docker-compose services)
+DEFAULT_POOLS = ('prefork:4', 'eventlet:100')
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the celery worker pools on a Stripe I/O-bound task (item.tasks.archive_stripe_product) against '
+        'a local fake Stripe server with an injected latency. For every pool, the tasks are queued to a separate '
+        'queue of the configured broker, a worker consuming it is started, and the tasks/sec are measured by the fake '
+        'Stripe server. The results are saved as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tasks', type=int, default=500, help='number of the tasks per pool')
+        parser.add_argument('--latency', type=float, default=0.2, help='fake Stripe latency per request, seconds')
+        parser.add_argument('--pool', action='append', help='a worker pool and its concurrency, e.g. eventlet:100')
+        parser.add_argument('--timeout', type=float, default=300, help='max time per pool, seconds')
+        parser.add_argument('--output', default='bench_celery_results.json', help='the JSON results file')
+
+    def handle(self, *args, **options):
+        results = {}
+        with FakeAPIServer(latency=options['latency']) as fake_api:
+            for pool_option in options['pool'] or DEFAULT_POOLS:
+                pool, _, concurrency = pool_option.partition(':')
+                results[pool_option] = self.__run_pool(
+                    fake_api, pool, int(concurrency or 1), options['tasks'], options['timeout'])
+                result = results[pool_option]
+                self.stdout.write(
+                    f"{pool_option}: {result['tasks_per_second']} tasks/sec, "
+                    f"{result['completed']}/{options['tasks']} tasks in {result['seconds']} s")
+
+        report = {
+            'created_at': datetime.now(tz=timezone.utc).isoformat(),
+            'tasks': options['tasks'],
+            'latency': options['latency'],
+            'pools': results,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results are saved to {options['output']}"))
+
+    @staticmethod
+    def __run_pool(fake_api: FakeAPIServer, pool: str, concurrency: int, tasks: int, timeout: float) -> dict:
+        """
+        Queues the tasks, runs a worker with the pool until all of them are done, and measures the throughput
+        from the first to the last Stripe request.
+
+        :return: the number of the completed tasks, the seconds taken and the tasks per second.
+        """
+        queue = f'bench_{uuid.uuid4().hex}'
+        fake_api.reset_calls()
+        for index in range(tasks):
+            archive_stripe_product.apply_async(args=[f'prod_bench{index}'], queue=queue)
+
+        worker = subprocess.Popen(
+            [sys.executable, '-m', 'celery', '-A', 'config', 'worker', '-P', pool, '-c', str(concurrency),
+             '-Q', queue, '-n', f'{queue}@%h', '--without-heartbeat', '--without-gossip', '--without-mingle',
+             '-l', 'WARNING'],
+            env={
+                **os.environ,
+                'STRIPE_API_BASE': fake_api.url,
+                'STRIPE_API_KEY': 'sk_test_benchmark',
+                'STRIPE_HTTP_POOL_MAXSIZE': str(concurrency),
+            },
+        )
+        try:
+            started_at = time.monotonic()
+            while fake_api.calls['product_modify'] < tasks and time.monotonic() - started_at < timeout:
+                if worker.poll() is not None:
+                    raise CommandError(f'The {pool} worker has exited with the code {worker.returncode}')
+                time.sleep(0.1)
+            # the last requests are still being responded to
+            time.sleep(fake_api.latency + 1)
+        finally:
+            worker.send_signal(signal.SIGTERM)
+            worker.wait(timeout=30)
+            with celery_app.connection_for_write() as connection:
+                Queue(queue).bind(connection.default_channel).delete()
+
+        call_times = fake_api.call_times
+        completed = fake_api.calls['product_modify']
+        # the last request is responded to the latency after it is received
+        seconds = call_times[-1] - call_times[0] + fake_api.latency if call_times else 0
+        return {
+            'pool': pool,
+            'concurrency': concurrency,
+            'completed': completed,
+            'seconds': round(seconds, 2),
+            'tasks_per_second': round(completed / seconds, 1) if seconds else 0,
+        }
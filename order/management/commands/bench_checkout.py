@@ -0,0 +1,159 @@
+import json
+import statistics
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.management import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from benchmarks.fake_apis import FakeAPIServer
+from config import settings
+from config.clients import get_stripe
+from config.celery import app as celery_app
+from item.models import Item, ItemStripePrice
+from order.models import Order
+from order.tasks import sweep_payment_statuses, refresh_fx_rates_task
+from order.utils import get_fx_rates_cache_key
+from pricing.models.discount import Discount
+from pricing.models.tax import Tax
+
+# scenario name -> (kind, items count, mixed currency, with tax and discount)
+SCENARIOS = {
+    'buy_item': ('buy_item', 1, False, False),
+    'create_order_1_item': ('create_order', 1, False, False),
+    'create_order_5_items': ('create_order', 5, False, False),
+    'create_order_50_items': ('create_order', 50, False, False),
+    'create_order_5_items_mixed_currency': ('create_order', 5, True, False),
+    'create_order_5_items_tax_discount': ('create_order', 5, False, True),
+    'create_order_5_items_mixed_currency_tax_discount': ('create_order', 5, True, True),
+    'task_sweep_payment_statuses': ('sweep_payment_statuses', 50, False, False),
+    'task_refresh_fx_rates': ('refresh_fx_rates', 0, False, False),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the checkout paths (buy_item, CreateOrderView, order.tasks) against a local fake Stripe and '
+        'fixer.io server with an injected latency. Runs in a separate test database. Reports p50/p95/p99 latency, '
+        'the Stripe/fixer.io API calls and the DB queries per run of each scenario, and saves them as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--latency', type=float, default=0.05, help='fake API latency per request, seconds')
+        parser.add_argument('--iterations', type=int, default=20, help='number of runs per scenario')
+        parser.add_argument('--cold', action='store_true', help='reset the Stripe catalog ids before every run')
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='run only these scenarios')
+        parser.add_argument('--output', default='bench_results.json', help='the JSON results file')
+
+    def handle(self, *args, **options):
+        # background tasks (e.g. the item catalog sync) are run in the process, no broker is needed
+        celery_app.conf.task_always_eager = True
+        test_runner = DiscoverRunner(interactive=False, verbosity=0)
+        old_config = test_runner.setup_databases()
+        try:
+            with FakeAPIServer(latency=options['latency']) as fake_api:
+                self.__use_fake_api(fake_api)
+                self.__seed()
+                results = {
+                    name: self.__run_scenario(fake_api, *SCENARIOS[name], options['iterations'], options['cold'])
+                    for name in options['scenario'] or SCENARIOS
+                }
+        finally:
+            test_runner.teardown_databases(old_config)
+
+        report = {
+            'created_at': datetime.now(tz=timezone.utc).isoformat(),
+            'latency': options['latency'],
+            'iterations': options['iterations'],
+            'cold': options['cold'],
+            'scenarios': results,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name}: p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms, "
+                f"API calls {result['api_calls']}, DB queries {result['db_queries']}")
+        self.stdout.write(self.style.SUCCESS(f"Results are saved to {options['output']}"))
+
+    @staticmethod
+    def __use_fake_api(fake_api: FakeAPIServer) -> None:
+        # the Stripe client is configured first, so its first use does not reset the fake api_base
+        stripe = get_stripe()
+        stripe.api_base = fake_api.url
+        stripe.api_key = 'sk_test_benchmark'
+        settings.FIXER_API_URL = f'{fake_api.url}/api'
+        cache.delete(get_fx_rates_cache_key())
+
+    @staticmethod
+    def __seed() -> None:
+        Item.objects.bulk_create([
+            Item(name=f'Item {i}', description='Benchmark item', price=Decimal(100 + i), currency=currency)
+            for currency in ('eur', 'rub') for i in range(50)
+        ])
+        Tax.objects.create(name='Benchmark tax', rate=Decimal('20.00'))
+        Discount.objects.create(name='Benchmark discount', percent_off=Decimal('10.00'))
+
+    def __run_scenario(self, fake_api, kind: str, items_count: int, mixed_currency: bool, with_pricing: bool,
+                       iterations: int, cold: bool) -> dict:
+        """
+        Runs the scenario iterations times, one warm-up run first.
+
+        :return: the latency percentiles, and the mean API calls (by endpoint) and DB queries per run.
+        """
+        if mixed_currency:
+            items = list(Item.objects.filter(currency='eur')[:items_count - items_count // 2]) + list(
+                Item.objects.filter(currency='rub')[:items_count // 2])
+        else:
+            items = list(Item.objects.filter(currency='eur')[:items_count])
+        data = {'lines-TOTAL_FORMS': len(items), 'lines-INITIAL_FORMS': 0}
+        for index, item in enumerate(items):
+            data.update({f'lines-{index}-item': item.pk, f'lines-{index}-quantity': 1})
+        if with_pricing:
+            data.update(tax=Tax.objects.get().pk, discount=Discount.objects.get().pk)
+
+        run = {
+            'buy_item': lambda: Client().get(reverse('item:buy_item', args=[items[0].pk])),
+            'create_order': lambda: Client().post(reverse('order:create_order'), data),
+            'sweep_payment_statuses': lambda: sweep_payment_statuses(),
+            'refresh_fx_rates': lambda: refresh_fx_rates_task(),
+        }[kind]
+        if kind == 'sweep_payment_statuses':
+            Order.objects.bulk_create([
+                Order(stripe_session_id=fake_api.create_session({})['id']) for _ in range(items_count)])
+
+        latencies, api_calls, db_queries = [], Counter(), 0
+        for iteration in range(iterations + 1):
+            if kind == 'sweep_payment_statuses':
+                Order.objects.update(payment_status='unpaid')
+            if cold:
+                Item.objects.update(stripe_product_id=None)
+                ItemStripePrice.objects.all().delete()
+                Tax.objects.update(stripe_tax_rate_id=None)
+                Discount.objects.update(stripe_coupon_ids={})
+            fake_api.reset_calls()
+            with CaptureQueriesContext(connection) as queries:
+                started_at = time.perf_counter()
+                run()
+                latency = time.perf_counter() - started_at
+            if iteration == 0:
+                continue
+            latencies.append(latency)
+            api_calls.update(fake_api.reset_calls())
+            db_queries += len(queries)
+
+        percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        return {
+            'p50_ms': round(percentiles[49] * 1000, 1),
+            'p95_ms': round(percentiles[94] * 1000, 1),
+            'p99_ms': round(percentiles[98] * 1000, 1),
+            'api_calls': {endpoint: round(count / iterations, 2) for endpoint, count in sorted(api_calls.items())},
+            'db_queries': round(db_queries / iterations, 2),
+        }
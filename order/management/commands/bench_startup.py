@@ -0,0 +1,187 @@
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+
+from django.core.management import BaseCommand, CommandError
+from kombu import Queue
+
+from benchmarks.fake_apis import FakeAPIServer
+from config.celery import app as celery_app
+from item.tasks import archive_stripe_product
+
+# the web server modes compared by default: mode -> the environment of gunicorn.conf.py
+WEB_MODES = {
+    'preload': {'GUNICORN_PRELOAD': 'True'},
+    'no_preload': {'GUNICORN_PRELOAD': 'False'},
+}
+# the celery worker pools compared by default (see the celery and celery-io docker-compose services)
+DEFAULT_POOLS = ('prefork:4', 'eventlet:100')
+
+
+def get_pss_mb(pid: int) -> float | None:
+    """
+    Returns the proportional set size (the private memory and the process' share of the shared memory) of a process
+    and its child processes, MB. None if it is not available (only Linux has /proc/{pid}/smaps_rollup).
+    """
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as children_file:
+            children = [int(child) for child in children_file.read().split()]
+        pss_kb = 0
+        for process_id in (pid, *children):
+            with open(f'/proc/{process_id}/smaps_rollup') as smaps_file:
+                pss_kb += next(int(line.split()[1]) for line in smaps_file if line.startswith('Pss:'))
+    except (OSError, StopIteration):
+        return None
+    return round(pss_kb / 1024, 1)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the cold start of the processes: the time from the start of the production web server '
+        '(gunicorn.conf.py, with and without preload_app) to its first response, and from the start of a celery worker '
+        'to its first task (a Stripe task, against a local fake Stripe server). The web server uses the configured '
+        'database, the worker uses the configured broker. The median of the runs is saved as JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=3, help='number of the runs per mode')
+        parser.add_argument('--workers', type=int, default=4, help='number of the web server workers')
+        parser.add_argument('--path', default='/item/search?q=item', help='the path of the first web request')
+        parser.add_argument('--pool', action='append', help='a worker pool and its concurrency, e.g. eventlet:100')
+        parser.add_argument('--timeout', type=float, default=60, help='max time to the first request, seconds')
+        parser.add_argument('--output', default='bench_startup_results.json', help='the JSON results file')
+
+    def handle(self, *args, **options):
+        results = {'web': {}, 'worker': {}}
+        for mode, env in WEB_MODES.items():
+            runs = [
+                self.__run_web_server(env, options['workers'], options['path'], options['timeout'])
+                for _ in range(options['runs'])
+            ]
+            results['web'][mode] = self.__summarize(runs)
+            self.stdout.write(f"web {mode}: {self.__describe(results['web'][mode])}")
+
+        with FakeAPIServer() as fake_api:
+            for pool_option in options['pool'] or DEFAULT_POOLS:
+                pool, _, concurrency = pool_option.partition(':')
+                runs = [
+                    self.__run_worker(fake_api, pool, int(concurrency or 1), options['timeout'])
+                    for _ in range(options['runs'])
+                ]
+                results['worker'][pool_option] = self.__summarize(runs)
+                self.stdout.write(f"worker {pool_option}: {self.__describe(results['worker'][pool_option])}")
+
+        report = {
+            'created_at': datetime.now(tz=timezone.utc).isoformat(),
+            'runs': options['runs'],
+            'web_workers': options['workers'],
+            'path': options['path'],
+            'results': results,
+        }
+        with open(options['output'], 'w') as output:
+            json.dump(report, output, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results are saved to {options['output']}"))
+
+    @staticmethod
+    def __summarize(runs: list[dict]) -> dict:
+        return {
+            key: round(statistics.median(run[key] for run in runs), 3) if runs[0][key] is not None else None
+            for key in runs[0]
+        }
+
+    @staticmethod
+    def __describe(result: dict) -> str:
+        return ', '.join(f'{key} {value}' for key, value in result.items())
+
+    @staticmethod
+    def __run_web_server(env: dict, workers: int, path: str, timeout: float) -> dict:
+        """
+        Starts the web server and sends the request until the first response.
+
+        :return: the seconds to the first response, the first and the second response time,
+        and the memory of the server processes after the first response.
+        """
+        with socket.socket() as free_socket:
+            free_socket.bind(('127.0.0.1', 0))
+            port = free_socket.getsockname()[1]
+        url = f'http://127.0.0.1:{port}{path}'
+
+        started_at = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+             '--workers', str(workers), '--log-level', 'warning', '--access-logfile', '/dev/null'],
+            env={**os.environ, **env},
+        )
+        try:
+            while True:
+                if server.poll() is not None:
+                    raise CommandError(f'The web server has exited with the code {server.returncode}')
+                if time.perf_counter() - started_at > timeout:
+                    raise CommandError(f'No response in {timeout} seconds')
+                request_started_at = time.perf_counter()
+                try:
+                    urllib.request.urlopen(url, timeout=timeout).read()
+                except urllib.error.URLError as e:
+                    if isinstance(e, urllib.error.HTTPError):
+                        raise CommandError(f'{url} has responded with {e.code}')
+                    time.sleep(0.01)
+                    continue
+                first_response_at = time.perf_counter()
+                break
+            urllib.request.urlopen(url, timeout=timeout).read()
+            return {
+                'seconds_to_first_response': first_response_at - started_at,
+                'first_response_seconds': first_response_at - request_started_at,
+                'second_response_seconds': time.perf_counter() - first_response_at,
+                'pss_mb': get_pss_mb(server.pid),
+            }
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=30)
+
+    @staticmethod
+    def __run_worker(fake_api: FakeAPIServer, pool: str, concurrency: int, timeout: float) -> dict:
+        """
+        Queues a Stripe task, starts a worker consuming it, and waits for the task's Stripe request.
+
+        :return: the seconds to the first task's Stripe request, and the memory of the worker processes.
+        """
+        queue = f'bench_{uuid.uuid4().hex}'
+        fake_api.reset_calls()
+        archive_stripe_product.apply_async(args=['prod_bench'], queue=queue)
+
+        started_at = time.perf_counter()
+        worker = subprocess.Popen(
+            [sys.executable, '-m', 'celery', '-A', 'config', 'worker', '-P', pool, '-c', str(concurrency),
+             '-Q', queue, '-n', f'{queue}@%h', '--without-heartbeat', '--without-gossip', '--without-mingle',
+             '-l', 'WARNING'],
+            env={**os.environ, 'STRIPE_API_BASE': fake_api.url, 'STRIPE_API_KEY': 'sk_test_benchmark'},
+        )
+        try:
+            while not fake_api.calls['product_modify']:
+                if worker.poll() is not None:
+                    raise CommandError(f'The {pool} worker has exited with the code {worker.returncode}')
+                if time.perf_counter() - started_at > timeout:
+                    raise CommandError(f'No task is run in {timeout} seconds')
+                time.sleep(0.01)
+            seconds_to_first_task = time.perf_counter() - started_at
+            # the task is still being finished
+            time.sleep(1)
+            return {
+                'seconds_to_first_task': seconds_to_first_task,
+                'pss_mb': get_pss_mb(worker.pid),
+            }
+        finally:
+            worker.send_signal(signal.SIGTERM)
+            worker.wait(timeout=30)
+            with celery_app.connection_for_write() as connection:
+                Queue(queue).bind(connection.default_channel).delete()
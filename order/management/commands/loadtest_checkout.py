@@ -0,0 +1,55 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Load tests the checkout endpoints of a running server: compares the throughput of the sync (buy_item) '
+        'and the async (abuy_item) paths. Run the server under ASGI (uvicorn config.asgi:application) to compare them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('item_id', type=int, help='id of the Item instance to be bought')
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='the server url')
+        parser.add_argument('--requests', type=int, default=200, help='number of requests per path')
+        parser.add_argument('--concurrency', type=int, default=50, help='number of concurrent clients')
+
+    def handle(self, *args, **options):
+        for path in (f'/buy/{options["item_id"]}', f'/async/buy/{options["item_id"]}'):
+            self.stdout.write(self.__run(options['base_url'] + path, options['requests'], options['concurrency']))
+
+    @staticmethod
+    def __run(url: str, requests_count: int, concurrency: int) -> str:
+        """
+        Sends requests_count GET requests to the url by concurrency clients.
+
+        :return: a report line with the throughput, the latency percentiles and the number of failed requests.
+        """
+        session = requests.Session()
+        session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+        def send_request(_) -> tuple[float, bool]:
+            started_at = time.perf_counter()
+            try:
+                response = session.get(url, timeout=60)
+                is_ok = response.status_code == 200
+            except requests.RequestException:
+                is_ok = False
+            return time.perf_counter() - started_at, is_ok
+
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(send_request, range(requests_count)))
+        duration = time.perf_counter() - started_at
+
+        latencies = sorted(latency for latency, _ in results)
+        percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        failed = sum(1 for _, is_ok in results if not is_ok)
+        return (
+            f'{url}: {requests_count / duration:.1f} req/s, '
+            f'p50 {percentiles[49] * 1000:.0f} ms, p95 {percentiles[94] * 1000:.0f} ms, failed {failed}'
+        )
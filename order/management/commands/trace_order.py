@@ -0,0 +1,68 @@
+import json
+from datetime import datetime, timezone
+
+from django.core.management import BaseCommand, CommandError
+
+from config.settings import TRACING_FILE
+from order.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        'Shows the timeline of an order: all the spans (the views, the Stripe and fixer.io requests, the celery tasks) '
+        'of the traces related to the order, read from the TRACING_FILE spans file (see config.tracing).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('order_id', type=int, help='id of the order')
+        parser.add_argument('--file', default=TRACING_FILE, help='the spans file, TRACING_FILE by default')
+
+    def handle(self, *args, **options):
+        if not options['file']:
+            raise CommandError('Tracing is off: set TRACING_FILE or pass --file')
+        order_id = options['order_id']
+        stripe_session_id = Order.objects.filter(pk=order_id).values_list('stripe_session_id', flat=True).first()
+
+        # the file can be large, it is read twice instead of being loaded: the traces of the order, then their spans
+        trace_ids = {
+            record['trace_id'] for record in self.__read_spans(options['file'])
+            if self.__is_order_span(record['attributes'], order_id, stripe_session_id)
+        }
+        if not trace_ids:
+            raise CommandError(f'No spans of the order {order_id} in {options["file"]}')
+        spans = sorted(
+            (record for record in self.__read_spans(options['file']) if record['trace_id'] in trace_ids),
+            key=lambda record: record['start_time'])
+
+        spans_by_id = {record['span_id']: record for record in spans}
+        started_at = spans[0]['start_time']
+        self.stdout.write(
+            f'Order {order_id}: {len(spans)} spans of {len(trace_ids)} traces, '
+            f'from {datetime.fromtimestamp(started_at, tz=timezone.utc).isoformat()}')
+        for record in spans:
+            depth, parent = 0, spans_by_id.get(record['parent_id'])
+            while parent is not None:
+                depth, parent = depth + 1, spans_by_id.get(parent['parent_id'])
+            line = (f"{(record['start_time'] - started_at) * 1000:>10.1f} ms  {'  ' * depth}{record['name']} "
+                    f"{record['duration_ms']:.1f} ms [{record['process']}]")
+            if record['status'] != 'ok':
+                line = self.style.ERROR(f"{line} {record['error'] or record['status']}")
+            self.stdout.write(line)
+
+    @staticmethod
+    def __read_spans(path: str):
+        try:
+            with open(path) as trace_file:
+                for line in trace_file:
+                    # a line being written by another process is skipped
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+        except FileNotFoundError:
+            raise CommandError(f'{path} does not exist')
+
+    @staticmethod
+    def __is_order_span(attributes: dict, order_id: int, stripe_session_id: str | None) -> bool:
+        return (attributes.get('order_id') == order_id or order_id in attributes.get('order_ids', ())
+                or bool(stripe_session_id) and attributes.get('stripe_session_id') == stripe_session_id)
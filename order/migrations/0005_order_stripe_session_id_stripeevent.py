@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0004_alter_order_payment_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_id', models.CharField(max_length=255, unique=True, verbose_name='event_id')),
+                ('type', models.CharField(max_length=100, verbose_name='type')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='received_at')),
+            ],
+            options={
+                'verbose_name': 'Stripe event',
+                'verbose_name_plural': 'Stripe events',
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='stripe_session_id',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True, verbose_name='stripe_session_id'),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def snapshot_item_prices(apps, schema_editor):
+    """
+    Copies the current price and currency of the items to the existing order lines.
+    """
+    Item = apps.get_model('item', 'Item')
+    OrderLine = apps.get_model('order', 'OrderLine')
+    items = Item.objects.filter(pk=models.OuterRef('item_id'))
+    OrderLine.objects.update(
+        unit_price=models.Subquery(items.values('price')[:1]),
+        currency=models.Subquery(items.values('currency')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('item', '0005_item_stripe_catalog'),
+        ('order', '0005_order_stripe_session_id_stripeevent'),
+    ]
+
+    operations = [
+        # OrderLine takes over the order_order_items table of the Order.items many-to-many relation,
+        # so only the new columns are added to the database
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='OrderLine',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_lines', to='item.item', verbose_name='item')),
+                        ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='order.order', verbose_name='order')),
+                    ],
+                    options={
+                        'verbose_name': 'Order line',
+                        'verbose_name_plural': 'Order lines',
+                        'db_table': 'order_order_items',
+                        'unique_together': {('order', 'item')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='order',
+                    name='items',
+                    field=models.ManyToManyField(related_name='orders', through='order.OrderLine', to='item.item', verbose_name='order_items'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1, verbose_name='quantity'),
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, default=0.0, max_digits=15, verbose_name='unit_price'),
+        ),
+        migrations.AddField(
+            model_name='orderline',
+            name='currency',
+            field=models.CharField(blank=True, max_length=3, null=True, verbose_name='currency'),
+        ),
+        migrations.RunPython(snapshot_item_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0006_orderline'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['payment_status', 'created_at'], name='order_status_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at'], name='order_created_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('payment_status', 'unpaid'), ('stripe_session_id__isnull', False)), fields=['created_at'], name='order_unpaid_created_at_idx'),
+        ),
+    ]
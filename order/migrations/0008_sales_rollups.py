@@ -0,0 +1,73 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_paid_at(apps, schema_editor):
+    """
+    Sets the creation time as the payment time of the orders paid before paid_at was introduced.
+    """
+    Order = apps.get_model('order', 'Order')
+    Order.objects.filter(payment_status='paid', paid_at__isnull=True).update(paid_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pricing', '0004_stripe_tax_rate_coupon_ids'),
+        ('order', '0007_order_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupHighWaterMark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='name')),
+                ('value', models.DateTimeField(blank=True, null=True, verbose_name='value')),
+            ],
+            options={
+                'verbose_name': 'Rollup high-water mark',
+                'verbose_name_plural': 'Rollup high-water marks',
+            },
+        ),
+        migrations.CreateModel(
+            name='SalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField(verbose_name='hour')),
+                ('currency', models.CharField(blank=True, max_length=3, null=True, verbose_name='currency')),
+                ('orders_count', models.PositiveIntegerField(verbose_name='orders_count')),
+                ('revenue', models.DecimalField(decimal_places=2, max_digits=20, verbose_name='revenue')),
+            ],
+            options={
+                'verbose_name': 'Sales rollup',
+                'verbose_name_plural': 'Sales rollups',
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='paid_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='paid_at'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['paid_at'], name='order_paid_at_idx'),
+        ),
+        migrations.RunPython(backfill_paid_at, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='salesrollup',
+            name='discount',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sales_rollups', to='pricing.discount', verbose_name='discount'),
+        ),
+        migrations.AddField(
+            model_name='salesrollup',
+            name='tax',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sales_rollups', to='pricing.tax', verbose_name='tax'),
+        ),
+        migrations.AddIndex(
+            model_name='salesrollup',
+            index=models.Index(fields=['hour'], name='sales_rollup_hour_idx'),
+        ),
+    ]
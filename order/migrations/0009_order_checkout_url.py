@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0008_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='checkout_error',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='checkout_error'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='checkout_url',
+            field=models.URLField(blank=True, max_length=2048, null=True, verbose_name='checkout_url'),
+        ),
+    ]
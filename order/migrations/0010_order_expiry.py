@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-18 01:29
+
+from datetime import timedelta
+
+from django.db import migrations, models
+
+
+def backfill_session_expires_at(apps, schema_editor):
+    """
+    Sets the expiration time of the Checkout Sessions created before session_expires_at was introduced
+    (the creation time plus the CHECKOUT_SESSION_EXPIRATION of that time, 30 minutes).
+    """
+    Order = apps.get_model('order', 'Order')
+    Order.objects.filter(stripe_session_id__isnull=False, session_expires_at__isnull=True).update(
+        session_expires_at=models.F('created_at') + timedelta(minutes=30))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0009_order_checkout_url'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_unpaid_created_at_idx',
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='session_expires_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='session_expires_at'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='payment_status',
+            field=models.CharField(choices=[('unpaid', 'Unpaid'), ('paid', 'Paid'), ('expired', 'Expired'), ('failed', 'Failed')], default='unpaid', max_length=10, verbose_name='payment_status'),
+        ),
+        migrations.RunPython(backfill_session_expires_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('payment_status', 'unpaid'), ('session_expires_at__isnull', False)), fields=['session_expires_at'], name='order_unpaid_expires_at_idx'),
+        ),
+    ]
@@ -9,9 +9,11 @@ class Order(models.Model):
     PAYMENT_STATUS = [
         ('unpaid', 'Unpaid'),
         ('paid', 'Paid'),
+        ('expired', 'Expired'),
+        ('failed', 'Failed'),
     ]
 
-    items = models.ManyToManyField(Item, verbose_name='order_items', related_name='orders')
+    items = models.ManyToManyField(Item, verbose_name='order_items', related_name='orders', through='OrderLine')
     tax = models.ForeignKey(Tax, verbose_name='order_tax', related_name='orders', on_delete=models.SET_NULL, **NULLABLE)
     discount = models.ForeignKey(
         Discount, verbose_name='order_discount', related_name='orders', on_delete=models.SET_NULL, **NULLABLE)
@@ -19,7 +21,13 @@ class Order(models.Model):
     total_price = models.DecimalField(default=0.0, decimal_places=2, max_digits=15, verbose_name='total_price')
     currency = models.CharField(verbose_name='currency', max_length=3, **NULLABLE)
     payment_status = models.CharField(
-        verbose_name='payment_status', choices=PAYMENT_STATUS, default='unpaid', max_length=6)
+        verbose_name='payment_status', choices=PAYMENT_STATUS, default='unpaid', max_length=10)
+    stripe_session_id = models.CharField(verbose_name='stripe_session_id', max_length=255, unique=True, **NULLABLE)
+    session_expires_at = models.DateTimeField(verbose_name='session_expires_at', **NULLABLE)
+    paid_at = models.DateTimeField(verbose_name='paid_at', **NULLABLE)
+    # the Checkout Session url, and the error of its creation in the background (see order.checkout)
+    checkout_url = models.URLField(verbose_name='checkout_url', max_length=2048, **NULLABLE)
+    checkout_error = models.CharField(verbose_name='checkout_error', max_length=255, **NULLABLE)
 
     def __str__(self):
         return f'Order {self.pk} - {self.created_at}'
@@ -27,3 +35,93 @@ class Order(models.Model):
     class Meta:
         verbose_name = 'Order'
         verbose_name_plural = 'Orders'
+        indexes = [
+            # the admin changelist: filtered by payment_status and/or ordered by created_at
+            models.Index(fields=['payment_status', 'created_at'], name='order_status_created_at_idx'),
+            models.Index(fields=['created_at'], name='order_created_at_idx'),
+            # the open Checkout Sessions swept by order.tasks.sweep_payment_statuses, and the overdue ones expired by
+            # order.tasks.expire_orders: the unpaid orders, a small part of the table, as the expired ones leave it
+            models.Index(
+                fields=['session_expires_at'], name='order_unpaid_expires_at_idx',
+                condition=models.Q(payment_status='unpaid', session_expires_at__isnull=False)),
+            # the incremental refresh of the sales rollups (order.rollups)
+            models.Index(fields=['paid_at'], name='order_paid_at_idx'),
+        ]
+
+
+class OrderLine(models.Model):
+    """
+    An item of an order, with its quantity, and the item's price and currency at the moment of the order creation.
+    Is stored in the table of the former Order.items many-to-many relation.
+    """
+    order = models.ForeignKey(Order, verbose_name='order', related_name='lines', on_delete=models.CASCADE)
+    item = models.ForeignKey(Item, verbose_name='item', related_name='order_lines', on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField(verbose_name='quantity', default=1)
+    unit_price = models.DecimalField(verbose_name='unit_price', max_digits=15, decimal_places=2, default=0.0)
+    currency = models.CharField(verbose_name='currency', max_length=3, **NULLABLE)
+
+    def __str__(self):
+        return f'{self.item} x {self.quantity} - {self.order}'
+
+    class Meta:
+        verbose_name = 'Order line'
+        verbose_name_plural = 'Order lines'
+        db_table = 'order_order_items'
+        # the unique index of the former many-to-many table
+        unique_together = [('order', 'item')]
+
+
+class StripeEvent(models.Model):
+    """
+    A processed Stripe webhook event. Is used to skip the events redelivered by Stripe.
+    """
+    event_id = models.CharField(verbose_name='event_id', max_length=255, unique=True)
+    type = models.CharField(verbose_name='type', max_length=100)
+    received_at = models.DateTimeField(auto_now_add=True, verbose_name='received_at')
+
+    def __str__(self):
+        return f'Stripe event {self.event_id} - {self.type}'
+
+    class Meta:
+        verbose_name = 'Stripe event'
+        verbose_name_plural = 'Stripe events'
+
+
+class SalesRollup(models.Model):
+    """
+    The number and the revenue of the orders paid within an hour, by currency, tax and discount.
+    Is refreshed incrementally from the orders by order.rollups.refresh_sales_rollups.
+    """
+    hour = models.DateTimeField(verbose_name='hour')
+    currency = models.CharField(verbose_name='currency', max_length=3, **NULLABLE)
+    tax = models.ForeignKey(
+        Tax, verbose_name='tax', related_name='sales_rollups', on_delete=models.SET_NULL, **NULLABLE)
+    discount = models.ForeignKey(
+        Discount, verbose_name='discount', related_name='sales_rollups', on_delete=models.SET_NULL, **NULLABLE)
+    orders_count = models.PositiveIntegerField(verbose_name='orders_count')
+    revenue = models.DecimalField(verbose_name='revenue', max_digits=20, decimal_places=2)
+
+    def __str__(self):
+        return f'Sales of {self.hour} - {self.revenue} {self.currency}'
+
+    class Meta:
+        verbose_name = 'Sales rollup'
+        verbose_name_plural = 'Sales rollups'
+        indexes = [
+            models.Index(fields=['hour'], name='sales_rollup_hour_idx'),
+        ]
+
+
+class RollupHighWaterMark(models.Model):
+    """
+    The time up to which a rollup (e.g. SalesRollup) has been refreshed.
+    """
+    name = models.CharField(verbose_name='name', max_length=50, unique=True)
+    value = models.DateTimeField(verbose_name='value', **NULLABLE)
+
+    def __str__(self):
+        return f'Rollup {self.name} refreshed until {self.value}'
+
+    class Meta:
+        verbose_name = 'Rollup high-water mark'
+        verbose_name_plural = 'Rollup high-water marks'
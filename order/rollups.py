@@ -0,0 +1,84 @@
+"""
+The sales rollups: the number and the revenue of the paid orders per hour, currency, tax and discount
+(order.SalesRollup). The reports read the rollups instead of aggregating the orders table.
+The rollups are refreshed incrementally by the refresh_sales_rollups_task: only the hours since the previous
+refresh (the high-water mark) are recomputed from the orders. The orders are bucketed by their payment time (paid_at),
+the hours within SALES_ROLLUP_LATENESS before the high-water mark are recomputed too, so the orders marked as paid
+with a slightly earlier paid_at (e.g. by a concurrent sweep_payment_statuses run) are not missed.
+"""
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+
+from config.settings import SALES_ROLLUP_LATENESS
+from order.models import Order, RollupHighWaterMark, SalesRollup
+
+SALES_ROLLUP_NAME = 'sales'
+REPORT_PERIODS = {'hour': TruncHour, 'day': TruncDay}
+
+
+def floor_hour(value: datetime) -> datetime:
+    """
+    Returns the start of the value's hour in the current time zone (the same hours as the TruncHour ones).
+    """
+    return timezone.localtime(value).replace(minute=0, second=0, microsecond=0)
+
+
+def refresh_sales_rollups(now: datetime = None) -> int:
+    """
+    Recomputes the sales rollups of the hours since the high-water mark (minus SALES_ROLLUP_LATENESS) up to now,
+    all the rollups on the first run, with a single aggregate query, and moves the high-water mark to now.
+    Concurrent refreshes are serialized by the high-water mark row lock.
+
+    :param now: the time up to which the rollups are refreshed, the current time by default.
+    :return: the number of the rollup rows written.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        high_water_mark, _ = RollupHighWaterMark.objects.select_for_update().get_or_create(name=SALES_ROLLUP_NAME)
+        paid_orders = Order.objects.filter(payment_status='paid', paid_at__isnull=False, paid_at__lt=now)
+        rollups = SalesRollup.objects.all()
+        if high_water_mark.value is not None:
+            since = floor_hour(high_water_mark.value - timedelta(seconds=SALES_ROLLUP_LATENESS))
+            paid_orders = paid_orders.filter(paid_at__gte=since)
+            rollups = rollups.filter(hour__gte=since)
+
+        rows = (
+            paid_orders.annotate(hour=TruncHour('paid_at'))
+            .values('hour', 'currency', 'tax_id', 'discount_id')
+            .annotate(orders_count=Count('pk'), revenue=Sum('total_price'))
+            .order_by()
+        )
+        rollups.delete()
+        created = SalesRollup.objects.bulk_create([SalesRollup(**row) for row in rows])
+
+        high_water_mark.value = now
+        high_water_mark.save(update_fields=['value'])
+    return len(created)
+
+
+def get_sales_report(since: datetime, until: datetime, period: str = 'day') -> dict:
+    """
+    Returns the paid orders count and revenue per period, currency, tax and discount, read from the rollups.
+
+    :param since: the start of the report, rounded down to the hour.
+    :param until: the end of the report (exclusive).
+    :param period: 'hour' or 'day'.
+    :return: {'refreshed_until': datetime or None, 'rows': [{'period', 'currency', 'tax_id', 'discount_id',
+    'orders_count', 'revenue'}, ...]}, the rows are ordered by period.
+    """
+    rows = (
+        SalesRollup.objects.filter(hour__gte=floor_hour(since), hour__lt=until)
+        .annotate(period=REPORT_PERIODS[period]('hour'))
+        .values('period', 'currency', 'tax_id', 'discount_id')
+        .annotate(orders_count=Sum('orders_count'), revenue=Sum('revenue'))
+        .order_by('period', 'currency', 'tax_id', 'discount_id')
+    )
+    high_water_mark = RollupHighWaterMark.objects.filter(name=SALES_ROLLUP_NAME).first()
+    return {
+        'refreshed_until': high_water_mark.value if high_water_mark is not None else None,
+        'rows': list(rows),
+    }
@@ -1,21 +1,59 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from functools import partial
+from typing import TYPE_CHECKING, Callable
 
 import pytz
-import stripe
-from stripe import TaxRate
-from stripe.api_resources.checkout import Session
-from stripe.error import StripeError
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
 
 from config import settings
-from config.settings import SMALLEST_CURRENCY_UNIT_RATIO
+from config.clients import get_stripe
+from config.metrics import CHECKOUT_SESSION_DURATION
+from config.settings import (
+    BASE_CURRENCY, SMALLEST_CURRENCY_UNIT_RATIO, STRIPE_CONCURRENT_REQUESTS, STRIPE_MAX_WORKERS,
+)
+from config.tracing import span
 from item.models import Item
-from order.utils import get_conversion_rate
+from item.service import ItemStripeCatalog
+from pricing.engine import PricingEngine, Quote, collapse_items
+from pricing.service import get_stripe_tax_rate_id, get_stripe_coupon_id
+
+if TYPE_CHECKING:
+    import stripe
 
 
 class ProjectStripeError(Exception):
     pass
 
 
+_stripe_executor = None
+
+
+def get_stripe_executor() -> ThreadPoolExecutor:
+    """
+    Returns the process-wide thread pool used for concurrent Stripe API calls.
+    The pool is shared by all the requests, so the number of simultaneous Stripe calls of a process is bounded
+    by STRIPE_MAX_WORKERS.
+    """
+    global _stripe_executor
+    if _stripe_executor is None:
+        _stripe_executor = ThreadPoolExecutor(max_workers=STRIPE_MAX_WORKERS, thread_name_prefix='stripe')
+    return _stripe_executor
+
+
+def run_closing_db_connections(call: Callable):
+    """
+    Runs the call in a thread pool worker, and closes the worker's expired database connections afterwards,
+    as Django closes them only at the end of a request.
+    """
+    try:
+        return call()
+    finally:
+        close_old_connections()
+
+
 class ProjectStripeSession:
     """
     A class isolating the Stripe session creation process.
@@ -24,144 +62,169 @@ class ProjectStripeSession:
     The make_session() method can be used externally. All the other methods are used within the class.
     """
 
-    def __init__(self, items: list[Item], tax=None, discount=None):
+    def __init__(self, items: list[Item], tax=None, discount=None, concurrent: bool = STRIPE_CONCURRENT_REQUESTS,
+                 quantities: dict[int, int] = None):
         """
         Initializes a ProjectStripeSession instance.
         Used for creating a stripe.checkout.Session.create session.
 
-        :param items: a list of item.Item instances.
+        :param items: a list of item.Item instances. A repeated item is sent as a single line item with its quantity.
         :param tax: a pricing.Tax model instance.
         :param discount: a pricing.Discount model instance.
+        :param concurrent: whether independent Stripe API calls are run concurrently.
+        :param quantities: the items' quantities by item.pk. If not passed, an item's quantity is its number in items.
         """
         self.API_KEY = settings.STRIPE_API_KEY
-        self.items = items
+        self.items, self.quantities = collapse_items(items, quantities)
         if tax is not None:
             self.tax_behavior = 'exclusive'
         else:
             self.tax_behavior = 'inclusive'
         self.tax = tax
         self.discount = discount
+        self.concurrent = concurrent
         # Currency's smallest unit ratio. Set at the level of 100 as the default value.
         # For example, there are 100 cents to one euro. Same works for one rub.
         self.smallest_cur_unit_ratio = SMALLEST_CURRENCY_UNIT_RATIO
-        self.base_curr = 'EUR'
-        self.second_curr = 'RUB'
-        # fixer.io API is used to get the latest currency rate dynamically
-        self.conversion_rate = get_conversion_rate(base_curr=self.base_curr, second_curr=self.second_curr)
+        self.base_curr = BASE_CURRENCY
+        self.pricing_engine = PricingEngine(base_curr=self.base_curr)
+        # the expiration time of the created Checkout Session
+        self.expires_at = None
+
+    @classmethod
+    def from_order(cls, order, **kwargs) -> 'ProjectStripeSession':
+        """
+        Returns the Checkout Session builder of a saved order: its lines' items and quantities, its tax and discount.
+
+        :param order: an order.Order instance with its order lines saved.
+        :param kwargs: other arguments of the class (e.g. concurrent).
+        """
+        order_lines = list(order.lines.select_related('item').order_by('pk'))
+        return cls(
+            items=[order_line.item for order_line in order_lines],
+            quantities={order_line.item_id: order_line.quantity for order_line in order_lines},
+            tax=order.tax, discount=order.discount, **kwargs)
+
+    def quote(self) -> Quote:
+        """
+        Computes the totals of the Checkout Session locally (pricing.engine.PricingEngine), without Stripe API calls.
+        The same currency rates are used for the quote and for the Checkout Session line items.
 
-        stripe.api_key = settings.STRIPE_API_KEY
+        :return: a pricing.engine.Quote instance.
+        """
+        return self.pricing_engine.quote(
+            items=self.items, tax=self.tax, discount=self.discount, quantities=self.quantities)
 
     def __convert_to_common_currency(self, item: Item) -> tuple:
         """
         Auxiliary method to convert an item's currency the common value (self.base_curr).
-        Used in self.__create_stripe_product_list when the self.items list of Item instances contain items
+        Used in self.__get_line_items when the self.items list of Item instances contain items
         with different currencies.
 
         :param item: an item.Item instance.
         """
-        if item.currency == self.base_curr.lower():
-            return int(item.price) * self.smallest_cur_unit_ratio, self.base_curr.lower()
-        else:
-            converted_price = int(item.price) * self.smallest_cur_unit_ratio * self.conversion_rate
-            return converted_price, self.base_curr.lower()
+        return self.pricing_engine.get_unit_amount(item, convert=True), self.base_curr.lower()
 
-    def __create_stripe_tax(self) -> TaxRate:
+    def __get_stripe_tax_rate_id(self) -> str:
         """
-        Creates a Stripe TaxRate instance, based on the self.tax instance fields' values.
+        Returns the id of the Stripe TaxRate of the self.tax instance (created once and reused, see
+        pricing.service.get_stripe_tax_rate_id).
         If self.tax passed the method is used in self.__create_stripe_session.
 
-        :return: a TaxRate instance
+        :return: a Stripe TaxRate id.
         """
-        stripe_tax = stripe.TaxRate.create(
-            percentage=self.tax.rate,
-            description=f'Tax {self.tax.name}',
-            display_name=f'Tax {self.tax.name}',
-            inclusive=False,
-        )
-        return stripe_tax
+        stripe = get_stripe()
+        try:
+            return get_stripe_tax_rate_id(self.tax)
+        except stripe.error.StripeError as e:
+            raise ProjectStripeError(f'Error during creating Stripe tax rate: {str(e)}')
 
-    def __create_stripe_product(self) -> dict:
+    def __run_concurrently(self, calls: list[Callable]) -> list:
         """
-        Creates a new Stripe Product object.
-        The method is used when only one Item object is passed.
+        Runs independent Stripe API calls in the shared bounded thread pool (see get_stripe_executor),
+        if self.concurrent is True. Otherwise, runs the calls one by one.
+        Errors raised by the calls are propagated to the caller as is.
+        The calls are run in a copy of the caller's context, so their Stripe requests are in the caller's trace.
 
-        :return: a dict (stripe_product response with extra 'item_price' and 'item_currency' key-val pairs).
+        :param calls: a list of callables without arguments.
+        :return: a list of the calls results, in the same order as the calls.
         """
-        try:
-            stripe_product = stripe.Product.create(name=self.items[0].name)
-            stripe_product['item_price'] = int(self.items[0].price) * self.smallest_cur_unit_ratio
-            stripe_product['item_currency'] = self.items[0].currency
-        except StripeError as e:
-            raise ProjectStripeError(f'Error during creating Stripe product: {str(e)}')
+        if not self.concurrent or len(calls) < 2:
+            return [call() for call in calls]
+        futures = [
+            get_stripe_executor().submit(contextvars.copy_context().run, run_closing_db_connections, call)
+            for call in calls
+        ]
+        return [future.result() for future in futures]
 
-        return stripe_product
-
-    def __create_stripe_product_list(self) -> list[dict]:
+    @staticmethod
+    def __sync_item(item: Item) -> None:
         """
-        Creates a list of Stripe Product object.
-        The method is used when several Item object are passed as an order.
-        If all the items have the same currency - their set currency is used (self.base_curr or self.second_curr).
-        If all the items have different currencies - self.base_curr is used as the common currency via the
-        self.__convert_to_common_currency method, in order to avert issues during the Checkout Session creation.
+        Syncs the item's Stripe Product and Prices (item.service.ItemStripeCatalog).
 
-        :return: a list of dicts (stripe_product responses with extra 'item_price' and 'item_currency' key-val pairs)
+        :param item: an item.Item instance.
         """
-        stripe_products_list = []
-        items_have_same_currency = len({item.currency for item in self.items}) == 1
-
-        for item in self.items:
-            try:
-                stripe_product = stripe.Product.create(name=item.name)
-                if not items_have_same_currency:
-                    converted_price = self.__convert_to_common_currency(item)
-                    stripe_product['item_price'] = int(converted_price[0])
-                    stripe_product['item_currency'] = converted_price[1]
-                else:
-                    stripe_product['item_price'] = int(item.price) * self.smallest_cur_unit_ratio
-                    stripe_product['item_currency'] = item.currency
-                stripe_products_list.append(stripe_product)
-            except StripeError as e:
-                raise ProjectStripeError(f'Error during creating Stripe product: {str(e)}')
-
-        return stripe_products_list
+        stripe = get_stripe()
+        try:
+            ItemStripeCatalog(item).sync()
+        except stripe.error.StripeError as e:
+            raise ProjectStripeError(f'Error during syncing Stripe product and prices: {str(e)}')
 
-    def __create_stripe_price_list(self) -> list[dict]:
+    def __get_line_items(self, synced_price_ids: dict[int, str]) -> list[dict]:
         """
-        Creates a list of Strip Price objects.
+        Builds the Checkout Session line items from the items' Stripe catalog objects (item.service.ItemStripeCatalog),
+        so no Stripe Products and Prices are created per checkout.
+        If all the items have the same currency - their synced Stripe Prices are referenced.
+        If the items have different currencies - the items' prices are converted to self.base_curr via the
+        self.__convert_to_common_currency method, and passed as inline price_data of the items' Stripe Products
+        (the converted amounts depend on the current rate, so they are not stored as Stripe Prices).
+        There is one line item per distinct item, with the item's quantity (self.quantities).
+        The line items order is the same as the self.items order.
+
+        :param synced_price_ids: the up-to-date Stripe Price ids of the items, looked up before syncing the items
+        (ItemStripeCatalog.get_synced_price_ids), only the ids of the items synced since then are queried again.
+        :return: a list of the Checkout Session line items (without tax rates).
+        """
+        items_have_same_currency = len({item.currency for item in self.items}) == 1
 
-        :return: a list of Stripe Price objects.
+        stripe = get_stripe()
+        try:
+            if items_have_same_currency:
+                price_ids = {
+                    item.pk: synced_price_ids.get(item.pk) or ItemStripeCatalog(item).get_price_id(self.tax_behavior)
+                    for item in self.items
+                }
+                return [{'price': price_ids[item.pk], 'quantity': self.quantities[item.pk]} for item in self.items]
+
+            line_items = []
+            for item in self.items:
+                converted_price = self.__convert_to_common_currency(item)
+                line_items.append({
+                    'price_data': {
+                        'product': ItemStripeCatalog(item).get_product_id(),
+                        'unit_amount': int(converted_price[0]),
+                        'currency': converted_price[1],
+                        'tax_behavior': self.tax_behavior,
+                    },
+                    'quantity': self.quantities[item.pk],
+                })
+            return line_items
+        except stripe.error.StripeError as e:
+            raise ProjectStripeError(f'Error during syncing Stripe products and prices: {str(e)}')
+
+    def __get_stripe_coupon_id(self) -> str:
         """
-        stripe_prices_list = []
-        if len(self.items) == 1:
-            stripe_products = [self.__create_stripe_product()]
-        else:
-            stripe_products = self.__create_stripe_product_list()
-
-        for product in stripe_products:
-            try:
-                stripe_price = stripe.Price.create(
-                    unit_amount=product['item_price'],
-                    currency=product['item_currency'],
-                    product=f"{product['id']}",
-                    tax_behavior=self.tax_behavior
-                )
-                stripe_prices_list.append(stripe_price)
-            except StripeError as e:
-                raise ProjectStripeError(f'Error during creating Stripe price: {str(e)}')
-        return stripe_prices_list
-
-    def __create_stripe_discount(self):
-        """
-        Creates a Stripe Coupon object, based on the self.discount (pricing.Discount) instance fields' values.
+        Returns the id of the Stripe Coupon of the self.discount (pricing.Discount) instance (created once per
+        currency and reused, see pricing.service.get_stripe_coupon_id).
         If the self.discount.amount_off is set the discount's currency is also configured:
         - If a single item is being purchased the self.item.currency is used as the amount_off currency.
-        - If all the items have the same currency - their set currency is used (self.base_curr or self.second_curr).
+        - If all the items have the same currency - their set currency is used.
         - If all the items have different currencies - self.base_curr currency is set as the common discount currency.
           It is not recommended to use the amount_off mode dealing with items with different currencies (use percent_off
           instead), or take it into account while setting the amount_off value of the pricing.Discount instance.
 
 
-        :return: a Stripe Coupon object.
+        :return: a Stripe Coupon id.
         """
         items_have_same_cur = len({item.currency for item in self.items}) == 1
         if len(self.items) == 1:
@@ -172,44 +235,44 @@ class ProjectStripeSession:
             else:
                 amount_off_currency = self.base_curr.lower()
 
-        stripe_discount = stripe.Coupon.create(
-            duration='once',
-            percent_off=self.discount.percent_off if self.discount.percent_off else None,
-            amount_off=int(
-                self.discount.amount_off) * self.smallest_cur_unit_ratio if self.discount.amount_off else None,
-            currency=amount_off_currency
-        )
-
-        return stripe_discount
+        stripe = get_stripe()
+        try:
+            return get_stripe_coupon_id(self.discount, currency=amount_off_currency)
+        except stripe.error.StripeError as e:
+            raise ProjectStripeError(f'Error during creating Stripe coupon: {str(e)}')
 
-    def __create_stripe_session(self) -> Session:
+    def __create_stripe_session(self) -> 'stripe.checkout.Session':
         """
         Creates a new Stripe Checkout Session, based on all the passed arguments.
-        Calls self.__create_stripe_price_list() method to create stripe Product and Price instances.
-        Calls self.__create_stripe_discount() and self.__create_stripe_tax() if self.discount and self.tax are provided.
+        Calls self.__sync_item() for the items not synced with Stripe yet, and self.__get_stripe_coupon_id() and
+        self.__get_stripe_tax_rate_id() if self.discount and self.tax are provided.
+        These calls are independent, so they are run concurrently if self.concurrent is True.
+        Calls self.__get_line_items() method to get the line items of the items' synced Stripe Products and Prices.
 
         :return: a Stripe Checkout Session instance.
         """
-        stripe_prices = self.__create_stripe_price_list()
-        stripe_discounts = self.__create_stripe_discount() if self.discount else None
-        stripe_tax = self.__create_stripe_tax() if self.tax else None
-        exp_timestamp = int((datetime.now(tz=pytz.timezone(settings.TIME_ZONE)) + timedelta(seconds=1800)).timestamp())
-
+        synced_price_ids = ItemStripeCatalog.get_synced_price_ids(self.items, tax_behavior=self.tax_behavior)
+        *_, stripe_coupon_id, stripe_tax_rate_id = self.__run_concurrently([
+            *[partial(self.__sync_item, item) for item in self.items if item.pk not in synced_price_ids],
+            self.__get_stripe_coupon_id if self.discount else lambda: None,
+            self.__get_stripe_tax_rate_id if self.tax else lambda: None,
+        ])
+        line_items = self.__get_line_items(synced_price_ids)
+        self.expires_at = datetime.now(tz=pytz.timezone(settings.TIME_ZONE)) + timedelta(
+            seconds=settings.CHECKOUT_SESSION_EXPIRATION)
+
+        stripe = get_stripe()
         try:
             stripe_session = stripe.checkout.Session.create(
                 payment_method_types=['card'],
                 success_url="https://example.com/success",
                 line_items=[
-                    {
-                        "price": f"{price['id']}",
-                        "quantity": 1,
-                        'tax_rates': [stripe_tax['id']] if self.tax else None
-                    } for price in stripe_prices],
+                    {**line_item, 'tax_rates': [stripe_tax_rate_id] if self.tax else None} for line_item in line_items],
                 mode="payment",
-                expires_at=exp_timestamp,
-                discounts=[{'coupon': stripe_discounts['id']}] if self.discount else None)
+                expires_at=int(self.expires_at.timestamp()),
+                discounts=[{'coupon': stripe_coupon_id}] if self.discount else None)
             return stripe_session
-        except StripeError as e:
+        except stripe.error.StripeError as e:
             raise ProjectStripeError(f'Error during creating Stripe session: {str(e)}')
 
     @staticmethod
@@ -221,14 +284,61 @@ class ProjectStripeSession:
         :param session_id: a Stripe Checkout Session id.
         :return: True is session['payment_status'] == 'paid', otherwise returns False
         """
-        stripe.api_key = settings.STRIPE_API_KEY
-        payment_info = stripe.checkout.Session.retrieve(session_id)
+        payment_info = get_stripe().checkout.Session.retrieve(session_id)
         return payment_info['payment_status'] == 'paid'
 
+    @staticmethod
+    def get_paid_session_ids(created_since: datetime) -> set[str]:
+        """
+        Returns the ids of all the paid Stripe Checkout Sessions created since the created_since time.
+        The sessions are listed by the Stripe list API, 100 sessions per page.
+
+        :param created_since: the earliest creation time of the sessions.
+        :return: a set of the paid Stripe Checkout Session ids.
+        """
+        # the Checkout Session is created right after its Order, a margin covers the clock difference with Stripe
+        created_gte = int(created_since.timestamp()) - 60
+        stripe = get_stripe()
+        try:
+            stripe_sessions = stripe.checkout.Session.list(created={'gte': created_gte}, status='complete', limit=100)
+            return {
+                stripe_session['id'] for stripe_session in stripe_sessions.auto_paging_iter()
+                if stripe_session['payment_status'] == 'paid'
+            }
+        except stripe.error.StripeError as e:
+            raise ProjectStripeError(f'Error during listing Stripe sessions: {str(e)}')
+
     def make_session(self):
         """
         Creates and returns a new Stripe Checkout Session,
         with all the provided arguments during the class instance initialization.
         The method us used externally in the project's views.
+        The session's expiration time is set as self.expires_at.
+        """
+        with CHECKOUT_SESSION_DURATION.time(), span('checkout session', items_count=len(self.items)):
+            return self.__create_stripe_session()
+
+
+class AsyncProjectStripeSession(ProjectStripeSession):
+    """
+    An async interface of the ProjectStripeSession class, used by the async (ASGI) checkout views.
+    It is a thread offload, not non-blocking I/O: the Stripe library (7.x) has no async HTTP client, so the session is
+    created by the blocking make_session() in a thread of the event loop's default executor, with its Stripe API calls
+    and ORM queries. The event loop is not blocked meanwhile, but every pending session holds an executor thread,
+    so the concurrent checkouts of a process are capped by the executor's size.
+    """
+
+    async def amake_session(self):
+        """
+        Creates and returns a new Stripe Checkout Session, the same way as make_session() does.
+        """
+        return await sync_to_async(run_closing_db_connections, thread_sensitive=False)(self.make_session)
+
+    @staticmethod
+    async def aget_payment_status(session_id: str) -> bool:
+        """
+        Checks whether a payment has been made or not, the same way as get_payment_status() does.
+
+        :param session_id: a Stripe Checkout Session id.
         """
-        return self.__create_stripe_session()
+        return await sync_to_async(ProjectStripeSession.get_payment_status, thread_sensitive=False)(session_id)
@@ -1,105 +1,163 @@
-import json
 import pytz
 from datetime import datetime, timedelta
 
 from celery import shared_task
-from django.core.exceptions import ValidationError, ObjectDoesNotExist
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.shortcuts import get_object_or_404
-from django_celery_beat.models import IntervalSchedule, PeriodicTask, ClockedSchedule
+from django_celery_beat.models import PeriodicTask, PeriodicTasks
 
 from config import settings
+from config.tracing import set_span_attributes
 from order.models import Order
-from order.service import ProjectStripeSession
+from order.rollups import refresh_sales_rollups
+from order.service import ProjectStripeError, ProjectStripeSession
+from order.utils import refresh_fx_rates
+from pricing.engine import PricingError
 
 
-@shared_task
+@shared_task(ignore_result=True)
 def disable_payment_status_check(order_id: str) -> None:
     """
     Sets the 'task.enable' field to False if the order has been paid, and there is no need to check its
     payment status again. It also disables the one-off status check disabler task.
+    Both tasks are disabled with a single UPDATE query, and celery-beat is notified of the change once.
+    Is kept for the per-order PeriodicTask instances created before the sweep_payment_statuses task was introduced.
 
     :param order_id: id of the paid Order instance, expected to be paid.
     """
-    try:
-        task = PeriodicTask.objects.get(name=f'Payment status check for Order {order_id}')
-        task.enabled = False
-        task.save()
-        task_disabler = PeriodicTask.objects.get(name=f'Disables payment status check for Order {order_id}')
-        task_disabler.enabled = False
-        task_disabler.save()
-    except ObjectDoesNotExist:
+    set_span_attributes(order_id=order_id)
+    task_names = [
+        f'Payment status check for Order {order_id}',
+        f'Disables payment status check for Order {order_id}',
+    ]
+    if not PeriodicTask.objects.filter(name__in=task_names).update(enabled=False):
         raise ValidationError(f"Couldn't disable the Payment status check for Order {order_id}")
+    # the updates bypass PeriodicTask.save(), which tells celery-beat to reload the schedule
+    PeriodicTasks.update_changed()
 
 
-@shared_task
+@shared_task(bind=True, ignore_result=True)
+def create_checkout_session(self, order_id: int) -> None:
+    """
+    Creates the Stripe Checkout Session of an order saved without it (the deferred checkout, see order.checkout),
+    and saves the session's id and url to the order, the waiting page redirects the browser to the url.
+    If the session can't be created, the order is set as 'failed' and the error is saved to its checkout_error field,
+    an unexpected error is raised again after that.
+    An order which already has a Checkout Session is skipped, and the session is created by one task run at a time
+    (a cache lock), so a redelivered task creates no second session: it is retried while the lock is held.
+
+    :param order_id: id of the Order instance.
+    """
+    set_span_attributes(order_id=order_id)
+    lock_key = f'order:{order_id}:checkout_session'
+    if not cache.add(lock_key, True, timeout=settings.CHECKOUT_SESSION_LOCK_TIMEOUT):
+        raise self.retry(countdown=settings.CHECKOUT_SESSION_LOCK_TIMEOUT)
+    try:
+        order = Order.objects.select_related('tax', 'discount').filter(
+            pk=order_id, stripe_session_id__isnull=True, checkout_error__isnull=True).first()
+        if order is None:
+            return
+        project_stripe_obj = ProjectStripeSession.from_order(order)
+        stripe_session = project_stripe_obj.make_session()
+        Order.objects.filter(pk=order_id).update(
+            stripe_session_id=stripe_session['id'], checkout_url=stripe_session['url'],
+            session_expires_at=project_stripe_obj.expires_at)
+    except (ProjectStripeError, PricingError) as e:
+        Order.objects.filter(pk=order_id).update(payment_status='failed', checkout_error=str(e)[:255])
+    except Exception:
+        # the waiting page gets the failure at once, the error is logged by the worker
+        Order.objects.filter(pk=order_id).update(
+            payment_status='failed', checkout_error='The Checkout Session could not be created')
+        raise
+    finally:
+        cache.delete(lock_key)
+
+
+@shared_task(ignore_result=True)
+def refresh_fx_rates_task() -> None:
+    """
+    Refreshes the cached rates of all the currencies (see order.utils.get_fx_rates).
+    Is called periodically by celery-beat, and on demand when the stale cached rates are served.
+    """
+    refresh_fx_rates()
+
+
+@shared_task(ignore_result=True)
 def set_payment_status(order_id: str, stripe_session_id: str) -> None:
     """
     Task is called periodically to check the Stripe Checkout Session payment status.
     Sets 'paid' as the Order instance's payment_status field value if the payment has been done.
+    Is kept for the per-order PeriodicTask instances created before the sweep_payment_statuses task was introduced.
 
     :param order_id: id of the Order instance expected to be paid.
     :param stripe_session_id: the Stripe Checkout Session id which payment status should be checked
     """
-    if ProjectStripeSession.get_payment_status(stripe_session_id):
-        order = get_object_or_404(Order, pk=order_id)
-        order.payment_status = 'paid'
-        order.save()
+    set_span_attributes(order_id=order_id, stripe_session_id=stripe_session_id)
+    order = get_object_or_404(Order, pk=order_id)
+    if order.payment_status == 'paid' or ProjectStripeSession.get_payment_status(stripe_session_id):
+        if order.payment_status != 'paid':
+            order.payment_status = 'paid'
+            order.paid_at = datetime.now(tz=pytz.timezone(settings.TIME_ZONE))
+            order.save()
         disable_payment_status_check.delay(order_id)
 
 
-@shared_task()
-def set_payment_status_check_schedule(order_id, stripe_session_id) -> None:
+@shared_task
+def sweep_payment_statuses() -> int:
     """
-    Sets the set_payment_status periodic task schedule.
+    Task is called periodically by celery-beat (every PAYMENT_STATUS_CHECK_INTERVAL minutes) as a fallback of the
+    Stripe webhook (order.views.stripe_webhook).
+    Selects all the unpaid Orders with a Stripe Checkout Session not expired yet (or within the expire_orders grace
+    period) with a single query, gets the paid Checkout Sessions created since the oldest of them with
+    the paginated Stripe list API, and sets the paid Orders' payment_status as 'paid' with a single bulk update.
 
-    :param order_id: id of the Order instance expected to be paid.
-    :param stripe_session_id: the Stripe Checkout Session id which payment status should be checked
+    :return: the number of the Orders set as 'paid'.
     """
-    schedule, created = IntervalSchedule.objects.get_or_create(
-        every=2,
-        period=IntervalSchedule.MINUTES,
-    )
-    start_time = datetime.now(tz=pytz.timezone(settings.TIME_ZONE)) + timedelta(seconds=120)
+    now = datetime.now(tz=pytz.timezone(settings.TIME_ZONE))
+    open_orders = list(Order.objects.filter(
+        payment_status='unpaid',
+        session_expires_at__gt=now - timedelta(minutes=settings.PAYMENT_STATUS_CHECK_INTERVAL),
+        stripe_session_id__isnull=False,
+    ).only('pk', 'stripe_session_id', 'created_at'))
+    if not open_orders:
+        return 0
 
-    try:
-        PeriodicTask.objects.create(
-            interval=schedule,
-            start_time=start_time,
-            name=f'Payment status check for Order {order_id}',
-            task='order.tasks.set_payment_status',
-            args=json.dumps([order_id, stripe_session_id]),
-            kwargs={}
-        )
-    except Exception as e:
-        raise ValidationError(
-            f"Couldn't create a PeriodicTask for the set_payment_status_check_schedule schedule: {str(e)}")
+    created_since = min(order.created_at for order in open_orders)
+    paid_session_ids = ProjectStripeSession.get_paid_session_ids(created_since=created_since)
+    paid_orders = [order for order in open_orders if order.stripe_session_id in paid_session_ids]
+    for order in paid_orders:
+        order.payment_status = 'paid'
+        order.paid_at = now
+    Order.objects.bulk_update(paid_orders, ['payment_status', 'paid_at'])
+    set_span_attributes(order_ids=[order.pk for order in paid_orders])
+    return len(paid_orders)
 
 
 @shared_task
-def set_disabler_schedule(order_id: str):
+def expire_orders() -> int:
     """
-    Sets a new ClockedSchedule schedule for one-off task to disable the set_payment_status periodic task.
-    Expiration time - 30 minutes from the first payment status check.
-    Aligns with the expires_at option of the Stripe Checkout Session configured in order.service.ProjectStripeSession.
-    Disables the payment status check task after 30 minutes from the start_time of the set_payment_status_check_schedule
+    Task is called periodically by celery-beat (every ORDER_EXPIRY_INTERVAL minutes).
+    Sets all the unpaid Orders which Stripe Checkout Session has expired as 'expired' with a single UPDATE query
+    (backed by the partial index of the unpaid orders), so they are not swept anymore.
+    The Orders are expired PAYMENT_STATUS_CHECK_INTERVAL minutes after their session, once sweep_payment_statuses has
+    checked them after the expiration. A late webhook still sets an expired Order as 'paid'.
 
-    :param order_id: the order.Order instance id, which pyament status check is being disabled.
-    :return:
+    :return: the number of the Orders set as 'expired'.
     """
     now = datetime.now(tz=pytz.timezone(settings.TIME_ZONE))
-    disable_at = now + timedelta(seconds=1800)
-    schedule, created = ClockedSchedule.objects.get_or_create(
-        clocked_time=disable_at
-    )
-    try:
-        PeriodicTask.objects.create(
-            clocked=schedule,
-            one_off=True,
-            name=f'Disables payment status check for Order {order_id}',
-            task='order.tasks.disable_payment_status_check',
-            args=json.dumps([order_id, ]),
-            kwargs={},
-        )
-    except Exception as e:
-        raise ValidationError(
-            f"Couldn't create a PeriodicTask for the set_disabler_schedule schedule: {str(e)}")
+    return Order.objects.filter(
+        payment_status='unpaid',
+        session_expires_at__lte=now - timedelta(minutes=settings.PAYMENT_STATUS_CHECK_INTERVAL),
+    ).update(payment_status='expired')
+
+
+@shared_task
+def refresh_sales_rollups_task() -> int:
+    """
+    Task is called periodically by celery-beat (every SALES_ROLLUP_REFRESH_INTERVAL minutes).
+    Refreshes the sales rollups incrementally (see order.rollups.refresh_sales_rollups).
+
+    :return: the number of the rollup rows written.
+    """
+    return refresh_sales_rollups()
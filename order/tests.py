@@ -1,3 +1,988 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import hmac
+import json
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from celery.exceptions import Retry
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import DurationField, ExpressionWrapper, F
+from django.db.models.functions import Now
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from prometheus_client import REGISTRY
+from django.urls import reverse
+from django.utils import timezone
+from stripe.error import APIConnectionError
+
+from benchmarks.fake_apis import FakeAPIServer
+from config.clients import RateLimiter, get_fixer_session, get_stripe
+from config.metrics import get_stripe_operation
+from config.settings import FIXER_MAX_RETRIES, FX_RATE_MAX_STALENESS, FX_RATE_TTL, QUOTE_MAX_CARTS, STRIPE_TIMEOUT
+from config.tracing import inject_trace_context, span
+from item.models import Item, ItemStripePrice
+from item.tests import QueryPlanTestMixin
+from order.models import Order, SalesRollup, StripeEvent
+from order.rollups import refresh_sales_rollups
+from order.service import ProjectStripeError
+from order.tasks import (
+    create_checkout_session, expire_orders, refresh_fx_rates_task, refresh_sales_rollups_task, sweep_payment_statuses,
+)
+from order.utils import FxRatesError, fetch_fx_rates, get_fx_rates, get_fx_rates_cache_key
+from order.views import CreateOrderView
+from order.webhooks import handle_stripe_event
+from pricing.engine import PricingEngine, PricingError
+from pricing.models.discount import Discount
+from pricing.models.tax import Tax
+
+
+class CreateOrderQueriesTestCase(TestCase):
+    """
+    Query budget of the order creation path (CreateOrderView) with the items, tax and discount already synced
+    with Stripe. The queries are:
+    validating the items (1), the tax (1) and the discount (1), looking up the items' Stripe Price ids (1),
+    and saving the order and its lines in a transaction (2, plus SAVEPOINT and RELEASE SAVEPOINT inside TestCase).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.items = Item.objects.bulk_create([
+            Item(name=f'Item {i}', description='Test item', price=Decimal(10 + i), currency='eur',
+                 stripe_product_id=f'prod_{i}')
+            for i in range(20)
+        ])
+        ItemStripePrice.objects.bulk_create([
+            ItemStripePrice(item=item, stripe_price_id=f'price_{item.pk}_{tax_behavior}',
+                            unit_amount=int(item.price) * 100, currency='eur', tax_behavior=tax_behavior)
+            for item in cls.items for tax_behavior, _ in ItemStripePrice.TAX_BEHAVIOR
+        ])
+        cls.tax = Tax.objects.create(name='VAT 20', rate=Decimal('20.00'), stripe_tax_rate_id='txr_1')
+        cls.discount = Discount.objects.create(
+            name='10% off', percent_off=Decimal('10.00'), stripe_coupon_ids={'': 'coupon_1'})
+
+    def setUp(self):
+        patcher = mock.patch('stripe.checkout.Session.create', return_value={
+            'id': 'cs_test_1', 'url': 'https://checkout.stripe.com/c/pay/cs_test_1'})
+        self.session_create = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def get_order_data(items: list[Item], quantity: int = 1, **data) -> dict:
+        data.update({'lines-TOTAL_FORMS': len(items), 'lines-INITIAL_FORMS': 0})
+        for index, item in enumerate(items):
+            data.update({f'lines-{index}-item': item.pk, f'lines-{index}-quantity': quantity})
+        return data
+
+    def test_create_order(self):
+        data = self.get_order_data(self.items[:3], quantity=2, tax=self.tax.pk, discount=self.discount.pk)
+        response = self.client.post(reverse('order:create_order'), data)
+
+        self.assertRedirects(response, 'https://checkout.stripe.com/c/pay/cs_test_1', fetch_redirect_response=False)
+        order = Order.objects.get()
+        self.assertEqual(order.stripe_session_id, 'cs_test_1')
+        self.assertEqual(order.currency, 'eur')
+        # (10 + 11 + 12) * 2 = 66, -10% = 59.40, +20% tax = 71.28
+        self.assertEqual(order.total_price, Decimal('71.28'))
+        self.assertEqual(
+            list(order.lines.order_by('item_id').values_list('item_id', 'quantity', 'unit_price')),
+            [(item.pk, 2, item.price) for item in self.items[:3]])
+        line_items = self.session_create.call_args.kwargs['line_items']
+        self.assertEqual([line_item['quantity'] for line_item in line_items], [2, 2, 2])
+
+    def test_create_order_queries(self):
+        with self.assertNumQueries(6):
+            self.client.post(reverse('order:create_order'), self.get_order_data(self.items[:1]))
+
+    def test_create_order_with_tax_and_discount_queries(self):
+        data = self.get_order_data(self.items[:5], tax=self.tax.pk, discount=self.discount.pk)
+        with self.assertNumQueries(8):
+            self.client.post(reverse('order:create_order'), data)
+
+    def test_create_order_queries_do_not_depend_on_lines_count(self):
+        with self.assertNumQueries(6):
+            self.client.post(reverse('order:create_order'), self.get_order_data(self.items))
+
+    def test_unknown_items(self):
+        data = self.get_order_data(self.items[:2])
+        unknown_item_id = self.items[-1].pk + 1
+        data['lines-1-item'] = unknown_item_id
+        # the items of all the lines are validated with one query, the others render the tax and discount choices
+        with self.assertNumQueries(3):
+            response = self.client.post(reverse('order:create_order'), data)
+
+        self.assertEqual(response.context['lines_formset'][1].errors,
+                         {'item': [f'Item {unknown_item_id} does not exist']})
+        self.assertFalse(Order.objects.exists())
+        self.session_create.assert_not_called()
+
+    def test_repeated_items_are_one_line(self):
+        data = self.get_order_data([self.items[0], self.items[1], self.items[0]], quantity=2)
+        self.client.post(reverse('order:create_order'), data)
+
+        order = Order.objects.get()
+        self.assertEqual(list(order.lines.order_by('item_id').values_list('item_id', 'quantity')),
+                         [(self.items[0].pk, 4), (self.items[1].pk, 2)])
+
+    def test_nothing_is_saved_if_stripe_fails(self):
+        self.session_create.side_effect = APIConnectionError('Network error')
+        with self.assertRaises(ProjectStripeError):
+            self.client.post(reverse('order:create_order'), self.get_order_data(self.items[:2]))
+        self.assertFalse(Order.objects.exists())
+
+
+class DeferredCheckoutTestCase(TestCase):
+    """
+    The deferred checkout (order.checkout): the order is saved without a Checkout Session, the session is created by
+    the create_checkout_session task, and the waiting page gets its url.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.items = Item.objects.bulk_create([
+            Item(name=f'Item {i}', description='Test item', price=Decimal(10 + i), currency='eur',
+                 stripe_product_id=f'prod_{i}')
+            for i in range(2)
+        ])
+        ItemStripePrice.objects.bulk_create([
+            ItemStripePrice(item=item, stripe_price_id=f'price_{item.pk}', unit_amount=int(item.price) * 100,
+                            currency='eur', tax_behavior='inclusive')
+            for item in cls.items
+        ])
+
+    def setUp(self):
+        patcher = mock.patch('stripe.checkout.Session.create', return_value={
+            'id': 'cs_test_1', 'url': 'https://checkout.stripe.com/c/pay/cs_test_1'})
+        self.session_create = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('order.checkout.create_checkout_session.delay')
+        self.create_checkout_session_delay = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_order(self) -> Order:
+        data = CreateOrderQueriesTestCase.get_order_data(self.items, quantity=2)
+        with mock.patch.object(CreateOrderView, 'deferred_checkout', True), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('order:create_order'), data)
+        order = Order.objects.get()
+        self.assertRedirects(
+            response, reverse('order:checkout_page', args=[order.pk]), fetch_redirect_response=False)
+        return order
+
+    def test_create_order(self):
+        order = self.create_order()
+
+        self.session_create.assert_not_called()
+        self.create_checkout_session_delay.assert_called_once_with(order.pk)
+        self.assertIsNone(order.stripe_session_id)
+        self.assertEqual(order.total_price, Decimal('42.00'))
+        self.assertEqual(order.currency, 'eur')
+        self.assertEqual(order.lines.count(), 2)
+
+    def test_create_checkout_session(self):
+        order = self.create_order()
+        self.assertEqual(self.client.get(reverse('order:checkout_status', args=[order.pk])).json(),
+                         {'status': 'pending'})
+        self.assertContains(self.client.get(reverse('order:checkout_page', args=[order.pk])), 'Preparing the checkout')
+
+        create_checkout_session(order.pk)
+        order.refresh_from_db()
+        self.assertEqual(order.stripe_session_id, 'cs_test_1')
+        self.assertEqual(order.checkout_url, 'https://checkout.stripe.com/c/pay/cs_test_1')
+        self.assertIsNotNone(order.session_expires_at)
+        line_items = self.session_create.call_args.kwargs['line_items']
+        self.assertEqual([line_item['quantity'] for line_item in line_items], [2, 2])
+        self.assertEqual(self.client.get(reverse('order:checkout_status', args=[order.pk])).json(),
+                         {'status': 'ready', 'checkout_url': order.checkout_url})
+        self.assertRedirects(self.client.get(reverse('order:checkout_page', args=[order.pk])),
+                             order.checkout_url, fetch_redirect_response=False)
+
+        # a redelivered task creates no second session
+        create_checkout_session(order.pk)
+        self.session_create.assert_called_once()
+
+    def test_task_is_queued_on_commit(self):
+        data = CreateOrderQueriesTestCase.get_order_data(self.items)
+        with mock.patch.object(CreateOrderView, 'deferred_checkout', True), \
+                self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(reverse('order:create_order'), data)
+            self.create_checkout_session_delay.assert_not_called()
+
+        for callback in callbacks:
+            callback()
+        self.create_checkout_session_delay.assert_called_once_with(Order.objects.get().pk)
+
+    def test_create_checkout_session_unexpected_error(self):
+        order = self.create_order()
+        self.session_create.side_effect = RuntimeError('Unexpected')
+
+        with self.assertRaisesMessage(RuntimeError, 'Unexpected'):
+            create_checkout_session(order.pk)
+        order.refresh_from_db()
+        self.assertEqual(order.payment_status, 'failed')
+        self.assertEqual(self.client.get(reverse('order:checkout_status', args=[order.pk])).json(),
+                         {'status': 'failed', 'detail': 'The Checkout Session could not be created'})
+
+    def test_create_checkout_session_redelivered(self):
+        order = self.create_order()
+        # another run of the task is creating the session
+        cache.add(f'order:{order.pk}:checkout_session', True)
+        with self.assertRaises(Retry):
+            create_checkout_session(order.pk)
+        self.session_create.assert_not_called()
+
+        cache.delete(f'order:{order.pk}:checkout_session')
+        create_checkout_session(order.pk)
+        create_checkout_session(order.pk)
+        self.session_create.assert_called_once()
+
+    def test_create_checkout_session_fails(self):
+        order = self.create_order()
+        self.session_create.side_effect = APIConnectionError('Network error')
+
+        create_checkout_session(order.pk)
+        state = self.client.get(reverse('order:checkout_status', args=[order.pk])).json()
+        self.assertEqual(state['status'], 'failed')
+        self.assertIn('Network error', state['detail'])
+        self.assertEqual(Order.objects.get().payment_status, 'failed')
+
+    async def test_checkout_events(self):
+        order = await sync_to_async(self.create_order)()
+        await sync_to_async(create_checkout_session)(order.pk)
+
+        response = await self.async_client.get(reverse('order:checkout_events', args=[order.pk]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = [piece async for piece in response.streaming_content]
+        self.assertEqual(
+            events[-1], b'data: {"status": "ready", "checkout_url": "https://checkout.stripe.com/c/pay/cs_test_1"}\n\n')
+
+    def test_checkout_events_under_wsgi(self):
+        order = self.create_order()
+        with mock.patch('order.checkout.time.sleep', side_effect=lambda _: create_checkout_session(order.pk)):
+            response = self.client.get(reverse('order:checkout_events', args=[order.pk]))
+            self.assertFalse(response.is_async)
+            events = list(response.streaming_content)
+        self.assertEqual(events, [
+            b'retry: 1000\n\n',
+            b': pending\n\n',
+            b'data: {"status": "ready", "checkout_url": "https://checkout.stripe.com/c/pay/cs_test_1"}\n\n',
+        ])
+
+    def test_server_fields_are_not_posted(self):
+        data = CreateOrderQueriesTestCase.get_order_data(
+            self.items, checkout_url='https://example.com/phishing', checkout_error='Posted',
+            paid_at='2024-01-01 00:00', session_expires_at='2024-01-01 00:00', payment_status='paid')
+        with mock.patch.object(CreateOrderView, 'deferred_checkout', True), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('order:create_order'), data)
+
+        order = Order.objects.get()
+        self.assertEqual(
+            (order.checkout_url, order.checkout_error, order.paid_at, order.session_expires_at, order.payment_status),
+            (None, None, None, None, 'unpaid'))
+        self.create_checkout_session_delay.assert_called_once_with(order.pk)
+        self.assertEqual(self.client.get(reverse('order:checkout_status', args=[order.pk])).json(),
+                         {'status': 'pending'})
+
+    def test_buy_item(self):
+        with mock.patch('item.views.CHECKOUT_DEFERRED', True), self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(reverse('items:buy_item', args=[self.items[0].pk]))
+
+        self.assertEqual(response.status_code, 202)
+        order = Order.objects.get()
+        self.assertEqual(response.json()['checkout_page_url'], reverse('order:checkout_page', args=[order.pk]))
+        self.assertEqual(order.total_price, self.items[0].price)
+        self.assertEqual(list(order.lines.values_list('item_id', 'quantity')), [(self.items[0].pk, 1)])
+        self.create_checkout_session_delay.assert_called_once_with(order.pk)
+        self.session_create.assert_not_called()
+
+
+class AsyncCheckoutViewsTestCase(TransactionTestCase):
+    """
+    The async checkout views (AsyncCreateOrderView and abuy_item). The Checkout Session is created in a thread pool
+    worker with its own database connection, so the test data is committed (TransactionTestCase): a TestCase
+    transaction would lock the tables for the worker's connection.
+    """
+
+    def setUp(self):
+        self.items = Item.objects.bulk_create([
+            Item(name=f'Item {i}', description='Test item', price=Decimal(10 + i), currency='eur',
+                 stripe_product_id=f'prod_{i}')
+            for i in range(2)
+        ])
+        ItemStripePrice.objects.bulk_create([
+            ItemStripePrice(item=item, stripe_price_id=f'price_{item.pk}', unit_amount=int(item.price) * 100,
+                            currency='eur', tax_behavior='inclusive')
+            for item in self.items
+        ])
+        patcher = mock.patch('stripe.checkout.Session.create', return_value={
+            'id': 'cs_test_1', 'url': 'https://checkout.stripe.com/c/pay/cs_test_1'})
+        self.session_create = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_create_order(self):
+        data = CreateOrderQueriesTestCase.get_order_data(self.items, quantity=2)
+        response = await self.async_client.post(reverse('order:acreate_order'), data)
+
+        self.assertRedirects(response, 'https://checkout.stripe.com/c/pay/cs_test_1', fetch_redirect_response=False)
+        order = await Order.objects.aget()
+        self.assertEqual(order.stripe_session_id, 'cs_test_1')
+        self.assertEqual(order.total_price, Decimal('42.00'))
+        self.assertEqual(await order.lines.acount(), 2)
+        line_items = self.session_create.call_args.kwargs['line_items']
+        self.assertEqual([line_item['price'] for line_item in line_items],
+                         [f'price_{item.pk}' for item in self.items])
+
+    async def test_create_order_invalid_form(self):
+        data = CreateOrderQueriesTestCase.get_order_data(self.items, quantity=0)
+        response = await self.async_client.post(reverse('order:acreate_order'), data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(await Order.objects.aexists())
+        self.session_create.assert_not_called()
+
+    async def test_create_order_deferred(self):
+        data = CreateOrderQueriesTestCase.get_order_data(self.items)
+        with mock.patch.object(CreateOrderView, 'deferred_checkout', True), \
+                mock.patch('order.checkout.create_checkout_session.delay') as create_checkout_session_delay:
+            response = await self.async_client.post(reverse('order:acreate_order'), data)
+
+        order = await Order.objects.aget()
+        self.assertRedirects(
+            response, reverse('order:checkout_page', args=[order.pk]), fetch_redirect_response=False)
+        create_checkout_session_delay.assert_called_once_with(order.pk)
+        self.session_create.assert_not_called()
+
+    async def test_buy_item(self):
+        response = await self.async_client.get(reverse('items:abuy_item', args=[self.items[0].pk]))
+
+        self.assertEqual(response.json(), {
+            'stripe_session_id': 'cs_test_1', 'checkout_url': 'https://checkout.stripe.com/c/pay/cs_test_1'})
+        self.assertEqual(self.session_create.call_args.kwargs['line_items'][0]['price'], f'price_{self.items[0].pk}')
+
+    async def test_buy_item_not_found(self):
+        response = await self.async_client.get(reverse('items:abuy_item', args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_concurrent_checkouts(self):
+        # both Checkout Sessions are created at the same time: neither request waits for the other one's Stripe call
+        barrier = threading.Barrier(2, timeout=5)
+
+        def create_session(**kwargs):
+            barrier.wait()
+            return self.session_create.return_value
+
+        self.session_create.side_effect = create_session
+        responses = await asyncio.gather(*(
+            self.async_client.get(reverse('items:abuy_item', args=[item.pk])) for item in self.items))
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+
+
+class ClientsTestCase(TestCase):
+    """
+    The shared Stripe and fixer.io clients (config.clients): one pooled client per process, the retries of
+    the failed requests, and the rate limiter of the bulk Stripe jobs.
+    """
+
+    def setUp(self):
+        # the Stripe client is set up on the first use
+        self.stripe = get_stripe()
+        self.fake_api = FakeAPIServer().__enter__()
+        self.addCleanup(self.fake_api.__exit__, None, None, None)
+        for patcher in [
+            mock.patch.object(self.stripe, 'api_base', self.fake_api.url),
+            mock.patch.object(self.stripe, 'api_key', 'sk_test_clients'),
+            mock.patch('config.settings.FIXER_API_URL', f'{self.fake_api.url}/api'),
+            # no backoff between the retries
+            mock.patch('stripe.http_client.HTTPClient._sleep_time_seconds', return_value=0),
+            mock.patch('urllib3.util.retry.Retry.get_backoff_time', return_value=0),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_shared_clients(self):
+        self.assertIs(get_stripe(), self.stripe)
+        self.assertIs(get_fixer_session(), get_fixer_session())
+        self.assertEqual(self.stripe.default_http_client._timeout, STRIPE_TIMEOUT)
+
+    def test_stripe_retries(self):
+        self.fake_api.failures['product_create'] = 1
+        self.assertEqual(self.stripe.Product.create(name='Item')['name'], 'Item')
+        self.assertEqual(self.fake_api.calls['product_create'], 2)
+        # the retried write is not duplicated
+        self.assertEqual(len(set(self.fake_api.idempotency_keys)), 1)
+
+    def test_fixer_retries(self):
+        self.fake_api.failures['fx_fetch'] = FIXER_MAX_RETRIES
+        self.assertEqual(fetch_fx_rates().base, 'EUR')
+        self.assertEqual(self.fake_api.calls['fx_fetch'], FIXER_MAX_RETRIES + 1)
+
+        self.fake_api.failures['fx_fetch'] = FIXER_MAX_RETRIES + 1
+        with self.assertRaises(FxRatesError):
+            fetch_fx_rates()
+
+    def test_rate_limiter(self):
+        rate_limiter = RateLimiter(rate=50)
+        started_at = time.monotonic()
+        for _ in range(5):
+            rate_limiter.acquire()
+        # the calls are spaced by 1 / 50 seconds
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.08)
+
+
+class MetricsTestCase(TestCase):
+    """
+    The metrics of the outbound API requests, the views and the celery tasks (config.metrics),
+    and the /metrics endpoint.
+    """
+
+    @staticmethod
+    def get_count(name: str, **labels) -> float:
+        return REGISTRY.get_sample_value(f'{name}_count', labels) or 0
+
+    def test_stripe_operations(self):
+        for method, path, operation in [
+            ('post', '/v1/products', 'products.create'),
+            ('post', '/v1/products/prod_1', 'products.update'),
+            ('post', '/v1/prices', 'prices.create'),
+            ('post', '/v1/coupons', 'coupons.create'),
+            ('post', '/v1/tax_rates', 'tax_rates.create'),
+            ('post', '/v1/checkout/sessions', 'checkout.sessions.create'),
+            ('get', '/v1/checkout/sessions/cs_test_1', 'checkout.sessions.retrieve'),
+            ('get', '/v1/checkout/sessions?limit=100', 'checkout.sessions.list'),
+            ('post', '/v1/checkout/sessions/cs_test_1/expire', 'checkout.sessions.expire'),
+        ]:
+            with self.subTest(method=method, path=path):
+                self.assertEqual(get_stripe_operation(method, f'https://api.stripe.com{path}'), operation)
+
+    def test_external_requests(self):
+        stripe_count = self.get_count(
+            'external_request_duration_seconds', service='stripe', operation='products.create', outcome='2xx')
+        fixer_count = self.get_count(
+            'external_request_duration_seconds', service='fixer', operation='latest', outcome='2xx')
+        # the instrumented Stripe client is set up on the first use
+        stripe = get_stripe()
+        with FakeAPIServer() as fake_api, mock.patch('stripe.api_base', fake_api.url), \
+                mock.patch('stripe.api_key', 'sk_test_metrics'), \
+                mock.patch('config.settings.FIXER_API_URL', f'{fake_api.url}/api'):
+            stripe.Product.create(name='Item')
+            fetch_fx_rates()
+
+        self.assertEqual(self.get_count(
+            'external_request_duration_seconds', service='stripe', operation='products.create', outcome='2xx'),
+            stripe_count + 1)
+        self.assertEqual(self.get_count(
+            'external_request_duration_seconds', service='fixer', operation='latest', outcome='2xx'),
+            fixer_count + 1)
+
+    def test_view_metrics(self):
+        view = 'items:search_items'
+        db_queries = REGISTRY.get_sample_value('http_request_db_queries_sum', {'view': view}) or 0
+        requests_count = self.get_count('http_request_duration_seconds', view=view, method='GET', status='200')
+
+        self.client.get(reverse('items:search_items'), {'q': 'item'})
+        self.assertEqual(
+            self.get_count('http_request_duration_seconds', view=view, method='GET', status='200'), requests_count + 1)
+        self.assertEqual(REGISTRY.get_sample_value('http_request_db_queries_sum', {'view': view}), db_queries + 1)
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'http_request_db_queries_count{{view="{view}"}}', response.content.decode())
+
+    def test_task_metrics(self):
+        task = 'order.tasks.refresh_sales_rollups_task'
+        tasks_count = self.get_count('celery_task_duration_seconds', task=task, outcome='SUCCESS')
+        refresh_sales_rollups_task.apply()
+        self.assertEqual(self.get_count('celery_task_duration_seconds', task=task, outcome='SUCCESS'), tasks_count + 1)
+
+    def test_metrics_token(self):
+        with mock.patch('config.metrics.METRICS_TOKEN', 'secret'):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 401)
+            response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+
+
+class TracingTestCase(TestCase):
+    """
+    The spans of a checkout (config.tracing): the view span, the trace context sent with the celery task,
+    and the order timeline (the trace_order command).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        DeferredCheckoutTestCase.setUpTestData.__func__(cls)
+
+    def setUp(self):
+        trace_file = tempfile.NamedTemporaryFile(suffix='.jsonl')
+        self.addCleanup(trace_file.close)
+        self.trace_file = trace_file.name
+        for target, value in [
+            ('config.tracing.TRACING_FILE', self.trace_file),
+            ('order.management.commands.trace_order.TRACING_FILE', self.trace_file),
+            ('stripe.checkout.Session.create', mock.Mock(return_value={
+                'id': 'cs_test_1', 'url': 'https://checkout.stripe.com/c/pay/cs_test_1'})),
+            ('order.checkout.create_checkout_session.delay', mock.Mock()),
+        ]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get_spans(self) -> list[dict]:
+        with open(self.trace_file) as trace_file:
+            return [json.loads(line) for line in trace_file]
+
+    def test_checkout_trace(self):
+        order = DeferredCheckoutTestCase.create_order(self)
+        [view_span] = self.get_spans()
+        self.assertEqual(view_span['name'], 'POST orders:create_order')
+        self.assertEqual(view_span['attributes']['order_id'], order.pk)
+        self.assertEqual(view_span['attributes']['status_code'], 302)
+        self.assertIsNone(view_span['parent_id'])
+
+        # the task is run by a worker with the trace context of the message headers
+        headers = {}
+        with span('POST orders:create_order') as parent:
+            inject_trace_context(headers=headers)
+        create_checkout_session.apply(args=[order.pk], headers=headers)
+
+        task_span = next(record for record in self.get_spans() if record['name'].startswith('task '))
+        self.assertEqual(task_span['name'], 'task order.tasks.create_checkout_session')
+        self.assertEqual((task_span['trace_id'], task_span['parent_id']), (parent.trace_id, parent.span_id))
+        self.assertEqual(task_span['attributes']['order_id'], order.pk)
+        self.assertEqual(task_span['attributes']['state'], 'SUCCESS')
+        session_span = next(record for record in self.get_spans() if record['name'] == 'checkout session')
+        self.assertEqual(session_span['parent_id'], task_span['span_id'])
+
+        output = StringIO()
+        call_command('trace_order', order.pk, stdout=output)
+        self.assertIn(f'Order {order.pk}: 4 spans of 2 traces', output.getvalue())
+        self.assertIn('    task order.tasks.create_checkout_session', output.getvalue())
+
+    def test_tracing_off(self):
+        with mock.patch('config.tracing.TRACING_FILE', None):
+            DeferredCheckoutTestCase.create_order(self)
+        self.assertEqual(self.get_spans(), [])
+
+
+class FxRatesTestCase(TestCase):
+    """
+    The rate matrix of all the currencies (order.utils.get_fx_rates): one fixer.io request, the cross rates,
+    and the mixed-currency carts quoted without more requests.
+    """
+
+    def setUp(self):
+        for target, value in [
+            ('order.utils.CURRENCIES', ['RUB', 'EUR', 'USD', 'GBP']),
+            ('order.utils._fx_rates', None),
+        ]:
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        fake_api = FakeAPIServer().__enter__()
+        self.addCleanup(fake_api.__exit__, None, None, None)
+        patcher = mock.patch('config.settings.FIXER_API_URL', f'{fake_api.url}/api')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fake_api = fake_api
+        cache.delete_many([get_fx_rates_cache_key(), f'{get_fx_rates_cache_key()}:refreshing'])
+
+    def test_cross_rates(self):
+        fx_rates = fetch_fx_rates()
+        self.assertEqual(self.fake_api.calls['fx_fetch'], 1)
+        self.assertEqual(fx_rates.base, 'EUR')
+        self.assertEqual(set(fx_rates.rates), {'RUB', 'EUR', 'USD', 'GBP'})
+        self.assertEqual(fx_rates.get_rate('eur', 'eur'), 1)
+        self.assertEqual(fx_rates.get_rate('rub', 'eur'), 1 / Decimal('98.5'))
+        self.assertEqual(fx_rates.get_rate('usd', 'gbp'), Decimal('0.86') / Decimal('1.09'))
+
+    def test_mixed_currency_carts(self):
+        items = Item.objects.bulk_create([
+            Item(name=f'Item {currency}', description='Test item', price=Decimal(100), currency=currency)
+            for currency in ('eur', 'rub', 'usd', 'gbp')
+        ])
+        with mock.patch('django.core.cache.cache.get', wraps=cache.get) as cache_get:
+            quotes = [PricingEngine(base_curr='EUR').quote(items=items) for _ in range(3)]
+        self.assertEqual(self.fake_api.calls['fx_fetch'], 1)
+        # the fresh rates are kept in the process memory
+        self.assertEqual(cache_get.call_count, 1)
+        # 10000 cents of every currency: 10000 + 101 + 9174 + 11627 euro cents, truncated
+        self.assertEqual(quotes[0].currency, 'eur')
+        self.assertEqual(quotes[0].total, Decimal('309.02'))
+        self.assertEqual(len(set(quotes)), 1)
+
+    def test_cached_rates(self):
+        get_fx_rates()
+        with mock.patch('order.utils._fx_rates', None):
+            self.assertEqual(get_fx_rates().rates['USD'], Decimal('1.09'))
+        self.assertEqual(self.fake_api.calls['fx_fetch'], 1)
+
+    def test_stale_rates(self):
+        fx_rates = get_fx_rates()
+        stale_rates = fx_rates._replace(fetched_at=fx_rates.fetched_at - FX_RATE_TTL - 1)
+        cache.set(get_fx_rates_cache_key(), stale_rates)
+
+        with mock.patch('order.utils._fx_rates', None), \
+                mock.patch('order.tasks.refresh_fx_rates_task.delay') as refresh_fx_rates_task_delay:
+            # the stale rates are served at once, a single background refresh is scheduled
+            self.assertEqual(get_fx_rates(), stale_rates)
+            self.assertEqual(get_fx_rates(), stale_rates)
+        refresh_fx_rates_task_delay.assert_called_once_with()
+        self.assertEqual(self.fake_api.calls['fx_fetch'], 1)
+
+        refresh_fx_rates_task()
+        self.assertEqual(self.fake_api.calls['fx_fetch'], 2)
+        self.assertGreater(cache.get(get_fx_rates_cache_key()).fetched_at, stale_rates.fetched_at)
+
+    def test_fixer_error(self):
+        self.fake_api.fx_error = {'code': 104, 'type': 'usage_limit_reached'}
+        with self.assertRaisesMessage(FxRatesError, 'usage_limit_reached'):
+            get_fx_rates()
+
+        items = Item.objects.bulk_create([
+            Item(name=f'Item {currency}', description='Test item', price=Decimal(100), currency=currency)
+            for currency in ('eur', 'rub')
+        ])
+        response = self.client.get(reverse('order:quote_order'), {'items': [item.pk for item in items]})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('The currency rates are not available', response.json()['detail'])
+        response = self.client.post(
+            reverse('order:create_order'), CreateOrderQueriesTestCase.get_order_data(items))
+        self.assertContains(response, 'The currency rates are not available')
+        self.assertFalse(Order.objects.exists())
+
+    def test_fixer_error_serves_last_rates(self):
+        fx_rates = get_fx_rates()
+        expired_rates = fx_rates._replace(fetched_at=fx_rates.fetched_at - FX_RATE_MAX_STALENESS - 1)
+        cache.set(get_fx_rates_cache_key(), expired_rates)
+        self.fake_api.fx_error = {'code': 101, 'type': 'invalid_access_key'}
+
+        with mock.patch('order.utils._fx_rates', None):
+            self.assertEqual(get_fx_rates(), expired_rates)
+            # the failed fetch is not repeated by every request
+            self.assertEqual(get_fx_rates(), expired_rates)
+        self.assertEqual(self.fake_api.calls['fx_fetch'], 2)
+
+    def test_fixer_http_error(self):
+        with mock.patch('config.settings.FIXER_API_URL', f'{self.fake_api.url}/unknown'):
+            with self.assertRaisesMessage(FxRatesError, '404'):
+                fetch_fx_rates()
+
+    def test_missing_rate(self):
+        items = Item.objects.bulk_create([
+            Item(name=f'Item {currency}', description='Test item', price=Decimal(100), currency=currency)
+            for currency in ('eur', 'chf')
+        ])
+        with self.assertRaisesMessage(PricingError, 'No CHF rate'):
+            PricingEngine(base_curr='EUR').quote(items=items)
+
+
+class StripeWebhookTestCase(TestCase):
+    """
+    The Stripe webhook (order.views.stripe_webhook): the signature verification and the redelivered events.
+    """
+    secret = 'whsec_test'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.order = Order.objects.create(stripe_session_id='cs_test_1')
+
+    def setUp(self):
+        patcher = mock.patch('order.views.STRIPE_WEBHOOK_SECRET', self.secret)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post_event(self, event: dict, secret: str = None):
+        payload = json.dumps(event)
+        timestamp = int(time.time())
+        signature = hmac.new(
+            (secret or self.secret).encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        return self.client.post(reverse('order:stripe_webhook'), payload, content_type='application/json',
+                                HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}')
+
+    @staticmethod
+    def get_event(event_id: str = 'evt_1') -> dict:
+        return {
+            'id': event_id, 'object': 'event', 'type': 'checkout.session.completed',
+            'data': {'object': {'id': 'cs_test_1', 'object': 'checkout.session', 'payment_status': 'paid'}},
+        }
+
+    def test_paid_event(self):
+        self.assertEqual(self.post_event(self.get_event()).status_code, 200)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'paid')
+        self.assertIsNotNone(self.order.paid_at)
+
+    def test_invalid_signature(self):
+        self.assertEqual(self.post_event(self.get_event(), secret='whsec_other').status_code, 400)
+        response = self.client.post(reverse('order:stripe_webhook'), json.dumps(self.get_event()),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.get().payment_status, 'unpaid')
+
+    def test_redelivered_event(self):
+        self.post_event(self.get_event())
+        Order.objects.update(payment_status='unpaid', paid_at=None)
+
+        self.assertEqual(self.post_event(self.get_event()).status_code, 200)
+        self.assertEqual(Order.objects.get().payment_status, 'unpaid')
+        self.assertEqual(StripeEvent.objects.count(), 1)
+
+    def test_secret_is_not_set(self):
+        with mock.patch('order.views.STRIPE_WEBHOOK_SECRET', None):
+            self.assertEqual(self.post_event(self.get_event()).status_code, 503)
+        self.assertFalse(StripeEvent.objects.exists())
+
+
+class QuoteOrderTestCase(TestCase):
+    """
+    The order quote endpoint (order.views.quote_order): a single cart by GET, many carts by POST.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.items = Item.objects.bulk_create([
+            Item(name=f'Item {i}', description='Test item', price=Decimal(10 + i), currency='eur') for i in range(2)
+        ])
+        cls.tax = Tax.objects.create(name='VAT 20', rate=Decimal('20.00'))
+
+    def post_carts(self, carts):
+        return self.client.post(reverse('order:quote_order'), {'carts': carts}, content_type='application/json')
+
+    def test_quote(self):
+        response = self.client.get(
+            reverse('order:quote_order'), {'items': [item.pk for item in self.items], 'tax': self.tax.pk})
+        self.assertEqual(response.json(), {
+            'currency': 'eur', 'subtotal': '21.00', 'discount': '0.00', 'tax': '4.20', 'total': '25.20'})
+
+    def test_quote_carts(self):
+        response = self.post_carts([{'items': [self.items[0].pk]}, {'items': [self.items[1].pk], 'tax': self.tax.pk}])
+        self.assertEqual([quote['total'] for quote in response.json()['quotes']], ['10.00', '13.20'])
+
+    def test_invalid_carts(self):
+        for carts, detail in [
+            ([{'items': ['one']}], 'Item, tax and discount ids must be integers'),
+            ([{'items': [0]}], 'Items [0] do not exist'),
+            ('carts', 'The body must be JSON'),
+            ([{'items': [self.items[0].pk]}] * (QUOTE_MAX_CARTS + 1), f'At most {QUOTE_MAX_CARTS} carts'),
+        ]:
+            with self.subTest(detail=detail):
+                response = self.post_carts(carts)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn(detail, response.json()['detail'])
+
+    def test_other_methods(self):
+        for method in ('put', 'patch', 'delete'):
+            with self.subTest(method=method):
+                response = getattr(self.client, method)(
+                    reverse('order:quote_order'), {'carts': []}, content_type='application/json')
+                self.assertEqual(response.status_code, 405)
+                self.assertEqual(response['Allow'], 'GET, POST')
+
+
+class SweepPaymentStatusesQueriesTestCase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Order.objects.bulk_create([
+            Order(stripe_session_id=f'cs_test_{i}', session_expires_at=timezone.now() + timedelta(minutes=30))
+            for i in range(10)
+        ])
+
+    def test_sweep_payment_statuses_queries(self):
+        paid_session_ids = {'cs_test_1', 'cs_test_2', 'cs_test_3'}
+        with mock.patch('order.service.ProjectStripeSession.get_paid_session_ids', return_value=paid_session_ids):
+            # selecting the open orders (1) and a bulk update (1)
+            with self.assertNumQueries(2):
+                self.assertEqual(sweep_payment_statuses(), 3)
+        self.assertEqual(Order.objects.filter(payment_status='paid').count(), 3)
+
+
+class ExpireOrdersTestCase(TestCase):
+    """
+    The unpaid orders are set as 'expired' after their Checkout Session has expired, and are not swept anymore.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        cls.overdue, cls.in_grace_period, cls.open, cls.paid = Order.objects.bulk_create([
+            Order(stripe_session_id='cs_test_overdue', session_expires_at=now - timedelta(hours=1)),
+            Order(stripe_session_id='cs_test_in_grace_period', session_expires_at=now - timedelta(minutes=1)),
+            Order(stripe_session_id='cs_test_open', session_expires_at=now + timedelta(minutes=10)),
+            Order(stripe_session_id='cs_test_paid', session_expires_at=now - timedelta(hours=1), payment_status='paid'),
+        ])
+
+    def test_expire_orders(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(expire_orders(), 1)
+        self.assertEqual(
+            dict(Order.objects.values_list('stripe_session_id', 'payment_status')),
+            {'cs_test_overdue': 'expired', 'cs_test_in_grace_period': 'unpaid', 'cs_test_open': 'unpaid',
+             'cs_test_paid': 'paid'})
+
+    def test_sweep_skips_expired_orders(self):
+        with mock.patch('order.service.ProjectStripeSession.get_paid_session_ids', return_value=set()) as paid_ids:
+            sweep_payment_statuses()
+        # the oldest swept order is the one within the grace period
+        paid_ids.assert_called_once_with(created_since=self.in_grace_period.created_at)
+        expire_orders()
+        with mock.patch('order.service.ProjectStripeSession.get_paid_session_ids', return_value={'cs_test_overdue'}):
+            self.assertEqual(sweep_payment_statuses(), 0)
+
+    def test_webhook_events(self):
+        for event_type, session_id, payment_status in [
+            ('checkout.session.expired', 'cs_test_open', 'expired'),
+            ('checkout.session.async_payment_failed', 'cs_test_in_grace_period', 'failed'),
+            # a paid order is not expired
+            ('checkout.session.expired', 'cs_test_paid', 'paid'),
+        ]:
+            with self.subTest(event_type=event_type, session_id=session_id):
+                handle_stripe_event(
+                    {'id': f'evt_{session_id}', 'type': event_type, 'data': {'object': {'id': session_id}}})
+                self.assertEqual(
+                    Order.objects.get(stripe_session_id=session_id).payment_status, payment_status)
+
+
+class SalesRollupsTestCase(TestCase):
+    """
+    The sales rollups (order.rollups) count the paid orders only, per their payment hour, and are refreshed
+    incrementally.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.hour = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(hours=3)
+        Order.objects.bulk_create([
+            Order(payment_status='paid', paid_at=cls.hour + timedelta(minutes=15), total_price=10, currency='eur'),
+            Order(payment_status='paid', paid_at=cls.hour + timedelta(minutes=45), total_price=20, currency='eur'),
+            Order(payment_status='paid', paid_at=cls.hour + timedelta(minutes=70), total_price=100, currency='rub'),
+            # a paid_at without the paid status is not a sale
+            Order(payment_status='unpaid', paid_at=cls.hour + timedelta(minutes=30), total_price=1000, currency='eur'),
+            Order(payment_status='expired', paid_at=cls.hour + timedelta(minutes=30), total_price=1000, currency='eur'),
+        ])
+        cls.staff = User.objects.create_user('staff', password='password', is_staff=True)
+
+    def get_rollups(self) -> list[tuple]:
+        return list(SalesRollup.objects.order_by('hour', 'currency').values_list(
+            'hour', 'currency', 'orders_count', 'revenue'))
+
+    def test_refresh_sales_rollups(self):
+        self.assertEqual(refresh_sales_rollups(now=self.hour + timedelta(hours=2)), 2)
+        self.assertEqual(self.get_rollups(), [
+            (self.hour, 'eur', 2, Decimal('30.00')),
+            (self.hour + timedelta(hours=1), 'rub', 1, Decimal('100.00')),
+        ])
+
+    def test_incremental_refresh(self):
+        refresh_sales_rollups(now=self.hour + timedelta(hours=2))
+        # paid before the high-water mark, within SALES_ROLLUP_LATENESS
+        Order.objects.create(
+            payment_status='paid', paid_at=self.hour + timedelta(hours=2, seconds=-60), total_price=5, currency='eur')
+        Order.objects.filter(currency='rub').update(payment_status='unpaid')
+
+        self.assertEqual(refresh_sales_rollups(now=self.hour + timedelta(hours=3)), 1)
+        self.assertEqual(self.get_rollups(), [
+            (self.hour, 'eur', 2, Decimal('30.00')),
+            (self.hour + timedelta(hours=1), 'eur', 1, Decimal('5.00')),
+        ])
+
+    def test_sales_report(self):
+        refresh_sales_rollups(now=self.hour + timedelta(hours=2))
+        url = reverse('order:sales_report')
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(url, {'since': self.hour.isoformat(), 'period': 'hour'})
+        self.assertEqual(
+            [(row['currency'], row['orders_count'], Decimal(row['revenue'])) for row in response.json()['rows']],
+            [('eur', 2, Decimal(30)), ('rub', 1, Decimal(100))])
+        self.assertEqual(self.client.get(url, {'period': 'week'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'since': 'yesterday'}).status_code, 400)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'The query plans are checked on Postgres only')
+class OrderQueryPlansTestCase(QueryPlanTestMixin, TestCase):
+    """
+    The order admin changelist queries, the sweep_payment_statuses and expire_orders tasks queries on a large orders
+    table (mostly old paid orders, and a few recent unpaid ones) use the indexes.
+    """
+    ORDERS_COUNT = 50000
+    UNPAID_ORDERS_COUNT = 200
+
+    @classmethod
+    def setUpTestData(cls):
+        Order.objects.bulk_create([
+            Order(stripe_session_id=f'cs_test_{i}', total_price=Decimal(i % 1000), currency='eur',
+                  payment_status='unpaid' if i >= cls.ORDERS_COUNT - cls.UNPAID_ORDERS_COUNT else 'paid')
+            for i in range(cls.ORDERS_COUNT)
+        ], batch_size=5000)
+        # an order is created every minute, the newest one now
+        Order.objects.update(created_at=Now() - ExpressionWrapper(
+            (cls.ORDERS_COUNT - F('pk')) * timedelta(minutes=1), output_field=DurationField()))
+        Order.objects.update(session_expires_at=F('created_at') + timedelta(minutes=30))
+        cls.analyze(Order)
+        cls.superuser = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+    def get_changelist_queries(self, params: dict) -> list[dict]:
+        self.client.force_login(self.superuser)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:order_order_changelist'), params)
+        self.assertEqual(response.status_code, 200)
+        return list(queries)
+
+    def test_admin_changelist_pages(self):
+        # 'o' orders by a list_display column, created_at is the 5th one after the action checkbox column
+        created_at_column = 5
+        for params in [
+            {},
+            {'payment_status__exact': 'paid'},
+            {'payment_status__exact': 'unpaid'},
+            {'o': f'-{created_at_column}'},
+            {'o': f'-{created_at_column}', 'payment_status__exact': 'paid'},
+            {'o': f'{created_at_column}', 'payment_status__exact': 'unpaid'},
+        ]:
+            with self.subTest(params=params):
+                # the counts of the not selective filters are skipped, see test_admin_changelist_unpaid_filter
+                queries = [
+                    query for query in self.get_changelist_queries(params)
+                    if not query['sql'].startswith('SELECT COUNT(*)')
+                ]
+                self.assertNoSeqScan(queries, Order._meta.db_table)
+
+    def test_admin_changelist_unpaid_filter(self):
+        queries = [
+            query for query in self.get_changelist_queries({'payment_status__exact': 'unpaid'})
+            # the full count of the orders (shown next to the filtered count) reads the whole table anyway
+            if query['sql'] != 'SELECT COUNT(*) AS "__count" FROM "order_order"'
+        ]
+        self.assertNoSeqScan(queries, Order._meta.db_table)
+
+    def test_admin_search(self):
+        for search_term in ['cs_test_4242', '4242']:
+            with self.subTest(search_term=search_term):
+                queries = [
+                    query for query in self.get_changelist_queries({'q': search_term})
+                    if query['sql'] != 'SELECT COUNT(*) AS "__count" FROM "order_order"'
+                ]
+                self.assertNoSeqScan(queries, Order._meta.db_table)
+
+    def test_sweep_payment_statuses(self):
+        with mock.patch('order.service.ProjectStripeSession.get_paid_session_ids', return_value=set()):
+            with CaptureQueriesContext(connection) as queries:
+                sweep_payment_statuses()
+        self.assertNoSeqScan(queries, Order._meta.db_table)
+
+    def test_expire_orders(self):
+        with CaptureQueriesContext(connection) as queries:
+            expire_orders()
+        self.assertNoSeqScan(queries, Order._meta.db_table)
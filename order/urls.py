@@ -1,10 +1,20 @@
 from django.urls import path
 
 from order.apps import OrderConfig
-from order.views import CreateOrderView
+from order.views import (
+    CreateOrderView, AsyncCreateOrderView, stripe_webhook, quote_order, sales_report, checkout_page, checkout_status,
+    checkout_events,
+)
 
 app_name = OrderConfig.name
 
 urlpatterns = [
-    path('order/create', CreateOrderView.as_view(), name='create_order')
+    path('order/create', CreateOrderView.as_view(), name='create_order'),
+    path('async/order/create', AsyncCreateOrderView.as_view(), name='acreate_order'),
+    path('order/<int:order_id>/checkout', checkout_page, name='checkout_page'),
+    path('order/<int:order_id>/checkout/status', checkout_status, name='checkout_status'),
+    path('order/<int:order_id>/checkout/events', checkout_events, name='checkout_events'),
+    path('order/quote', quote_order, name='quote_order'),
+    path('order/stripe/webhook', stripe_webhook, name='stripe_webhook'),
+    path('order/reports/sales', sales_report, name='sales_report'),
 ]
@@ -1,18 +1,139 @@
-import requests
+import time
+from decimal import Decimal
+from typing import NamedTuple
 
-from config.settings import FIXER_API_KEY
+from django.core.cache import cache
 
+from config import settings
+from config.clients import get_fixer_session
+from config.metrics import FX_RATE_LOOKUP_DURATION, observe_external_request
+from config.settings import (
+    CURRENCIES, FIXER_API_KEY, FX_RATE_TTL, FX_RATE_MAX_STALENESS, FIXER_TIMEOUT, FIXER_MAX_RETRIES,
+)
+from config.tracing import span
 
-def get_conversion_rate(base_curr: str, second_curr: str) -> float:
+
+class FxRatesError(Exception):
+    pass
+
+
+class FxRates(NamedTuple):
+    """
+    The rate matrix of the CURRENCIES: the units of every currency per unit of the fixer.io base currency (EUR on
+    the fixer.io free plan), fetched in one request. The rate of any pair of the currencies is a cross rate
+    via the base currency, so no request is made per pair.
+    """
+    base: str
+    rates: dict[str, Decimal]
+    fetched_at: float
+
+    def get_rate(self, from_curr: str, to_curr: str) -> Decimal:
+        """
+        Returns the rate converting an amount in from_curr to to_curr (the to_curr units per from_curr unit).
+
+        :param from_curr: the currency of the amount, e.g. 'rub' or 'RUB'.
+        :param to_curr: the target currency.
+        :raise FxRatesError: if there is no rate of a currency (it is not one of the CURRENCIES).
+        """
+        try:
+            return self.rates[to_curr.upper()] / self.rates[from_curr.upper()]
+        except KeyError as e:
+            raise FxRatesError(f'No {e.args[0]} rate, the rates are of {", ".join(sorted(self.rates))}')
+
+
+# the rate matrix of this process, used without a cache lookup while it is fresh (see get_fx_rates)
+_fx_rates: FxRates | None = None
+
+
+def get_fx_rates_cache_key() -> str:
+    return f"fx_rates:{','.join(sorted(CURRENCIES))}"
+
+
+def fetch_fx_rates() -> FxRates:
     """
-    Returns the latest currency rate (second_curr against base_curr).
+    Returns the latest rates of all the CURRENCIES, requested from the fixer.io API in one request.
 
-    :param base_curr: the base currency, used by the fixer.io API as the 'base' argument's value.
-    :param second_curr: the second currency, used by the fixer.io API as the 'symbols' argument's value.
-    :return: the final rate (second_curr against base_curr).
+    :return: an FxRates instance.
+    :raise FxRatesError: if the request has failed, or fixer.io has returned an error.
     """
-    endpoint = f'http://data.fixer.io/api/latest?access_key={FIXER_API_KEY}&base={base_curr}&symbols={second_curr}'
-    response = requests.get(endpoint)
-    rate = response.json()['rates'][second_curr]
-    result = 1 / rate
-    return result
+    symbols = ','.join(CURRENCIES)
+    endpoint = f'{settings.FIXER_API_URL}/latest?access_key={FIXER_API_KEY}&symbols={symbols}'
+    started_at, status_code = time.perf_counter(), None
+    with span('fixer latest', symbols=symbols):
+        try:
+            response = get_fixer_session().get(endpoint, timeout=FIXER_TIMEOUT)
+            status_code = response.status_code
+            response.raise_for_status()
+            data = response.json()
+        # the requests exceptions (including the invalid JSON one) are OSErrors
+        except (OSError, ValueError) as e:
+            raise FxRatesError(f'The fixer.io request has failed: {e}')
+        finally:
+            observe_external_request('fixer', 'latest', started_at, status_code)
+    # fixer.io responds to the failed requests (e.g. the exceeded quota, an invalid key) with 200 and success=false
+    if not data.get('success', False):
+        raise FxRatesError(f"fixer.io has returned an error: {data.get('error')}")
+    rates = {symbol: Decimal(str(rate)) for symbol, rate in data['rates'].items()}
+    rates[data['base']] = Decimal(1)
+    return FxRates(base=data['base'], rates=rates, fetched_at=time.time())
+
+
+def refresh_fx_rates() -> FxRates:
+    """
+    Fetches the latest rates from the fixer.io API and stores them in the shared cache.
+    The cached rates are kept until they are replaced by the next fetched ones (see get_fx_rates for their expiry),
+    so the last good rates are there while the fixer.io API fails.
+
+    :return: an FxRates instance.
+    :raise FxRatesError: if the rates can't be fetched.
+    """
+    global _fx_rates
+    _fx_rates = fetch_fx_rates()
+    cache.set(get_fx_rates_cache_key(), _fx_rates, timeout=None)
+    return _fx_rates
+
+
+def get_fx_rates() -> FxRates:
+    """
+    Returns the latest rates of all the CURRENCIES. The rates are kept in the process memory while they are fresh
+    (FX_RATE_TTL), then they are looked up in the shared cache.
+    Stale cached rates (older than FX_RATE_TTL) are returned as is, and a background refresh is scheduled
+    (stale-while-revalidate). The rates are also refreshed periodically by the refresh_fx_rates_task celery-beat task.
+    The rates are fetched synchronously if there are no cached rates, or they are older than FX_RATE_MAX_STALENESS.
+    If the fetch fails, the last good rates (the expired cached ones or the ones of the process memory) are returned,
+    and the fetch is not retried by other requests until the refresh lock expires.
+
+    :return: an FxRates instance.
+    :raise FxRatesError: if the rates can't be fetched and there are no last good rates.
+    """
+    global _fx_rates
+    started_at = time.perf_counter()
+    if _fx_rates is not None and time.time() - _fx_rates.fetched_at <= FX_RATE_TTL:
+        FX_RATE_LOOKUP_DURATION.labels(source='memory').observe(time.perf_counter() - started_at)
+        return _fx_rates
+
+    cache_key = get_fx_rates_cache_key()
+    cached_rates = cache.get(cache_key)
+    # cache.add() works as a lock, so only one refresh is made while the rates are stale or expired
+    refresh_lock_key = f'{cache_key}:refreshing'
+    refresh_timeout = sum(FIXER_TIMEOUT) * (FIXER_MAX_RETRIES + 1)
+    if cached_rates is None or time.time() - cached_rates.fetched_at > FX_RATE_MAX_STALENESS:
+        last_rates = cached_rates or _fx_rates
+        if last_rates is None or cache.add(refresh_lock_key, True, timeout=refresh_timeout):
+            try:
+                fx_rates = refresh_fx_rates()
+                FX_RATE_LOOKUP_DURATION.labels(source='fetch').observe(time.perf_counter() - started_at)
+                return fx_rates
+            except FxRatesError:
+                if last_rates is None:
+                    raise
+        FX_RATE_LOOKUP_DURATION.labels(source='expired').observe(time.perf_counter() - started_at)
+        return last_rates
+
+    _fx_rates = cached_rates
+    is_stale = time.time() - cached_rates.fetched_at > FX_RATE_TTL
+    if is_stale and cache.add(refresh_lock_key, True, timeout=refresh_timeout):
+        from order.tasks import refresh_fx_rates_task
+        refresh_fx_rates_task.delay()
+    FX_RATE_LOOKUP_DURATION.labels(source='stale' if is_stale else 'cache').observe(time.perf_counter() - started_at)
+    return cached_rates
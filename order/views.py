@@ -1,11 +1,35 @@
-from django.core.exceptions import ValidationError
+import json
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.handlers.asgi import ASGIRequest
+from django.http import (
+    Http404, HttpResponse, HttpResponseNotAllowed, HttpResponseRedirect, JsonResponse, StreamingHttpResponse,
+)
+from django.shortcuts import render
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import add_never_cache_headers
+from django.utils.dateparse import parse_date, parse_datetime
 from django.views import generic
+from django.views.decorators.cache import never_cache
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST, require_http_methods
 
-from config.settings import SMALLEST_CURRENCY_UNIT_RATIO
-from order.service import ProjectStripeSession
-from order.forms import OrderForm
-from order.models import Order
-from order.tasks import set_payment_status_check_schedule, set_disabler_schedule
+from config.clients import get_stripe
+from config.settings import CHECKOUT_DEFERRED, QUOTE_MAX_CARTS, STRIPE_WEBHOOK_SECRET, SALES_REPORT_DEFAULT_DAYS
+from config.tracing import set_span_attributes
+from order.checkout import (
+    CHECKOUT_STATE_FIELDS, defer_checkout, get_checkout_state, iter_checkout_events, iter_checkout_events_sync,
+    save_order,
+)
+from order.service import ProjectStripeSession, AsyncProjectStripeSession
+from order.forms import OrderForm, OrderLineFormSet
+from order.models import Order, OrderLine
+from order.rollups import REPORT_PERIODS, get_sales_report
+from order.webhooks import handle_stripe_event
+from pricing.engine import Cart, PricingEngine, PricingError
 
 
 class CreateOrderView(generic.CreateView):
@@ -13,42 +37,311 @@ class CreateOrderView(generic.CreateView):
     form_class = OrderForm
     extra_context = {'page_title': 'Create Order'}
     template_name = 'order/create_order.html'
+    stripe_session_class = ProjectStripeSession
+    # whether the Checkout Session is created in the background (see order.checkout)
+    deferred_checkout = CHECKOUT_DEFERRED
+
+    def get_lines_formset(self) -> OrderLineFormSet:
+        """
+        Returns the formset of the order lines (item and quantity), bound to the request data on POST and PUT.
+        """
+        if self.request.method in ('POST', 'PUT'):
+            return OrderLineFormSet(data=self.request.POST)
+        return OrderLineFormSet()
+
+    def get_context_data(self, **kwargs):
+        kwargs.setdefault('lines_formset', self.get_lines_formset())
+        return super().get_context_data(**kwargs)
 
-    def get_success_url(self):
+    def post(self, request, *args, **kwargs):
         """
-        Sets the Stripe Checkout Session url as the successful url for the Order creating.
-        The url is collected from the self.request.session object.
+        Validates the order form and the order lines formset.
         """
-        return self.request.session.get('checkout_url')
+        self.object = None
+        form = self.get_form()
+        lines_formset = self.get_lines_formset()
+        if form.is_valid() and lines_formset.is_valid():
+            return self.form_valid(form, lines_formset)
+        return self.form_invalid(form, lines_formset)
+
+    def form_invalid(self, form, lines_formset=None):
+        return self.render_to_response(self.get_context_data(form=form, lines_formset=lines_formset))
 
-    def form_valid(self, form):
+    def get_project_stripe_session(self, form, order_lines: list[OrderLine]) -> ProjectStripeSession:
         """
-        Checks whether the form is valid, assigns the 'total_price', 'currency' fields values to the Order instance,
-        sets the schedule of the periodic task (set_payment_status_check_schedule) to monitor the payment_status of the
-        Stripe Checkout Session, and the schedule of the one-off task (set_disabler_schedule) to disable the
-        set_payment_status periodic task if the Order is paid of the payment expired (exp time - 30 minutes).
+        Returns the Stripe Checkout Session builder (self.stripe_session_class) of the order lines, tax and discount.
         """
-        self.object = form.save()
-        if form.is_valid():
-            items = form.cleaned_data.get('items', [])
-            discount = form.cleaned_data.get('discount', None)
-            tax = form.cleaned_data.get('tax', None)
+        return self.stripe_session_class(
+            items=[order_line.item for order_line in order_lines],
+            quantities={order_line.item_id: order_line.quantity for order_line in order_lines},
+            discount=form.cleaned_data.get('discount', None),
+            tax=form.cleaned_data.get('tax', None))
+
+    def form_valid(self, form, lines_formset=None):
+        """
+        Computes the order totals locally (pricing.engine.PricingEngine, the same way as Stripe computes the
+        Checkout Session's amount_total), creates the Stripe Checkout Session, and then saves the Order instance
+        with its 'total_price', 'currency', 'stripe_session_id', 'checkout_url' and 'session_expires_at' fields
+        and its order lines (order.OrderLine, with the items' quantities and price snapshots) at once
+        (see order.checkout.save_order). The user is redirected to the Checkout Session url.
+        The payment_status of the Order is updated by the Stripe webhook (stripe_webhook), and by the periodic
+        sweep_payment_statuses task as a fallback, the unpaid Order is set as 'expired' by the expire_orders task.
+        If the Stripe Checkout Session can't be created, nothing is saved. If the order can't be priced
+        (e.g. there are no currency rates of its items), the form is rendered again with the error.
+        If self.deferred_checkout is True, the order is saved at once, its Checkout Session is created by a celery task,
+        and the user is redirected to the waiting page (see order.checkout).
+        """
+        self.object = form.save(commit=False)
+        order_lines = lines_formset.get_order_lines(self.object)
+        project_stripe_obj = self.get_project_stripe_session(form, order_lines)
+        try:
+            quote = project_stripe_obj.quote()
+        except PricingError as e:
+            form.add_error(None, str(e))
+            return self.form_invalid(form, lines_formset)
+        if self.deferred_checkout:
+            defer_checkout(self.object, order_lines, quote)
+            return HttpResponseRedirect(reverse('order:checkout_page', args=[self.object.pk]))
+        stripe_session = project_stripe_obj.make_session()
+
+        self.object.total_price = quote.total
+        self.object.currency = quote.currency
+        self.object.stripe_session_id = stripe_session['id']
+        self.object.checkout_url = stripe_session['url']
+        self.object.session_expires_at = project_stripe_obj.expires_at
+        save_order(self.object, order_lines)
+        set_span_attributes(order_id=self.object.pk, stripe_session_id=stripe_session['id'])
+        return HttpResponseRedirect(stripe_session['url'])
+
+
+class AsyncCreateOrderView(CreateOrderView):
+    """
+    Async variant of the CreateOrderView view for ASGI. The event loop is not blocked, but every checkout holds
+    an executor thread while Stripe is being called (see order.service.AsyncProjectStripeSession).
+    The form is rendered and validated in a worker thread (it queries the database),
+    the Stripe Checkout Session is created by order.service.AsyncProjectStripeSession.
+    """
+    stripe_session_class = AsyncProjectStripeSession
+
+    async def get(self, request, *args, **kwargs):
+        return await sync_to_async(super().get)(request, *args, **kwargs)
+
+    async def post(self, request, *args, **kwargs):
+        """
+        Validates the form, creates the Stripe Checkout Session, saves the Order instance and its order lines
+        the same way as CreateOrderView.form_valid does, and redirects to the Checkout Session url
+        (or saves the order and redirects to the waiting page if self.deferred_checkout is True).
+        """
+        self.object = None
+        form = self.get_form()
+        lines_formset = self.get_lines_formset()
+        if not await sync_to_async(lambda: form.is_valid() and lines_formset.is_valid())():
+            return await sync_to_async(self.form_invalid)(form, lines_formset)
+
+        self.object = form.save(commit=False)
+        order_lines = lines_formset.get_order_lines(self.object)
+        project_stripe_obj = self.get_project_stripe_session(form, order_lines)
+        try:
+            quote = await sync_to_async(project_stripe_obj.quote)()
+        except PricingError as e:
+            form.add_error(None, str(e))
+            return await sync_to_async(self.form_invalid)(form, lines_formset)
+        if self.deferred_checkout:
+            await sync_to_async(defer_checkout)(self.object, order_lines, quote)
+            return HttpResponseRedirect(reverse('order:checkout_page', args=[self.object.pk]))
+        stripe_session = await project_stripe_obj.amake_session()
+
+        self.object.total_price = quote.total
+        self.object.currency = quote.currency
+        self.object.stripe_session_id = stripe_session['id']
+        self.object.checkout_url = stripe_session['url']
+        self.object.session_expires_at = project_stripe_obj.expires_at
+        await sync_to_async(save_order)(self.object, order_lines)
+        set_span_attributes(order_id=self.object.pk, stripe_session_id=stripe_session['id'])
+        return HttpResponseRedirect(stripe_session['url'])
+
+    async def put(self, *args, **kwargs):
+        return await self.post(*args, **kwargs)
+
+
+@require_GET
+def checkout_page(request, order_id):
+    """
+    The waiting page of a deferred checkout (see order.checkout): redirects the browser to the order's
+    Checkout Session url as soon as it is created, the url is received from the checkout_events stream.
+
+    :param request: HTTP request object.
+    :param order_id: id of the order.Order instance.
+    :return: a rendered HTML page, or a redirect to the Checkout Session url if it is already created.
+    """
+    values = Order.objects.filter(pk=order_id).values(*CHECKOUT_STATE_FIELDS).first()
+    if values is None:
+        raise Http404('No Order matches the given query.')
+    state = get_checkout_state(values)
+    if state['status'] == 'ready':
+        return HttpResponseRedirect(state['checkout_url'])
+    context = {'order_id': order_id, 'checkout_state': state, 'page_title': 'Checkout'}
+    return render(request, 'order/checkout.html', context)
+
+
+@never_cache
+@require_GET
+def checkout_status(request, order_id):
+    """
+    The checkout state of an order, for the clients polling it instead of listening to checkout_events.
+
+    :param request: HTTP request object.
+    :param order_id: id of the order.Order instance.
+    :return: a JSON response: {'status': 'pending' | 'ready' | 'failed', 'checkout_url': str, 'detail': str}.
+    """
+    values = Order.objects.filter(pk=order_id).values(*CHECKOUT_STATE_FIELDS).first()
+    if values is None:
+        raise Http404('No Order matches the given query.')
+    return JsonResponse(get_checkout_state(values))
+
+
+async def checkout_events(request, order_id):
+    """
+    Server-Sent Events stream of the checkout state of an order (see order.checkout.iter_checkout_events),
+    listened to by the waiting page. Waiting does not block a worker when the app is served under ASGI,
+    under WSGI the stream is a sync iterator (iter_checkout_events_sync) holding a worker thread.
+
+    :param request: HTTP request object.
+    :param order_id: id of the order.Order instance.
+    :return: a text/event-stream response.
+    """
+    # the django.views.decorators.http and cache decorators do not support async views in Django 4.2
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    if not await Order.objects.filter(pk=order_id).aexists():
+        raise Http404('No Order matches the given query.')
+    # Django streams the async iterators under ASGI only
+    events = iter_checkout_events(order_id) if isinstance(request, ASGIRequest) else iter_checkout_events_sync(order_id)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    # not buffered by the proxies
+    response['X-Accel-Buffering'] = 'no'
+    add_never_cache_headers(response)
+    return response
+
+
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    """
+    Stripe webhook endpoint. Verifies the event's signature with the STRIPE_WEBHOOK_SECRET,
+    and updates the payment status of the corresponding Order (see order.webhooks.handle_stripe_event).
+    Subscribed events: checkout.session.completed, checkout.session.expired,
+    checkout.session.async_payment_succeeded, checkout.session.async_payment_failed.
+
+    :param request: HTTP request object, sent by Stripe.
+    :return: an empty HTTP response, 400 if the payload or the signature is invalid,
+    503 if STRIPE_WEBHOOK_SECRET is not set.
+    """
+    if not STRIPE_WEBHOOK_SECRET:
+        # the events can't be verified, they are redelivered by Stripe once the secret is set
+        return HttpResponse('STRIPE_WEBHOOK_SECRET is not set', status=503)
+    stripe = get_stripe()
+    try:
+        event = stripe.Webhook.construct_event(
+            payload=request.body,
+            sig_header=request.headers.get('Stripe-Signature', ''),
+            secret=STRIPE_WEBHOOK_SECRET,
+        )
+    except (ValueError, stripe.error.SignatureVerificationError):
+        return HttpResponse(status=400)
+
+    set_span_attributes(stripe_event_type=event['type'], stripe_session_id=event['data']['object'].get('id'))
+    handle_stripe_event(event)
+    return HttpResponse(status=200)
+
+
+def parse_cart(data: dict) -> Cart:
+    """
+    Builds a pricing.engine.Cart from the 'items', 'tax' and 'discount' values of the request data.
+
+    :param data: a dict with a list of the item ids ('items'), and optional 'tax' and 'discount' ids.
+    """
+    try:
+        item_ids = [int(item_id) for item_id in data.get('items') or []]
+        tax_id = int(data['tax']) if data.get('tax') else None
+        discount_id = int(data['discount']) if data.get('discount') else None
+    except (TypeError, ValueError):
+        raise PricingError('Item, tax and discount ids must be integers')
+    return Cart(item_ids=item_ids, tax_id=tax_id, discount_id=discount_id)
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+def quote_order(request):
+    """
+    Returns the order totals computed locally by pricing.engine.PricingEngine, without creating a Checkout Session.
+    GET: quotes a single cart: ?items=1&items=2&tax=1&discount=1.
+    POST: quotes up to QUOTE_MAX_CARTS carts at once, the body is JSON:
+    {"carts": [{"items": [1, 2], "tax": 1, "discount": 1}, ...]}.
+
+    :param request: HTTP request object.
+    :return: a JSON response with the quote ({"currency", "subtotal", "discount", "tax", "total"}),
+    or with the list of quotes ({"quotes": [...]}) for a POST request. 400 if a cart is invalid.
+    """
+    try:
+        if request.method == 'POST':
+            try:
+                carts_data = json.loads(request.body)['carts']
+                if len(carts_data) > QUOTE_MAX_CARTS:
+                    raise PricingError(f'At most {QUOTE_MAX_CARTS} carts can be quoted at once')
+                carts = [parse_cart(cart) for cart in carts_data]
+            except (ValueError, KeyError, TypeError, AttributeError):
+                raise PricingError('The body must be JSON: {"carts": [{"items": [...], "tax": ..., "discount": ...}]}')
+            quotes = PricingEngine().quote_carts(carts)
+            return JsonResponse({'quotes': [quote._asdict() for quote in quotes]})
+
+        cart = parse_cart({
+            'items': request.GET.getlist('items'),
+            'tax': request.GET.get('tax'),
+            'discount': request.GET.get('discount'),
+        })
+        quote, = PricingEngine().quote_carts([cart])
+        return JsonResponse(quote._asdict())
+    except PricingError as e:
+        return JsonResponse({'detail': str(e)}, status=400)
+
+
+def parse_report_time(value: str):
+    """
+    Parses an ISO date or date-time GET parameter of the sales report, a date is the start of the day.
 
-            if items:
-                project_stripe_obj = ProjectStripeSession(
-                    items=items,
-                    discount=discount,
-                    tax=tax)
-                stripe_session = project_stripe_obj.make_session()
-                self.object.total_price = stripe_session['amount_total'] / SMALLEST_CURRENCY_UNIT_RATIO
-                self.object.currency = stripe_session['currency']
-                self.object.save()
+    :return: an aware datetime, None if the value is not a valid date or date-time.
+    """
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None and parse_date(value) is not None:
+            parsed = parse_datetime(f'{value}T00:00:00')
+    except ValueError:
+        return None
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
 
-                self.request.session['checkout_url'] = stripe_session['url']
 
-                set_payment_status_check_schedule.delay(order_id=self.object.pk, stripe_session_id=stripe_session['id'])
-                set_disabler_schedule.delay(order_id=self.object.pk)
+@staff_member_required
+@require_GET
+def sales_report(request):
+    """
+    Sales report for the staff dashboards: the paid orders count and revenue per period, currency, tax and discount.
+    Is read from the sales rollups (see order.rollups), so its cost does not depend on the number of orders.
 
-                return super().form_valid(form)
-            else:
-                ValidationError('Select items for your order')
+    :param request: HTTP request object, with the 'since' and 'until' (ISO dates or date-times, the last
+    SALES_REPORT_DEFAULT_DAYS days by default) and 'period' ('hour' or 'day', by default) GET parameters.
+    :return: a JSON response: {'refreshed_until': str, 'rows': [{'period', 'currency', 'tax_id', 'discount_id',
+    'orders_count', 'revenue'}, ...]}, 400 with {'detail': str} if the parameters are invalid.
+    """
+    now = timezone.now()
+    since = parse_report_time(request.GET['since']) if 'since' in request.GET else now - timedelta(
+        days=SALES_REPORT_DEFAULT_DAYS)
+    until = parse_report_time(request.GET['until']) if 'until' in request.GET else now
+    period = request.GET.get('period', 'day')
+    if since is None or until is None:
+        return JsonResponse({'detail': 'since and until must be ISO dates or date-times'}, status=400)
+    if period not in REPORT_PERIODS:
+        return JsonResponse({'detail': f'period must be one of {list(REPORT_PERIODS)}'}, status=400)
+    return JsonResponse(get_sales_report(since=since, until=until, period=period))
@@ -0,0 +1,38 @@
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+
+from order.models import Order, StripeEvent
+
+SESSION_PAID_EVENTS = ('checkout.session.completed', 'checkout.session.async_payment_succeeded')
+# the payment status an unpaid Order is set to on the other events
+SESSION_STATUS_EVENTS = {
+    'checkout.session.expired': 'expired',
+    'checkout.session.async_payment_failed': 'failed',
+}
+
+
+def handle_stripe_event(event) -> bool:
+    """
+    Applies a verified Stripe webhook event to the corresponding order.Order instance.
+    Each event is applied once: the processed events ids are stored as order.StripeEvent instances,
+    and the events redelivered by Stripe are skipped.
+    On checkout.session.completed / async_payment_succeeded events the Order is set as 'paid' if the session is paid,
+    on checkout.session.expired / async_payment_failed events an unpaid Order is set as 'expired' / 'failed'.
+    Other events are only recorded.
+
+    :param event: a stripe.Event instance.
+    :return: True if the event has been applied, False if it has been processed before.
+    """
+    stripe_session = event['data']['object']
+    try:
+        with transaction.atomic():
+            StripeEvent.objects.create(event_id=event['id'], type=event['type'])
+            if event['type'] in SESSION_PAID_EVENTS and stripe_session['payment_status'] == 'paid':
+                Order.objects.filter(stripe_session_id=stripe_session['id']).exclude(payment_status='paid').update(
+                    payment_status='paid', paid_at=timezone.now())
+            elif event['type'] in SESSION_STATUS_EVENTS:
+                Order.objects.filter(stripe_session_id=stripe_session['id'], payment_status='unpaid').update(
+                    payment_status=SESSION_STATUS_EVENTS[event['type']])
+    except IntegrityError:
+        return False
+    return True
@@ -1,18 +1,21 @@
 from django.contrib import admin
 
+from item.admin import IdSearchMixin
 from pricing.models.discount import Discount
 from pricing.models.tax import Tax
 
 
 @admin.register(Discount)
-class AdminDiscount(admin.ModelAdmin):
+class AdminDiscount(IdSearchMixin, admin.ModelAdmin):
     list_display = ('id', 'name', 'amount_off', 'percent_off')
     list_filter = ('amount_off', 'percent_off')
-    search_fields = ('id', 'name',)
+    search_fields = ('name',)
+    readonly_fields = ('stripe_coupon_ids',)
 
 
 @admin.register(Tax)
-class AdminTax(admin.ModelAdmin):
+class AdminTax(IdSearchMixin, admin.ModelAdmin):
     list_display = ('id', 'name', 'rate',)
     list_filter = ('rate',)
-    search_fields = ('id', 'name',)
+    search_fields = ('name',)
+    readonly_fields = ('stripe_tax_rate_id',)
@@ -0,0 +1,185 @@
+from collections import Counter
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+from functools import cached_property
+from typing import NamedTuple, Optional
+
+from config.settings import BASE_CURRENCY, SMALLEST_CURRENCY_UNIT_RATIO
+from item.models import Item
+from order.utils import FxRates, FxRatesError, get_fx_rates
+from pricing.models.discount import Discount
+from pricing.models.tax import Tax
+
+
+class PricingError(Exception):
+    pass
+
+
+class Cart(NamedTuple):
+    """
+    A cart to be quoted: the ids of its items (an id is repeated as many times as the item is bought),
+    and optional Tax and Discount ids.
+    """
+    item_ids: list[int]
+    tax_id: Optional[int] = None
+    discount_id: Optional[int] = None
+
+
+class Quote(NamedTuple):
+    """
+    The totals of a cart, in the cart's currency (in major units, e.g. euros).
+    """
+    currency: str
+    subtotal: Decimal
+    discount: Decimal
+    tax: Decimal
+    total: Decimal
+
+
+def round_half_up(amount: Decimal) -> int:
+    return int(amount.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def collapse_items(items: list[Item], quantities: dict[int, int] = None) -> tuple[list[Item], dict[int, int]]:
+    """
+    Collapses the cart's items into the distinct items and their quantities.
+
+    :param items: a list of item.Item instances, an item may be repeated.
+    :param quantities: the items' quantities by item.pk. If not passed, an item's quantity is its number in items.
+    :return: a tuple of the distinct items (in the order of their first occurrence) and their quantities by item.pk.
+    """
+    distinct_items = list({item.pk: item for item in items}.values())
+    if quantities is None:
+        quantities = Counter(item.pk for item in items)
+    return distinct_items, {item.pk: quantities[item.pk] for item in distinct_items}
+
+
+class PricingEngine:
+    """
+    A local pricing engine computing the order totals exactly the way the Stripe Checkout Session of
+    order.service.ProjectStripeSession computes them, without any Stripe API call:
+    - Items' prices are taken as int(item.price) in the smallest currency unit (item.service.get_unit_amount).
+    - If the items have different currencies, the prices are converted to self.base_curr (with the cross rates of
+      the fixer.io rate matrix, see order.utils.FxRates) and truncated to the smallest currency unit.
+    - The discount is applied to the subtotal: percent_off is rounded half up, amount_off is capped by the subtotal.
+    - There is one line per distinct item, its amount is the item's unit amount multiplied by the quantity.
+    - The tax is exclusive, and is computed per line on the line's share of the discounted subtotal.
+    All the amounts are computed with Decimal in the smallest currency unit.
+    The rates are looked up once per engine instance, and only if a mixed-currency cart is quoted.
+    """
+
+    def __init__(self, base_curr: str = BASE_CURRENCY):
+        """
+        Initializes a PricingEngine instance.
+
+        :param base_curr: the common currency of the mixed-currency carts.
+        """
+        self.base_curr = base_curr
+        self.smallest_cur_unit_ratio = SMALLEST_CURRENCY_UNIT_RATIO
+
+    @cached_property
+    def fx_rates(self) -> FxRates:
+        """
+        The latest rates of all the currencies, from the cached fixer.io rates.
+        """
+        try:
+            return get_fx_rates()
+        except FxRatesError as e:
+            raise PricingError(f'The currency rates are not available: {e}')
+
+    def get_unit_amount(self, item: Item, convert: bool = False) -> int:
+        """
+        Returns the item's price in the smallest currency unit.
+
+        :param item: an item.Item instance.
+        :param convert: whether the price is converted to self.base_curr (used for the mixed-currency carts).
+        """
+        unit_amount = Decimal(int(item.price) * self.smallest_cur_unit_ratio)
+        if convert and item.currency != self.base_curr.lower():
+            try:
+                rate = self.fx_rates.get_rate(item.currency, self.base_curr)
+            except FxRatesError as e:
+                raise PricingError(f"{item}'s price can't be converted to {self.base_curr}: {e}")
+            unit_amount = (unit_amount * rate).quantize(Decimal(1), rounding=ROUND_DOWN)
+        return int(unit_amount)
+
+    def quote(self, items: list[Item], tax: Tax = None, discount: Discount = None,
+              quantities: dict[int, int] = None) -> Quote:
+        """
+        Computes the totals of a single cart.
+
+        :param items: a list of item.Item instances, an item may be repeated (see collapse_items).
+        :param tax: a pricing.Tax instance.
+        :param discount: a pricing.Discount instance.
+        :param quantities: the items' quantities by item.pk.
+        :return: a Quote instance.
+        """
+        items, quantities = collapse_items(items, quantities)
+        if not items:
+            raise PricingError('The cart has no items')
+        if min(quantities.values()) < 1:
+            raise PricingError('The items quantities must be positive')
+        convert = len({item.currency for item in items}) > 1
+        currency = self.base_curr.lower() if convert else items[0].currency
+        line_amounts = [self.get_unit_amount(item, convert=convert) * quantities[item.pk] for item in items]
+        subtotal = sum(line_amounts)
+
+        discount_amount = 0
+        if discount is not None and discount.percent_off:
+            discount_amount = round_half_up(subtotal * Decimal(discount.percent_off) / 100)
+        elif discount is not None and discount.amount_off:
+            discount_amount = min(int(discount.amount_off) * self.smallest_cur_unit_ratio, subtotal)
+
+        tax_amount = 0
+        if tax is not None and subtotal:
+            # the discount is distributed over the lines proportionally, the last line takes the rounding remainder
+            allocated_discount = 0
+            for index, line_amount in enumerate(line_amounts):
+                if index == len(line_amounts) - 1:
+                    line_discount = discount_amount - allocated_discount
+                else:
+                    line_discount = round_half_up(Decimal(line_amount * discount_amount) / subtotal)
+                allocated_discount += line_discount
+                tax_amount += round_half_up((line_amount - line_discount) * Decimal(tax.rate) / 100)
+
+        total = subtotal - discount_amount + tax_amount
+        return Quote(
+            currency=currency,
+            subtotal=self.to_major_units(subtotal),
+            discount=self.to_major_units(discount_amount),
+            tax=self.to_major_units(tax_amount),
+            total=self.to_major_units(total),
+        )
+
+    def quote_carts(self, carts: list[Cart]) -> list[Quote]:
+        """
+        Computes the totals of many carts at once.
+        All the carts' items, taxes and discounts are loaded with one query per model.
+
+        :param carts: a list of Cart instances.
+        :return: a list of Quote instances, in the same order as the carts.
+        """
+        items = Item.objects.in_bulk({item_id for cart in carts for item_id in cart.item_ids})
+        taxes = Tax.objects.in_bulk({cart.tax_id for cart in carts if cart.tax_id is not None})
+        discounts = Discount.objects.in_bulk({cart.discount_id for cart in carts if cart.discount_id is not None})
+
+        quotes = []
+        for cart in carts:
+            missing_ids = [item_id for item_id in cart.item_ids if item_id not in items]
+            if missing_ids:
+                raise PricingError(f'Items {missing_ids} do not exist')
+            if cart.tax_id is not None and cart.tax_id not in taxes:
+                raise PricingError(f'Tax {cart.tax_id} does not exist')
+            if cart.discount_id is not None and cart.discount_id not in discounts:
+                raise PricingError(f'Discount {cart.discount_id} does not exist')
+            quotes.append(self.quote(
+                items=[items[item_id] for item_id in cart.item_ids],
+                tax=taxes.get(cart.tax_id),
+                discount=discounts.get(cart.discount_id),
+            ))
+        return quotes
+
+    def to_major_units(self, amount: int) -> Decimal:
+        """
+        Converts an amount in the smallest currency unit to the major units (e.g. cents to euros).
+        """
+        return (Decimal(amount) / self.smallest_cur_unit_ratio).quantize(Decimal('0.01'))
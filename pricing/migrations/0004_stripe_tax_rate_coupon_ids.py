@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-18 00:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pricing', '0003_alter_discount_percent_off'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discount',
+            name='stripe_coupon_ids',
+            field=models.JSONField(blank=True, default=dict, verbose_name='stripe_coupon_ids'),
+        ),
+        migrations.AddField(
+            model_name='tax',
+            name='stripe_tax_rate_id',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='stripe_tax_rate_id'),
+        ),
+    ]
@@ -8,6 +8,8 @@ class Discount(models.Model):
     name = models.CharField(verbose_name='discount_name', max_length=150, unique=True)
     amount_off = models.DecimalField(verbose_name='discount_amount', max_digits=10, decimal_places=2, **NULLABLE)
     percent_off = models.DecimalField(verbose_name='discount_percentage', max_digits=5, decimal_places=2, **NULLABLE)
+    # Stripe Coupon ids by currency (amount_off coupons are currency specific, percent_off coupons are stored by '')
+    stripe_coupon_ids = models.JSONField(verbose_name='stripe_coupon_ids', default=dict, blank=True)
 
     def __str__(self):
         return f'Discount "{self.name}"'
@@ -21,5 +23,14 @@ class Discount(models.Model):
             raise ValidationError('Either percent_off or amount_off should be specified, not both.')
 
     def save(self, *args, **kwargs):
+        """
+        Resets the stored Stripe Coupon ids if the discount's amount_off or percent_off has been changed,
+        so new Stripe Coupons are created on the next checkouts (Stripe Coupon amounts are immutable).
+        """
         self.clean()
+        if self.pk is not None and self.stripe_coupon_ids:
+            previous = Discount.objects.filter(pk=self.pk).values('amount_off', 'percent_off').first()
+            if previous is not None and (previous['amount_off'], previous['percent_off']) != (
+                    self.amount_off, self.percent_off):
+                self.stripe_coupon_ids = {}
         super().save(*args, **kwargs)
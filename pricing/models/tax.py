@@ -1,9 +1,12 @@
 from django.db import models
 
+from item.models import NULLABLE
+
 
 class Tax(models.Model):
     name = models.CharField(verbose_name='tax_name', max_length=150, unique=True)
     rate = models.DecimalField(verbose_name='tax_rate', max_digits=5, decimal_places=2)
+    stripe_tax_rate_id = models.CharField(verbose_name='stripe_tax_rate_id', max_length=255, **NULLABLE)
 
     def __str__(self):
         return f'Tax "{self.name}"'
@@ -11,3 +14,14 @@ class Tax(models.Model):
     class Meta:
         verbose_name = 'Tax'
         verbose_name_plural = 'Taxes'
+
+    def save(self, *args, **kwargs):
+        """
+        Resets the stored Stripe TaxRate id if the tax's name or rate has been changed,
+        so a new Stripe TaxRate is created on the next checkout (Stripe TaxRate percentage is immutable).
+        """
+        if self.pk is not None and self.stripe_tax_rate_id:
+            previous = Tax.objects.filter(pk=self.pk).values('name', 'rate').first()
+            if previous is not None and (previous['name'], previous['rate']) != (self.name, self.rate):
+                self.stripe_tax_rate_id = None
+        super().save(*args, **kwargs)
@@ -0,0 +1,74 @@
+from config.clients import get_stripe
+from config.settings import SMALLEST_CURRENCY_UNIT_RATIO
+from pricing.models.discount import Discount
+from pricing.models.tax import Tax
+
+
+def get_stripe_tax_rate_id(tax: Tax) -> str:
+    """
+    Returns the id of the Stripe TaxRate of the pricing.Tax instance.
+    The Stripe TaxRate is created once, on the first call, and its id is stored in the Tax.stripe_tax_rate_id field.
+    No transaction or row lock is held while Stripe is called: the concurrent calls create the TaxRate with the same
+    idempotency key (so they get the same one), and the id is stored only if the row still has no id and the same
+    name and rate (compare-and-set).
+    Stripe errors are propagated to the caller as stripe.error.StripeError.
+
+    :param tax: a pricing.Tax instance.
+    """
+    if tax.stripe_tax_rate_id:
+        return tax.stripe_tax_rate_id
+
+    stripe_tax = get_stripe().TaxRate.create(
+        percentage=tax.rate,
+        description=f'Tax {tax.name}',
+        display_name=f'Tax {tax.name}',
+        inclusive=False,
+        idempotency_key=f'tax-{tax.pk}-{tax.rate}-{tax.name}',
+    )
+    unchanged_tax = Tax.objects.filter(pk=tax.pk, name=tax.name, rate=tax.rate)
+    tax.stripe_tax_rate_id = stripe_tax['id']
+    if not unchanged_tax.filter(stripe_tax_rate_id__isnull=True).update(stripe_tax_rate_id=stripe_tax['id']):
+        # the id has been stored by a concurrent call, or the tax has been changed meanwhile (then the TaxRate
+        # created for the tax instance is used, and it is not stored)
+        tax.stripe_tax_rate_id = unchanged_tax.values_list('stripe_tax_rate_id', flat=True).first() or stripe_tax['id']
+    return tax.stripe_tax_rate_id
+
+
+def get_stripe_coupon_id(discount: Discount, currency: str) -> str:
+    """
+    Returns the id of the Stripe Coupon of the pricing.Discount instance.
+    The Stripe Coupon is created once per currency (amount_off coupons) or once at all (percent_off coupons),
+    and its id is stored in the Discount.stripe_coupon_ids field.
+    No transaction or row lock is held while Stripe is called: the concurrent calls create the Coupon with the same
+    idempotency key, and the ids are stored only if they have not been changed meanwhile (compare-and-set),
+    otherwise they are read again.
+    Stripe errors are propagated to the caller as stripe.error.StripeError.
+
+    :param discount: a pricing.Discount instance.
+    :param currency: the currency of the amount_off discount.
+    """
+    coupon_key = currency if discount.amount_off else ''
+    if coupon_key in discount.stripe_coupon_ids:
+        return discount.stripe_coupon_ids[coupon_key]
+
+    stripe_coupon = get_stripe().Coupon.create(
+        duration='once',
+        percent_off=discount.percent_off if discount.percent_off else None,
+        amount_off=int(discount.amount_off) * SMALLEST_CURRENCY_UNIT_RATIO if discount.amount_off else None,
+        currency=currency,
+        idempotency_key=f'discount-{discount.pk}-{currency}-{discount.amount_off}-{discount.percent_off}',
+    )
+    unchanged_discount = Discount.objects.filter(
+        pk=discount.pk, amount_off=discount.amount_off, percent_off=discount.percent_off)
+    coupon_ids = discount.stripe_coupon_ids
+    while coupon_key not in coupon_ids:
+        new_coupon_ids = {**coupon_ids, coupon_key: stripe_coupon['id']}
+        if unchanged_discount.filter(stripe_coupon_ids=coupon_ids).update(stripe_coupon_ids=new_coupon_ids):
+            coupon_ids = new_coupon_ids
+            break
+        coupon_ids = unchanged_discount.values_list('stripe_coupon_ids', flat=True).first()
+        if coupon_ids is None:
+            # the discount has been changed meanwhile, the Coupon created for the discount instance is not stored
+            return stripe_coupon['id']
+    discount.stripe_coupon_ids = coupon_ids
+    return discount.stripe_coupon_ids[coupon_key]
@@ -1,3 +1,186 @@
+from decimal import Decimal
+from unittest import mock
+
 from django.test import TestCase
 
-# Create your tests here.
+from benchmarks.fake_apis import FakeAPIServer
+from config.clients import get_stripe
+from item.models import Item
+from order.utils import FxRates
+from pricing.engine import Cart, PricingEngine, PricingError, Quote
+from pricing.models.discount import Discount
+from pricing.models.tax import Tax
+from pricing.service import get_stripe_coupon_id, get_stripe_tax_rate_id
+
+
+class PricingEngineTestCase(TestCase):
+    """
+    The totals of pricing.engine.PricingEngine, computed the way Stripe computes the Checkout Session's amount_total.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.items = Item.objects.bulk_create([
+            Item(name='Item A', description='Test item', price=Decimal('10.00'), currency='eur'),
+            Item(name='Item B', description='Test item', price=Decimal('15.00'), currency='eur'),
+            # the price is truncated to 3 euros, as in the synced Stripe Price
+            Item(name='Item C', description='Test item', price=Decimal('3.99'), currency='eur'),
+            Item(name='Item D', description='Test item', price=Decimal('1234.00'), currency='rub'),
+        ])
+        cls.tax = Tax.objects.create(name='VAT 20', rate=Decimal('20.00'))
+        cls.percent_discount = Discount.objects.create(name='12.5% off', percent_off=Decimal('12.50'))
+        cls.amount_discount = Discount.objects.create(name='5 off', amount_off=Decimal('5.00'))
+
+    def setUp(self):
+        self.engine = PricingEngine(base_curr='EUR')
+        self.engine.fx_rates = FxRates(base='EUR', rates={'EUR': Decimal(1), 'RUB': Decimal(100)}, fetched_at=0)
+
+    def test_quote(self):
+        item_a, item_b, item_c, _ = self.items
+        self.assertEqual(
+            self.engine.quote(items=[item_a, item_b, item_c, item_c]),
+            Quote(currency='eur', subtotal=Decimal('31.00'), discount=Decimal('0.00'), tax=Decimal('0.00'),
+                  total=Decimal('31.00')))
+        self.assertEqual(
+            self.engine.quote(items=[item_a, item_c], quantities={item_a.pk: 2, item_c.pk: 3}).subtotal,
+            Decimal('29.00'))
+
+    def test_percent_discount(self):
+        quote = self.engine.quote(items=self.items[:3], tax=self.tax, discount=self.percent_discount)
+        # 2800 cents -12.5% = 2450, the tax of the lines (875, 1312, 263 cents after the discount) is 175 + 262 + 53
+        self.assertEqual(quote, Quote(currency='eur', subtotal=Decimal('28.00'), discount=Decimal('3.50'),
+                                      tax=Decimal('4.90'), total=Decimal('29.40')))
+
+    def test_percent_discount_is_rounded_half_up(self):
+        discount = Discount.objects.create(name='7.5% off', percent_off=Decimal('7.50'))
+        item = Item.objects.create(name='Item E', description='Test item', price=Decimal(67), currency='eur')
+        # 502.5 cents
+        self.assertEqual(self.engine.quote(items=[item], discount=discount).discount, Decimal('5.03'))
+
+    def test_amount_discount(self):
+        quote = self.engine.quote(items=self.items[:3], tax=self.tax, discount=self.amount_discount)
+        # the discount is spread over the lines as 179, 268 and 53 cents, the lines' tax is 164 + 246 + 49 cents,
+        # one cent less than the tax of the discounted subtotal (460 cents)
+        self.assertEqual(quote, Quote(currency='eur', subtotal=Decimal('28.00'), discount=Decimal('5.00'),
+                                      tax=Decimal('4.59'), total=Decimal('27.59')))
+
+    def test_amount_discount_is_capped_by_subtotal(self):
+        discount = Discount.objects.create(name='50 off', amount_off=Decimal('50.00'))
+        quote = self.engine.quote(items=self.items[:3], tax=self.tax, discount=discount)
+        self.assertEqual((quote.discount, quote.tax, quote.total), (Decimal('28.00'), Decimal('0.00'), Decimal('0.00')))
+
+    def test_mixed_currency_cart(self):
+        item_a, _, _, item_d = self.items
+        # 1234 rubles are 1234 euro cents
+        self.assertEqual(self.engine.quote(items=[item_a, item_d]).total, Decimal('22.34'))
+        self.assertEqual(self.engine.quote(items=[item_a, item_d]).currency, 'eur')
+
+    def test_single_currency_cart_is_not_converted(self):
+        with mock.patch('pricing.engine.get_fx_rates') as get_fx_rates:
+            quote = PricingEngine(base_curr='EUR').quote(items=[self.items[3]])
+        get_fx_rates.assert_not_called()
+        self.assertEqual((quote.currency, quote.total), ('rub', Decimal('1234.00')))
+
+    def test_invalid_carts(self):
+        with self.assertRaisesMessage(PricingError, 'The cart has no items'):
+            self.engine.quote(items=[])
+        with self.assertRaisesMessage(PricingError, 'The items quantities must be positive'):
+            self.engine.quote(items=[self.items[0]], quantities={self.items[0].pk: 0})
+
+    def test_quote_carts(self):
+        item_a, item_b, item_c, _ = self.items
+        carts = [
+            Cart(item_ids=[item_a.pk, item_b.pk, item_c.pk], tax_id=self.tax.pk, discount_id=self.percent_discount.pk),
+            Cart(item_ids=[item_a.pk, item_a.pk]),
+        ]
+        # the items, the taxes and the discounts
+        with self.assertNumQueries(3):
+            quotes = self.engine.quote_carts(carts)
+        self.assertEqual([quote.total for quote in quotes], [Decimal('29.40'), Decimal('20.00')])
+
+    def test_quote_carts_unknown_ids(self):
+        item_id = self.items[0].pk
+        for cart, message in [
+            (Cart(item_ids=[item_id, 0]), 'Items [0] do not exist'),
+            (Cart(item_ids=[item_id], tax_id=0), 'Tax 0 does not exist'),
+            (Cart(item_ids=[item_id], discount_id=0), 'Discount 0 does not exist'),
+        ]:
+            with self.subTest(cart=cart), self.assertRaisesMessage(PricingError, message):
+                self.engine.quote_carts([cart])
+
+
+class StripePricingObjectsTestCase(TestCase):
+    """
+    The Stripe TaxRates and Coupons of the taxes and discounts (pricing.service), created against a fake Stripe API
+    without holding a lock, and stored with a compare-and-set.
+    """
+
+    def setUp(self):
+        stripe = get_stripe()
+        self.fake_api = FakeAPIServer().__enter__()
+        self.addCleanup(self.fake_api.__exit__, None, None, None)
+        for patcher in [mock.patch.object(stripe, 'api_base', self.fake_api.url),
+                        mock.patch.object(stripe, 'api_key', 'sk_test_pricing')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.tax = Tax.objects.create(name='VAT 20', rate=Decimal('20.00'))
+        self.discount = Discount.objects.create(name='5 off', amount_off=Decimal('5.00'))
+
+    def test_tax_rate(self):
+        self.assertEqual(get_stripe_tax_rate_id(self.tax), 'txr_fake1')
+        self.assertEqual(get_stripe_tax_rate_id(Tax.objects.get(pk=self.tax.pk)), 'txr_fake1')
+        self.assertEqual(self.fake_api.reset_calls(), {'tax_rate_create': 1})
+        self.assertEqual(self.fake_api.idempotency_keys, [f'tax-{self.tax.pk}-20.00-VAT 20'])
+
+    def test_tax_rate_stored_concurrently(self):
+        stripe = get_stripe()
+        create_tax_rate = stripe.TaxRate.create
+
+        def create_tax_rate_while_stored_concurrently(**params):
+            Tax.objects.filter(pk=self.tax.pk).update(stripe_tax_rate_id='txr_concurrent')
+            return create_tax_rate(**params)
+
+        with mock.patch.object(stripe.TaxRate, 'create', side_effect=create_tax_rate_while_stored_concurrently):
+            self.assertEqual(get_stripe_tax_rate_id(self.tax), 'txr_concurrent')
+        self.assertEqual(Tax.objects.get(pk=self.tax.pk).stripe_tax_rate_id, 'txr_concurrent')
+
+    def test_tax_changed_meanwhile(self):
+        stripe = get_stripe()
+        create_tax_rate = stripe.TaxRate.create
+
+        def create_tax_rate_while_changed(**params):
+            Tax.objects.filter(pk=self.tax.pk).update(rate=Decimal('10.00'))
+            return create_tax_rate(**params)
+
+        with mock.patch.object(stripe.TaxRate, 'create', side_effect=create_tax_rate_while_changed):
+            self.assertEqual(get_stripe_tax_rate_id(self.tax), 'txr_fake1')
+        # the TaxRate of the 20% rate is not stored for the changed tax
+        self.assertIsNone(Tax.objects.get(pk=self.tax.pk).stripe_tax_rate_id)
+
+    def test_coupons(self):
+        self.assertEqual(get_stripe_coupon_id(self.discount, 'eur'), 'coupon_fake1')
+        self.assertEqual(get_stripe_coupon_id(self.discount, 'rub'), 'coupon_fake2')
+        self.assertEqual(get_stripe_coupon_id(Discount.objects.get(pk=self.discount.pk), 'eur'), 'coupon_fake1')
+        self.assertEqual(self.fake_api.reset_calls(), {'coupon_create': 2})
+        self.assertEqual(Discount.objects.get(pk=self.discount.pk).stripe_coupon_ids,
+                         {'eur': 'coupon_fake1', 'rub': 'coupon_fake2'})
+
+        # a percent_off coupon is the same in all the currencies
+        percent_discount = Discount.objects.create(name='10% off', percent_off=Decimal('10.00'))
+        self.assertEqual(get_stripe_coupon_id(percent_discount, 'eur'), 'coupon_fake3')
+        self.assertEqual(get_stripe_coupon_id(percent_discount, 'rub'), 'coupon_fake3')
+        self.assertEqual(self.fake_api.reset_calls(), {'coupon_create': 1})
+
+    def test_coupon_stored_concurrently(self):
+        stripe = get_stripe()
+        create_coupon = stripe.Coupon.create
+
+        def create_coupon_while_stored_concurrently(**params):
+            Discount.objects.filter(pk=self.discount.pk).update(stripe_coupon_ids={'rub': 'coupon_concurrent'})
+            return create_coupon(**params)
+
+        with mock.patch.object(stripe.Coupon, 'create', side_effect=create_coupon_while_stored_concurrently):
+            self.assertEqual(get_stripe_coupon_id(self.discount, 'eur'), 'coupon_fake1')
+        # the concurrently stored coupon is kept
+        self.assertEqual(Discount.objects.get(pk=self.discount.pk).stripe_coupon_ids,
+                         {'rub': 'coupon_concurrent', 'eur': 'coupon_fake1'})